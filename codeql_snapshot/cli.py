@@ -1,6 +1,8 @@
 import click
 from sqlalchemy import create_engine, text
 from minio import Minio
+from datetime import timedelta
+import urllib3
 from typing import Optional, List, Any
 from pathlib import Path
 from alembic import config, script
@@ -14,6 +16,12 @@ if not __package__ and __name__ == "__main__":
     sys.path.append(str(Path(__file__).parent.parent))
     __package__ = Path(__file__).parent.name
 
+from codeql_snapshot.helpers.transfer import TransferOptions, DEFAULT_PART_SIZE, DEFAULT_CONCURRENCY
+from codeql_snapshot.helpers.archive import ArchiveFormat, SOURCE_CODECS, DATABASE_CODECS
+from codeql_snapshot.helpers.cache import ObjectCache
+from codeql_snapshot.helpers.codeql import CliServerPool
+from codeql_snapshot.helpers.compilation_cache import CompilationCache
+
 root_directory: Path = Path(__file__).parent
 commands_directory: Path = Path(__file__).parent / "commands"
 
@@ -40,6 +48,17 @@ class LazyMultiCommand(click.MultiCommand):
         return command
 
 
+def parse_archive_format(
+    ctx: click.Context, param: click.Parameter, value: str
+) -> ArchiveFormat:
+    try:
+        format = ArchiveFormat.parse(value)
+        format.validate(DATABASE_CODECS if param.name == "database_compression" else SOURCE_CODECS)
+        return format
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 @click.command(cls=LazyMultiCommand)
 @click.option(
     "--connection-string",
@@ -64,6 +83,57 @@ class LazyMultiCommand(click.MultiCommand):
 @click.option("--storage-source-bucket", default="sources")
 @click.option("--storage-database-bucket", default="databases")
 @click.option("--storage-sarif-bucket", default="sarifs")
+@click.option(
+    "--storage-part-size",
+    type=click.IntRange(min=5),
+    default=DEFAULT_PART_SIZE // (1024 * 1024),
+    help="Size in MiB of the parts in which objects are uploaded and downloaded.",
+)
+@click.option(
+    "--storage-concurrency",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONCURRENCY,
+    help="Number of parts of a single object that are uploaded or downloaded concurrently.",
+)
+@click.option(
+    "--source-compression",
+    default="deflate",
+    callback=parse_archive_format,
+    help=f"Codec used for new source archives, optionally followed by a level, e.g. deflate:9 or zstd:19. One of {', '.join(SOURCE_CODECS)}, where manifest stores each file once across all sources.",
+)
+@click.option(
+    "--database-compression",
+    default="bundle",
+    callback=parse_archive_format,
+    help=f"Codec used for new database archives, optionally followed by a level. One of {', '.join(DATABASE_CODECS)}, where bundle uses codeql database bundle.",
+)
+@click.option(
+    "--cache-directory",
+    type=click.Path(path_type=Path, file_okay=False),
+    help="Directory in which downloaded objects are kept, so later jobs on the same node can skip the download. Can be shared by multiple workers.",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    default=20,
+    help="Size in GiB above which the least recently used objects are evicted from the cache directory.",
+)
+@click.option(
+    "--compilation-cache-directory",
+    type=click.Path(path_type=Path, file_okay=False),
+    help="Directory in which compiled queries are kept per CodeQL version and query packs, so later analyses on the same node can skip compiling them. Can be shared by multiple workers.",
+)
+@click.option(
+    "--compilation-cache-size",
+    type=click.IntRange(min=1),
+    default=5,
+    help="Size in GiB above which the compiled queries of the least recently used CodeQL version and query packs are removed from the compilation cache directory.",
+)
+@click.option(
+    "--codeql-cli-server",
+    is_flag=True,
+    help="Run CodeQL commands on long-lived CodeQL CLI servers, instead of starting CodeQL and its JVM for every command.",
+)
 @click.pass_context
 def multicommand(
     ctx: click.Context,
@@ -74,6 +144,15 @@ def multicommand(
     storage_source_bucket: str,
     storage_database_bucket: str,
     storage_sarif_bucket: str,
+    storage_part_size: int,
+    storage_concurrency: int,
+    source_compression: ArchiveFormat,
+    database_compression: ArchiveFormat,
+    cache_directory: Optional[Path],
+    cache_size: int,
+    compilation_cache_directory: Optional[Path],
+    compilation_cache_size: int,
+    codeql_cli_server: bool,
 ):
     ctx.ensure_object(dict)
 
@@ -83,6 +162,17 @@ def multicommand(
         access_key=storage_access_key,
         secret_key=storage_secret_key,
         secure=False,
+        # Same as the default client, but with enough connections for concurrent part transfers of concurrent jobs.
+        http_client=urllib3.PoolManager(
+            timeout=urllib3.util.Timeout(
+                connect=timedelta(minutes=5).seconds,
+                read=timedelta(minutes=5).seconds,
+            ),
+            maxsize=max(10, storage_concurrency * 2),
+            retries=urllib3.Retry(
+                total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]
+            ),
+        ),
     )
     ctx.obj["storage"] = {
         "client": storage_client,
@@ -91,7 +181,23 @@ def multicommand(
             "database": storage_database_bucket,
             "sarif": storage_sarif_bucket,
         },
+        "transfer": TransferOptions(
+            part_size=storage_part_size * 1024 * 1024,
+            concurrency=storage_concurrency,
+        ),
+        # Only used when creating objects, readers use the format recorded on the object.
+        "formats": {
+            "source": source_compression,
+            "database": database_compression,
+        },
+        "cache": ObjectCache(cache_directory, cache_size * 1024 * 1024 * 1024) if cache_directory else None,
+    }
+    ctx.obj["codeql"] = {
+        "servers": CliServerPool() if codeql_cli_server else None,
+        "compilation_cache": CompilationCache(compilation_cache_directory, compilation_cache_size * 1024 * 1024 * 1024) if compilation_cache_directory else None,
     }
+    if ctx.obj["codeql"]["servers"]:
+        ctx.call_on_close(ctx.obj["codeql"]["servers"].close)
 
     if ctx.invoked_subcommand != "init":
         alembic_config_path = (root_directory / "alembic.ini").absolute()
@@ -1,6 +1,6 @@
 import click
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 from subprocess import run
 from sqlalchemy import Engine, select
 from sqlalchemy.orm import Session
@@ -25,6 +25,26 @@ from codeql_snapshot.helpers.object_store import has_source_object, create_sourc
 )
 @click.option("--category")
 @click.option("--label")
+@click.option(
+    "--priority",
+    type=int,
+    help="Snapshots with a higher priority are built and analyzed first. Defaults to 0 for new snapshots.",
+)
+@click.option(
+    "--exclude",
+    multiple=True,
+    help="Glob pattern of files and directories to leave out of the source archive. Patterns without a slash match at any depth. Can be repeated.",
+)
+@click.option(
+    "--gitignore",
+    is_flag=True,
+    help="Leave the .git directory and the files ignored by git out of the source archive.",
+)
+@click.option(
+    "--git-archive",
+    is_flag=True,
+    help="Archive the files tracked in the snapshot commit from the git object database instead of the working tree.",
+)
 @click.argument(
     "source-root", type=click.Path(exists=True, path_type=Path, file_okay=False)
 )
@@ -37,6 +57,10 @@ def command(
     language: str,
     category: Optional[str],
     label: Optional[str],
+    priority: Optional[int],
+    exclude: Tuple[str, ...],
+    gitignore: bool,
+    git_archive: bool,
     source_root: Path,
 ):
     if project_url == None:
@@ -60,6 +84,20 @@ def command(
     if not source_root.is_dir():
         raise click.exceptions.UsageError("Provided source root is not a directory!")
 
+    if git_archive and gitignore:
+        raise click.exceptions.UsageError("Cannot use both gitignore and git-archive!")
+
+    if (git_archive or gitignore) and not (source_root / ".git").exists():
+        raise click.exceptions.UsageError(
+            "Provided source root is not the root of a git repository!"
+        )
+
+    source_options = {
+        "exclude": exclude,
+        "gitignore": gitignore,
+        "commit": commit if git_archive else None,
+    }
+
     database_engine: Engine = ctx.obj["database"]["engine"]
 
     with Session(database_engine) as session, session.begin():
@@ -70,9 +108,13 @@ def command(
             .where(Snapshot.commit == commit)
             .where(Snapshot.language == SnapshotLanguage[language.upper()])
             .where(Snapshot.category == category)
+            # Wait for a purge of the snapshot in progress, which removes the snapshot together with its source object.
+            .with_for_update()
         )
         existing_snapshot = session.scalar(stmt)
         if existing_snapshot:
+            if priority != None:
+                existing_snapshot.priority = priority
             if existing_snapshot.state == SnapshotState.BUILD_FAILED:
                 click.echo(
                     f"Snapshot in state {existing_snapshot.state.name}. Resetting state to {SnapshotState.NOT_BUILT.name} to retry."
@@ -89,7 +131,15 @@ def command(
                         f"Snapshot in state {existing_snapshot.state.name} and is missing a source object. Resetting state to {SnapshotState.NOT_BUILT.name}."
                     )
                     existing_snapshot.state = SnapshotState.NOT_BUILT
-            elif existing_snapshot.state == SnapshotState.NOT_BUILT:
+            elif existing_snapshot.state in [
+                SnapshotState.NOT_BUILT,
+                SnapshotState.DELETED,
+            ]:
+                if existing_snapshot.state == SnapshotState.DELETED:
+                    click.echo(
+                        f"Snapshot exist in state {existing_snapshot.state.name}. Restoring it in state {SnapshotState.NOT_BUILT.name}."
+                    )
+                    existing_snapshot.state = SnapshotState.NOT_BUILT
                 if not has_source_object(ctx, existing_snapshot.source_id):
                     click.echo(
                         f"Snapshot exist in state {SnapshotState.NOT_BUILT.name}, but is missing a source object. Retrying to add source object."
@@ -100,6 +150,7 @@ def command(
                             ctx,
                             existing_snapshot.source_id,
                             source_root,
+                            **source_options,
                         )
                     except S3Error as err:
                         click.echo(
@@ -110,7 +161,7 @@ def command(
                         click.echo(
                             f"Failed to create source archive with error {err}! Adding snapshot with state {SnapshotState.SNAPSHOT_FAILED}"
                         )
-                    existing_snapshot.state = SnapshotState.SNAPSHOT_FAILED
+                        existing_snapshot.state = SnapshotState.SNAPSHOT_FAILED
             elif existing_snapshot.state == SnapshotState.SNAPSHOT_FAILED:
                 click.echo(
                     f"Snapshot exist in state {existing_snapshot.state.name}. Resetting to {SnapshotState.NOT_BUILT.name} to retry."
@@ -128,13 +179,16 @@ def command(
                 language=SnapshotLanguage[language.upper()],
                 category=category,
                 label=label,
+                priority=priority or 0,
             )
             # Add and commit the new snapshot first so the global id is generated.
             with session.begin_nested():
                 session.add(new_snapshot)
             try:
                 if not has_source_object(ctx, new_snapshot.source_id):
-                    create_source_object(ctx, new_snapshot.source_id, source_root)
+                    create_source_object(
+                        ctx, new_snapshot.source_id, source_root, **source_options
+                    )
             except S3Error as err:
                 click.echo(
                     f"Failed to create source object with error '{err}'! Adding snapshot with state {SnapshotState.SNAPSHOT_FAILED}"
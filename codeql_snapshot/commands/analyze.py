@@ -1,85 +1,60 @@
 import click
-from sqlalchemy import Engine, select
-from sqlalchemy.orm import Session
-from typing import Optional, List
-from codeql_snapshot.helpers.codeql import CodeQL, CodeQLException
-from codeql_snapshot.helpers.object_store import (
-    has_database_object,
-    get_database_object,
-    create_sarif_object,
-)
-from codeql_snapshot.models.snapshot import Snapshot, SnapshotState
-from tempfile import TemporaryDirectory
-from pathlib import Path
+from datetime import timedelta
+from typing import Optional
+from codeql_snapshot.helpers.jobs import AnalysisJobRunner, run_in_parallel, resource_budget
 
 
 @click.command(name="analyze")
 @click.option("-s", "--snapshot-global-id")
 @click.option("-r", "--retry", is_flag=True)
 @click.option("-l", "--label")
+@click.option(
+    "-b",
+    "--batch",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Maximum number of snapshots to claim in a single transaction.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of snapshots to process concurrently, dividing the available cores and memory between them.",
+)
+@click.option(
+    "--lease-duration",
+    type=click.IntRange(min=1),
+    default=300,
+    help="Number of seconds a claimed snapshot is leased. The lease is renewed while the snapshot is being processed and snapshots with an expired lease can be claimed by other workers.",
+)
+@click.option(
+    "--timeout",
+    type=click.IntRange(min=1),
+    help="Maximum number of seconds a single CodeQL or custom build command is allowed to run.",
+)
+@click.option(
+    "--fair-share",
+    is_flag=True,
+    help="Spread claimed snapshots across projects instead of strictly following the snapshot priority.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Analyze snapshots even if their database, the CodeQL version and the query packs are unchanged since their last analysis.",
+)
 @click.pass_context
-def command(ctx: click.Context, snapshot_global_id: Optional[str], retry: bool, label: Optional[str]) -> None:
-    database_engine: Engine = ctx.obj["database"]["engine"]
-
-    global_id: Optional[str] = None
-    category: Optional[str] = None
-    with Session(database_engine) as session, session.begin():
-        stmt = select(Snapshot).where(Snapshot.label == label)
-
-        if snapshot_global_id:
-            stmt = stmt.where(
-                Snapshot.global_id == snapshot_global_id
-            ).with_for_update()
-        else:
-            stmt = stmt.limit(1).with_for_update(skip_locked=True)
-
-        if retry:
-            stmt = stmt.where(Snapshot.state == SnapshotState.ANALYSIS_FAILED)
-        else:
-            stmt = stmt.where(Snapshot.state == SnapshotState.NOT_ANALYZED)
-
-        snapshot = session.scalar(stmt)
-        if snapshot:
-            snapshot.state = SnapshotState.ANALYSIS_IN_PROGRESS
-            global_id = snapshot.global_id
-            category = snapshot.category
-
-    if global_id:
-        if has_database_object(ctx, global_id):
-            with TemporaryDirectory() as tmpdir:
-                tmpzip = (Path(tmpdir) / global_id).with_suffix(".zip")
-
-                get_database_object(ctx, global_id, tmpzip)
-
-                try:
-                    codeql = CodeQL()
-
-                    codeql.database_unbundle(tmpzip)
-                    database_path = tmpzip.with_suffix("")
-                    sarif_path = database_path.with_suffix(".sarif")
-
-                    if category:
-                        codeql.database_analyze(database_path, sarif_path, **{"sarif-category": category})
-                    else:
-                        codeql.database_analyze(database_path, sarif_path)
-                    create_sarif_object(ctx, global_id, sarif_path)
-
-                    newstate = SnapshotState.ANALYZED
-                except CodeQLException as e:
-                    newstate = SnapshotState.ANALYSIS_FAILED
-                    click.echo(f"Failed to create database with error {e}")
-            with Session(database_engine) as session, session.begin():
-                stmt = (
-                    select(Snapshot)
-                    .where(Snapshot.global_id == global_id)
-                    .with_for_update()
-                )
-                snapshot = session.scalar(stmt)
-                if snapshot:
-                    snapshot.state = newstate
-                else:
-                    click.echo(
-                        f"Could not find snapshot to update state from {SnapshotState.ANALYSIS_IN_PROGRESS} to {newstate}!"
-                    )
-    else:
+def command(ctx: click.Context, snapshot_global_id: Optional[str], retry: bool, label: Optional[str], batch: int, jobs: int, lease_duration: int, timeout: Optional[int], fair_share: bool, force: bool) -> None:
+    resources = resource_budget(jobs, ctx.obj["storage"]["transfer"].buffer_size()) if jobs > 1 else None
+    runner = AnalysisJobRunner(
+        ctx,
+        force,
+        resources=resources,
+        lease_duration=timedelta(seconds=lease_duration),
+        timeout=timeout,
+        fair_share=fair_share,
+    )
+    claimed_jobs = runner.claim(label, retry, snapshot_global_id, max(batch, jobs))
+    run_in_parallel(claimed_jobs, runner.run, jobs)
+    if not claimed_jobs:
         click.echo("No snapshot requiring analysis!")
@@ -1,21 +1,7 @@
 import click
-from sqlalchemy import select
-from sqlalchemy.engine.base import Engine
-from sqlalchemy.orm import Session
-from typing import Optional, List
-from codeql_snapshot.models import Snapshot, SnapshotState
-from codeql_snapshot.helpers.object_store import (
-    has_source_object,
-    get_source_object,
-    create_database_object,
-)
-from codeql_snapshot.helpers.zip import zipdir
-from codeql_snapshot.helpers.codeql import CodeQL, CodeQLException
-from tempfile import TemporaryDirectory
-from pathlib import Path
-from zipfile import ZipFile
-from subprocess import run
-import shlex
+from datetime import timedelta
+from typing import Optional
+from codeql_snapshot.helpers.jobs import BuildJobRunner, ClusterBuildJobRunner, run_in_parallel, resource_budget
 
 
 @click.command(name="build")
@@ -24,6 +10,52 @@ import shlex
 @click.option("-x", "--exec")
 @click.option("-r", "--retry", is_flag=True)
 @click.option("-l", "--label")
+@click.option(
+    "-b",
+    "--batch",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Maximum number of snapshots to claim in a single transaction.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of snapshots to process concurrently, dividing the available cores and memory between them.",
+)
+@click.option(
+    "-a",
+    "--analyze",
+    is_flag=True,
+    help="Analyze the database right after building it instead of leaving it for the analyze command.",
+)
+@click.option(
+    "--lease-duration",
+    type=click.IntRange(min=1),
+    default=300,
+    help="Number of seconds a claimed snapshot is leased. The lease is renewed while the snapshot is being processed and snapshots with an expired lease can be claimed by other workers.",
+)
+@click.option(
+    "--timeout",
+    type=click.IntRange(min=1),
+    help="Maximum number of seconds a single CodeQL or custom build command is allowed to run.",
+)
+@click.option(
+    "--fair-share",
+    is_flag=True,
+    help="Spread claimed snapshots across projects instead of strictly following the snapshot priority.",
+)
+@click.option(
+    "--no-reuse",
+    is_flag=True,
+    help="Always build a new database, instead of reusing the database of a snapshot of the same commit, language and category built with the same command.",
+)
+@click.option(
+    "--db-cluster",
+    is_flag=True,
+    help="Claim the snapshots of all languages of a source together and build their databases with a single CodeQL database cluster run, extracting the source once.",
+)
 @click.pass_context
 def command(
     ctx: click.Context,
@@ -32,111 +64,35 @@ def command(
     exec: Optional[str],
     retry: bool,
     label: Optional[str],
+    batch: int,
+    jobs: int,
+    analyze: bool,
+    lease_duration: int,
+    timeout: Optional[int],
+    fair_share: bool,
+    no_reuse: bool,
+    db_cluster: bool,
 ):
 
     if command and exec:
         raise click.exceptions.UsageError("Cannot use both command and exec!")
-
-    database_engine: Engine = ctx.obj["database"]["engine"]
-
-    global_id: Optional[str] = None
-    source_id: Optional[str] = None
-    language: Optional[str] = None
-    with Session(database_engine) as session, session.begin():
-
-        stmt = select(Snapshot).where(Snapshot.label == label)
-
-        if snapshot_global_id:
-            stmt = stmt.where(
-                Snapshot.global_id == snapshot_global_id
-            ).with_for_update()
-        else:
-            stmt = stmt.limit(1).with_for_update(skip_locked=True)
-
-        if retry:
-            stmt = stmt.where(Snapshot.state == SnapshotState.BUILD_FAILED)
-        else:
-            stmt = stmt.where(Snapshot.state == SnapshotState.NOT_BUILT)
-
-        snapshot = session.scalar(stmt)
-        if snapshot:
-            snapshot.state = SnapshotState.BUILD_IN_PROGRESS
-
-            global_id = snapshot.global_id
-            source_id = snapshot.source_id
-            language = snapshot.language.value
-
-    if global_id and source_id and language:
-        if has_source_object(ctx, source_id):
-            with TemporaryDirectory() as tmpdir:
-                tmpzip = (Path(tmpdir) / source_id).with_suffix(".zip")
-
-                get_source_object(ctx, source_id, tmpzip)
-
-                tmp_source_root: Path = Path(tmpdir) / source_id
-                tmp_source_root.mkdir()
-
-                with ZipFile(str(tmpzip)) as zipfile:
-                    zipfile.extractall(tmp_source_root)
-
-                database_path = Path(tmpdir, f"{global_id}-db")
-                codeql = CodeQL()
-                try:
-                    if command:
-                        codeql.database_create(
-                            language,
-                            tmp_source_root,
-                            database_path,
-                            command=command,
-                        )
-                    elif exec:
-                        args = shlex.split(exec) + [
-                            language,
-                            str(tmp_source_root),
-                            str(database_path),
-                        ]
-
-                        try:
-                            cp = run(args)
-                            if cp.returncode != 0:
-                                raise CodeQLException("custom build execution failed!")
-                        except OSError as e:
-                            raise CodeQLException(
-                                f"Failed to execute custom build command with error: {e.strerror}!"
-                            )
-                    else:
-                        codeql.database_create(language, tmp_source_root, database_path)
-
-                    bundle_path = codeql.database_bundle(database_path)
-                    create_database_object(ctx, global_id, bundle_path)
-                    newstate = SnapshotState.NOT_ANALYZED
-                except CodeQLException as e:
-                    if database_path.exists():
-                        zipped_database_path = database_path.with_suffix(".zip")
-                        zipdir(database_path, zipped_database_path)
-                        create_database_object(ctx, global_id, zipped_database_path)
-
-                    newstate = SnapshotState.BUILD_FAILED
-
-                    click.echo(f"Failed to create database with error {e}")
-
-        else:
-            newstate = SnapshotState.SNAPSHOT_FAILED
-
-        with Session(database_engine) as session, session.begin():
-
-            stmt = (
-                select(Snapshot)
-                .where(Snapshot.global_id == global_id)
-                .with_for_update()
-            )
-
-            snapshot = session.scalar(stmt)
-            if snapshot:
-                snapshot.state = newstate
-            else:
-                click.echo(
-                    f"Could not find snapshot to update state from {SnapshotState.BUILD_IN_PROGRESS} to {newstate}!"
-                )
-    else:
+    if db_cluster and exec:
+        raise click.exceptions.UsageError("Cannot use exec to build a database cluster!")
+
+    resources = resource_budget(jobs, ctx.obj["storage"]["transfer"].buffer_size()) if jobs > 1 else None
+    runner_class = ClusterBuildJobRunner if db_cluster else BuildJobRunner
+    runner = runner_class(
+        ctx,
+        command,
+        exec,
+        analyze,
+        not no_reuse,
+        resources=resources,
+        lease_duration=timedelta(seconds=lease_duration),
+        timeout=timeout,
+        fair_share=fair_share,
+    )
+    claimed_jobs = runner.claim(label, retry, snapshot_global_id, max(batch, jobs))
+    run_in_parallel(claimed_jobs, runner.run, jobs)
+    if not claimed_jobs:
         click.echo("Could not find snapshot to build!")
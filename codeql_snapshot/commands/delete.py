@@ -1,49 +1,89 @@
 import click
-from sqlalchemy import Engine, select, func
-from sqlalchemy.orm import Session
-from codeql_snapshot.helpers.object_store import (
-    has_database_object,
-    remove_database_object,
-    has_sarif_object,
-    remove_sarif_object,
-    has_source_object,
-    remove_source_object,
+from datetime import timedelta
+from sqlalchemy import Engine
+from typing import Optional, Tuple
+from codeql_snapshot.helpers.retention import (
+    RetentionPolicy,
+    mark_snapshots_deleted,
+    purge_deleted_snapshots,
 )
-from codeql_snapshot.models.snapshot import Snapshot
+from codeql_snapshot.models.snapshot import SnapshotState
 
 
 @click.command(name="delete")
-@click.option("-s", "--snapshot-global-id", required=True)
+@click.option(
+    "-s",
+    "--snapshot-global-id",
+    "snapshot_global_ids",
+    multiple=True,
+    help="Id of a snapshot to delete. Can be repeated to delete multiple snapshots at once.",
+)
+@click.option("--project-url", help="Only delete snapshots of this project.")
+@click.option("--branch", help="Only delete snapshots of this branch.")
+@click.option("-l", "--label", help="Only delete snapshots with this label.")
+@click.option(
+    "--state",
+    "states",
+    multiple=True,
+    type=click.Choice(
+        [state.name for state in SnapshotState if state != SnapshotState.DELETED],
+        case_sensitive=False,
+    ),
+    help="Only delete snapshots in this state, can be repeated. Snapshots in progress are only deleted once their lease expired.",
+)
+@click.option(
+    "--older-than",
+    type=click.IntRange(min=0),
+    help="Only delete snapshots created more than this number of days ago.",
+)
+@click.option(
+    "--keep-last",
+    type=click.IntRange(min=0),
+    help="Keep this number of the most recent snapshots of every branch, language and category.",
+)
+@click.option(
+    "--purge",
+    is_flag=True,
+    help="Remove the objects of the deleted snapshots right away, instead of leaving them for the purge command.",
+)
 @click.pass_context
-def command(ctx: click.Context, snapshot_global_id: str) -> None:
+def command(
+    ctx: click.Context,
+    snapshot_global_ids: Tuple[str, ...],
+    project_url: Optional[str],
+    branch: Optional[str],
+    label: Optional[str],
+    states: Tuple[str, ...],
+    older_than: Optional[int],
+    keep_last: Optional[int],
+    purge: bool,
+) -> None:
     database_engine: Engine = ctx.obj["database"]["engine"]
 
-    with Session(database_engine) as session, session.begin():
-        stmt = (
-            select(Snapshot)
-            .where(Snapshot.global_id == snapshot_global_id)
-            .with_for_update()
+    policy = RetentionPolicy(
+        global_ids=snapshot_global_ids,
+        project_url=project_url,
+        branch=branch,
+        label=label,
+        states=[SnapshotState[state.upper()] for state in states],
+        older_than=timedelta(days=older_than) if older_than != None else None,
+        keep_last=keep_last,
+    )
+    if policy.is_empty():
+        raise click.exceptions.UsageError(
+            "Specify the snapshots to delete by id or with at least one filter!"
         )
 
-        snapshot = session.scalar(stmt)
-        if snapshot:
-
-            with session.begin_nested():
-                references = session.scalar(
-                    select(func.count())
-                    .select_from(Snapshot)
-                    .where(Snapshot.source_id == snapshot.source_id)
-                    .where(Snapshot.global_id != snapshot.global_id)
-                )
-                if references == 0:
-                    if has_source_object(ctx, snapshot.source_id):
-                        remove_source_object(ctx, snapshot.source_id)
-            if has_database_object(ctx, snapshot.global_id):
-                remove_database_object(ctx, snapshot.global_id)
-            if has_sarif_object(ctx, snapshot.global_id):
-                remove_sarif_object(ctx, snapshot.global_id)
-
-            session.delete(snapshot)
+    deleted_global_ids = set(mark_snapshots_deleted(database_engine, policy))
+    for snapshot_global_id in snapshot_global_ids:
+        if not snapshot_global_id in deleted_global_ids:
+            click.echo(
+                f"No snapshot with id {snapshot_global_id} that can be deleted, it does not exist, is already deleted or is in progress!"
+            )
+    click.echo(f"Deleted {len(deleted_global_ids)} snapshot(s).")
 
-        else:
-            click.echo(f"No snapshot with id {snapshot_global_id}!")
+    if purge:
+        purged = 0
+        while deleted := purge_deleted_snapshots(ctx):
+            purged += deleted
+        click.echo(f"Purged {purged} snapshot(s).")
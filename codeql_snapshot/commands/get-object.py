@@ -4,10 +4,12 @@ from sqlalchemy.orm import Session
 from codeql_snapshot.helpers.object_store import (
     has_database_object,
     get_database_object,
+    get_database_object_format,
     has_sarif_object,
     get_sarif_object,
     has_source_object,
     get_source_object,
+    get_source_object_format,
 )
 from codeql_snapshot.models.snapshot import Snapshot
 from pathlib import Path
@@ -41,7 +43,12 @@ def command(
 
             if object_type == "database":
                 if has_database_object(ctx, snapshot.global_id):
-                    database_path = (directory / snapshot.global_id).with_suffix(".zip")
+                    database_format = get_database_object_format(
+                        ctx, snapshot.global_id
+                    )
+                    database_path = (directory / snapshot.global_id).with_suffix(
+                        database_format.suffix
+                    )
                     if database_path.exists():
                         click.echo(f"Database already exists at {database_path}!")
                         return
@@ -70,11 +77,14 @@ def command(
                     click.echo(f"No sarif for snapshot with id {snapshot_global_id}!")
 
             if object_type == "source":
-                source_path = (directory / snapshot.source_id).with_suffix(".zip")
-                if source_path.exists():
-                    click.echo(f"Source already exists at {source_path}!")
-                    return
                 if has_source_object(ctx, snapshot.source_id):
+                    source_format = get_source_object_format(ctx, snapshot.source_id)
+                    source_path = (directory / snapshot.source_id).with_suffix(
+                        source_format.suffix
+                    )
+                    if source_path.exists():
+                        click.echo(f"Source already exists at {source_path}!")
+                        return
                     get_source_object(
                         ctx,
                         snapshot.source_id,
@@ -19,7 +19,7 @@ def command(ctx: click.Context, format: str):
 
         if format == "table":
             table = BeautifulTable(maxwidth=get_terminal_size()[0])
-            table.columns.header = "Global Id, Source Id, Project Url,Branch,Commit,Language,Category,State,Labels,Created At,Updated At".split(
+            table.columns.header = "Global Id, Source Id, Project Url,Branch,Commit,Language,Category,State,Labels,Priority,Created At,Updated At".split(
                 ","
             )
             table.columns.alignment = BeautifulTable.ALIGN_LEFT
@@ -35,6 +35,7 @@ def command(ctx: click.Context, format: str):
                         snapshot.category,
                         snapshot.state.name,
                         snapshot.label,
+                        snapshot.priority,
                         snapshot.created_at.replace(microsecond=0).isoformat(),
                         snapshot.updated_at.replace(microsecond=0).isoformat(),
                     ]
@@ -53,6 +54,7 @@ def command(ctx: click.Context, format: str):
                     "category": snapshot.category,
                     "state": snapshot.state.name,
                     "label": snapshot.label,
+                    "priority": snapshot.priority,
                     "created-at": snapshot.created_at.replace(
                         microsecond=0
                     ).isoformat(),
@@ -0,0 +1,52 @@
+import click
+from typing import Any
+from codeql_snapshot.helpers.notifications import SnapshotListener
+from codeql_snapshot.helpers.retention import purge_deleted_snapshots
+from codeql_snapshot.models.snapshot import SnapshotState
+from threading import Event
+import signal
+
+
+@click.command(name="purge")
+@click.option(
+    "-b",
+    "--batch",
+    type=click.IntRange(min=1),
+    default=1000,
+    help="Maximum number of deleted snapshots to purge in a single transaction.",
+)
+@click.option(
+    "-w",
+    "--wait",
+    is_flag=True,
+    help="Wait for snapshots to be deleted when there is nothing left to purge instead of exiting.",
+)
+@click.pass_context
+def command(ctx: click.Context, batch: int, wait: bool) -> None:
+    stop = Event()
+
+    def request_stop(signum: int, frame: Any) -> None:
+        click.echo(
+            f"Received signal {signal.Signals(signum).name}, stopping after the current batch."
+        )
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    # Start listening before looking for work, so snapshots deleted in the meantime are not missed.
+    listener = SnapshotListener(ctx.obj["database"]["engine"]) if wait else None
+
+    purged = 0
+    while not stop.is_set():
+        purged_batch = purge_deleted_snapshots(ctx, batch)
+        purged += purged_batch
+        if purged_batch < batch:
+            if not listener:
+                break
+            listener.wait_for(
+                lambda notification: notification.state == SnapshotState.DELETED,
+                stop=stop,
+            )
+
+    click.echo(f"Purged {purged} snapshot(s).")
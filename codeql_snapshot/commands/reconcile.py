@@ -0,0 +1,53 @@
+import click
+from datetime import timedelta
+from typing import Tuple
+from codeql_snapshot.helpers.reconcile import (
+    OBJECT_KINDS,
+    ReconcileReport,
+    reconcile_objects,
+    reconcile_blobs,
+)
+
+
+@click.command(name="reconcile")
+@click.option(
+    "-k",
+    "--kind",
+    "kinds",
+    multiple=True,
+    type=click.Choice([*OBJECT_KINDS, "blob"]),
+    default=[*OBJECT_KINDS, "blob"],
+    help="Kind of objects to reconcile, can be repeated. Defaults to all kinds. Blobs are the files of source manifests.",
+)
+@click.option(
+    "--min-age",
+    type=click.IntRange(min=0),
+    default=24,
+    help="Number of hours since its last modification before an object without snapshot is considered orphaned, so objects of snapshots being added are left alone.",
+)
+@click.option(
+    "--remove",
+    is_flag=True,
+    help="Remove the orphaned objects instead of only reporting them.",
+)
+@click.pass_context
+def command(
+    ctx: click.Context, kinds: Tuple[str, ...], min_age: int, remove: bool
+) -> None:
+    total = ReconcileReport()
+    for kind in OBJECT_KINDS:
+        if kind in kinds:
+            report = reconcile_objects(
+                ctx, OBJECT_KINDS[kind], timedelta(hours=min_age), remove
+            )
+            total.orphaned += report.orphaned
+            total.missing += report.missing
+    # Last, so the blobs of the source manifests just removed are removed as well.
+    if "blob" in kinds:
+        report = reconcile_blobs(ctx, timedelta(hours=min_age), remove)
+        total.orphaned += report.orphaned
+        total.missing += report.missing
+
+    click.echo(
+        f"{'Removed' if remove else 'Found'} {total.orphaned} orphaned object(s), found {total.missing} missing object(s)."
+    )
@@ -0,0 +1,117 @@
+import click
+from sqlalchemy import Engine, select
+from sqlalchemy.orm import Session
+from codeql_snapshot.models import Snapshot, SnapshotState, Result
+from beautifultable import BeautifulTable
+from shutil import get_terminal_size
+from typing import Dict, Any, Optional, Tuple
+import json
+
+
+@click.command(name="results")
+@click.option(
+    "-s",
+    "--snapshot-global-id",
+    "snapshot_global_ids",
+    multiple=True,
+    help="Global id of a snapshot whose results to list, can be repeated.",
+)
+@click.option("--project-url")
+@click.option("--branch")
+@click.option(
+    "--rule-id", help="Only list the results of the rule, e.g. java/sql-injection."
+)
+@click.option(
+    "--fingerprint",
+    help="Only list the results with the fingerprint, to find the same alert in other snapshots.",
+)
+@click.option(
+    "--min-security-severity",
+    type=float,
+    help="Only list the results of security rules with at least the given severity.",
+)
+@click.option("--format", default="table", type=click.Choice(["table", "json"]))
+@click.pass_context
+def command(
+    ctx: click.Context,
+    snapshot_global_ids: Tuple[str, ...],
+    project_url: Optional[str],
+    branch: Optional[str],
+    rule_id: Optional[str],
+    fingerprint: Optional[str],
+    min_security_severity: Optional[float],
+    format: str,
+) -> None:
+    database_engine: Engine = ctx.obj["database"]["engine"]
+    stmt = (
+        select(Result, Snapshot)
+        .join(Snapshot, Snapshot.global_id == Result.snapshot_global_id)
+        .where(Snapshot.state != SnapshotState.DELETED)
+        .order_by(Snapshot.global_id, Result.path, Result.start_line, Result.id)
+    )
+    if snapshot_global_ids:
+        stmt = stmt.where(Snapshot.global_id.in_(snapshot_global_ids))
+    if project_url:
+        stmt = stmt.where(Snapshot.project_url == project_url)
+    if branch:
+        stmt = stmt.where(Snapshot.branch == branch)
+    if rule_id:
+        stmt = stmt.where(Result.rule_id == rule_id)
+    if fingerprint:
+        stmt = stmt.where(Result.fingerprint == fingerprint)
+    if min_security_severity != None:
+        stmt = stmt.where(Result.security_severity >= min_security_severity)
+
+    with Session(database_engine) as session:
+        rows = session.execute(stmt)
+
+        if format == "table":
+            table = BeautifulTable(maxwidth=get_terminal_size()[0])
+            table.columns.header = "Global Id,Project Url,Branch,Commit,Language,Rule Id,Location,Level,Security Severity,Fingerprint".split(
+                ","
+            )
+            table.columns.alignment = BeautifulTable.ALIGN_LEFT
+            for result, snapshot in rows:
+                table.append_row(
+                    [
+                        snapshot.global_id,
+                        snapshot.project_url,
+                        snapshot.branch,
+                        snapshot.commit,
+                        snapshot.language.name,
+                        result.rule_id,
+                        f"{result.path}:{result.start_line}",
+                        result.level,
+                        result.security_severity,
+                        result.fingerprint,
+                    ]
+                )
+            click.echo(table)
+        elif format == "json":
+
+            def result_to_dict(result: Result, snapshot: Snapshot) -> Dict[str, Any]:
+                return {
+                    "global-id": snapshot.global_id,
+                    "project-url": snapshot.project_url,
+                    "branch": snapshot.branch,
+                    "commit": snapshot.commit,
+                    "language": snapshot.language.name,
+                    "category": snapshot.category,
+                    "rule-id": result.rule_id,
+                    "path": result.path,
+                    "start-line": result.start_line,
+                    "start-column": result.start_column,
+                    "end-line": result.end_line,
+                    "end-column": result.end_column,
+                    "level": result.level,
+                    "security-severity": result.security_severity,
+                    "fingerprint": result.fingerprint,
+                    "message": result.message,
+                }
+
+            click.echo(
+                json.dumps(
+                    [result_to_dict(result, snapshot) for result, snapshot in rows],
+                    indent=2,
+                )
+            )
@@ -0,0 +1,71 @@
+import click
+from sqlalchemy import Engine, select
+from sqlalchemy.orm import Session
+from typing import Optional, Tuple
+from codeql_snapshot.helpers.notifications import SnapshotListener
+from codeql_snapshot.models.snapshot import Snapshot, SnapshotState
+
+# States a snapshot does not leave without intervention, so there is no point in waiting for another state.
+FAILED_STATES = {
+    SnapshotState.SNAPSHOT_FAILED,
+    SnapshotState.BUILD_FAILED,
+    SnapshotState.ANALYSIS_FAILED,
+    SnapshotState.DELETED,
+}
+
+
+@click.command(name="wait")
+@click.option("-s", "--snapshot-global-id", required=True)
+@click.option(
+    "--state",
+    "states",
+    multiple=True,
+    type=click.Choice([state.name for state in SnapshotState], case_sensitive=False),
+    default=[SnapshotState.ANALYZED.name],
+    help="State to wait for, can be repeated. Defaults to ANALYZED.",
+)
+@click.option(
+    "--timeout",
+    type=click.IntRange(min=1),
+    help="Maximum number of seconds to wait.",
+)
+@click.pass_context
+def command(
+    ctx: click.Context,
+    snapshot_global_id: str,
+    states: Tuple[str, ...],
+    timeout: Optional[int],
+) -> None:
+    database_engine: Engine = ctx.obj["database"]["engine"]
+    target_states = {SnapshotState[state.upper()] for state in states}
+
+    with SnapshotListener(database_engine) as listener:
+        with Session(database_engine) as session:
+            state = session.scalar(
+                select(Snapshot.state).where(Snapshot.global_id == snapshot_global_id)
+            )
+        if not state:
+            raise click.ClickException(
+                f"Could not find snapshot with id {snapshot_global_id}!"
+            )
+
+        if not state in target_states and not state in FAILED_STATES:
+            notification = listener.wait_for(
+                lambda notification: notification.global_id == snapshot_global_id
+                and (
+                    notification.state in target_states
+                    or notification.state in FAILED_STATES
+                ),
+                timeout,
+            )
+            if not notification:
+                raise click.ClickException(
+                    f"Snapshot with id {snapshot_global_id} did not reach state {', '.join(states)} within {timeout} seconds!"
+                )
+            state = notification.state
+
+    click.echo(state.name)
+    if not state in target_states:
+        raise click.ClickException(
+            f"Snapshot with id {snapshot_global_id} is in state {state.name}!"
+        )
@@ -0,0 +1,232 @@
+import click
+from datetime import timedelta
+from typing import Optional, List, Any
+from codeql_snapshot.helpers.queue import SnapshotJob
+from codeql_snapshot.helpers.jobs import (
+    JobRunner,
+    BuildJobRunner,
+    ClusterBuildJobRunner,
+    AnalysisJobRunner,
+    run_in_parallel,
+    resource_budget,
+)
+from codeql_snapshot.helpers.pipeline import Pipeline
+from codeql_snapshot.helpers.notifications import SnapshotListener
+from threading import Event
+import signal
+
+STAGES = ["build", "analyze"]
+
+
+def parse_stages(ctx: click.Context, param: click.Parameter, value: str) -> List[str]:
+    stages = [stage.strip().lower() for stage in value.split(",") if stage.strip()]
+    for stage in stages:
+        if not stage in STAGES:
+            raise click.BadParameter(
+                f"Unknown stage {stage}, expected one of {', '.join(STAGES)}!"
+            )
+    if not stages:
+        raise click.BadParameter("At least one stage is required!")
+    return stages
+
+
+@click.command(name="worker")
+@click.option(
+    "--stages",
+    default=",".join(STAGES),
+    callback=parse_stages,
+    help="Comma separated list of stages to process.",
+)
+@click.option("-c", "--command")
+@click.option("-x", "--exec")
+@click.option("-l", "--label")
+@click.option(
+    "-b",
+    "--batch",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Maximum number of snapshots to claim in a single transaction.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of snapshots to process concurrently, dividing the available cores and memory between them.",
+)
+@click.option(
+    "-a",
+    "--analyze",
+    is_flag=True,
+    help="Analyze databases right after building them in the build stage.",
+)
+@click.option(
+    "-p",
+    "--pipeline",
+    is_flag=True,
+    help="Download the next jobs and upload the previous jobs while CodeQL runs.",
+)
+@click.option(
+    "--prefetch",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of jobs that can wait in between two pipeline stages.",
+)
+@click.option(
+    "-w",
+    "--wait",
+    is_flag=True,
+    help="Wait for new snapshots when there is no work left instead of exiting.",
+)
+@click.option(
+    "--lease-duration",
+    type=click.IntRange(min=1),
+    default=300,
+    help="Number of seconds a claimed snapshot is leased. The lease is renewed while the snapshot is being processed and snapshots with an expired lease can be claimed by other workers.",
+)
+@click.option(
+    "--timeout",
+    type=click.IntRange(min=1),
+    help="Maximum number of seconds a single CodeQL or custom build command is allowed to run.",
+)
+@click.option(
+    "--fair-share",
+    is_flag=True,
+    help="Spread claimed snapshots across projects instead of strictly following the snapshot priority.",
+)
+@click.option(
+    "--no-reuse",
+    is_flag=True,
+    help="Always build a new database, instead of reusing the database of a snapshot of the same commit, language and category built with the same command.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Analyze snapshots in the analyze stage even if their database, the CodeQL version and the query packs are unchanged since their last analysis.",
+)
+@click.option(
+    "--db-cluster",
+    is_flag=True,
+    help="Claim the snapshots of all languages of a source together in the build stage and build their databases with a single CodeQL database cluster run, extracting the source once.",
+)
+@click.pass_context
+def command(
+    ctx: click.Context,
+    stages: List[str],
+    command: Optional[str],
+    exec: Optional[str],
+    label: Optional[str],
+    batch: int,
+    jobs: int,
+    analyze: bool,
+    pipeline: bool,
+    prefetch: int,
+    wait: bool,
+    lease_duration: int,
+    timeout: Optional[int],
+    fair_share: bool,
+    no_reuse: bool,
+    force: bool,
+    db_cluster: bool,
+) -> None:
+    if command and exec:
+        raise click.exceptions.UsageError("Cannot use both command and exec!")
+    if db_cluster and exec:
+        raise click.exceptions.UsageError(
+            "Cannot use exec to build a database cluster!"
+        )
+
+    # Finish the job in progress when asked to stop, so no snapshot is left behind in an in-progress state.
+    stop = Event()
+
+    def request_stop(signum: int, frame: Any) -> None:
+        click.echo(
+            f"Received signal {signal.Signals(signum).name}, stopping after the current job."
+        )
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    resources = (
+        resource_budget(jobs, ctx.obj["storage"]["transfer"].buffer_size())
+        if jobs > 1
+        else None
+    )
+    runner_options = {
+        "resources": resources,
+        "lease_duration": timedelta(seconds=lease_duration),
+        "timeout": timeout,
+        "fair_share": fair_share,
+    }
+    runners: List[JobRunner] = []
+    for stage in stages:
+        if stage == "build":
+            runner_class = ClusterBuildJobRunner if db_cluster else BuildJobRunner
+            runners.append(
+                runner_class(
+                    ctx, command, exec, analyze, not no_reuse, **runner_options
+                )
+            )
+        else:
+            runners.append(AnalysisJobRunner(ctx, force, **runner_options))
+
+    # Start listening before looking for work, so snapshots added in the meantime are not missed.
+    listener = SnapshotListener(ctx.obj["database"]["engine"]) if wait else None
+    states = {runner.state for runner in runners}
+
+    def wait_for_work() -> None:
+        assert listener
+        # Expired leases are not announced, so look for work at least once per lease duration.
+        listener.wait_for(
+            lambda notification: notification.label == label
+            and notification.state in states,
+            lease_duration,
+            stop,
+        )
+
+    if pipeline:
+        processed = Pipeline(
+            runners,
+            label,
+            stop,
+            batch,
+            jobs,
+            prefetch,
+            wait_for_work if listener else None,
+        ).run()
+        click.echo(f"Processed {processed} snapshot job(s).")
+        return
+
+    def process(runner: JobRunner, job: SnapshotJob) -> bool:
+        if stop.is_set():
+            # Hand back the claimed snapshots we will not get to.
+            runner.release([job])
+            return False
+
+        click.echo(f"Running {runner.name} for snapshot {job.global_id}.")
+        runner.run(job)
+        return True
+
+    processed = 0
+    while not stop.is_set():
+        found_work = False
+        for runner in runners:
+            if stop.is_set():
+                break
+
+            claimed_jobs = runner.claim(label, batch=max(batch, jobs))
+            if claimed_jobs:
+                found_work = True
+                processed += sum(
+                    run_in_parallel(
+                        claimed_jobs, lambda job: process(runner, job), jobs
+                    )
+                )
+
+        if not found_work:
+            if not listener:
+                break
+            wait_for_work()
+
+    click.echo(f"Processed {processed} snapshot job(s).")
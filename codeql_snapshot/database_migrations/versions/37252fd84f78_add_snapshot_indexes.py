@@ -0,0 +1,72 @@
+"""add snapshot indexes
+
+Revision ID: 37252fd84f78
+Revises: 5aa21efb5837
+Create Date: 2026-10-18 13:24:09.118260
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "37252fd84f78"
+down_revision = "5aa21efb5837"
+branch_labels = None
+depends_on = None
+
+claimable_states = [
+    "NOT_BUILT",
+    "BUILD_IN_PROGRESS",
+    "BUILD_FAILED",
+    "NOT_ANALYZED",
+    "ANALYSIS_IN_PROGRESS",
+    "ANALYSIS_FAILED",
+]
+
+
+def upgrade() -> None:
+    # Build the indexes concurrently so workers can keep claiming snapshots while the migration runs.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_snapshots_label_state_claimable"),
+            "snapshots",
+            ["label", "state"],
+            postgresql_where=sa.text(
+                "state IN ({})".format(
+                    ", ".join(f"'{state}'" for state in claimable_states)
+                )
+            ),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_snapshots_source_id"),
+            "snapshots",
+            ["source_id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_snapshots_project_url_branch_commit"),
+            "snapshots",
+            ["project_url", "branch", "commit"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_snapshots_project_url_branch_commit"),
+            table_name="snapshots",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_snapshots_source_id"),
+            table_name="snapshots",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_snapshots_label_state_claimable"),
+            table_name="snapshots",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,30 @@
+"""add snapshot lease
+
+Revision ID: 5aa21efb5837
+Revises: 7af914c0b3be
+Create Date: 2026-10-18 13:12:41.502318
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "5aa21efb5837"
+down_revision = "7af914c0b3be"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "snapshots", sa.Column("lease_owner", sa.String(length=255), nullable=True)
+    )
+    op.add_column(
+        "snapshots", sa.Column("lease_expires_at", sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("snapshots", "lease_expires_at")
+    op.drop_column("snapshots", "lease_owner")
@@ -0,0 +1,79 @@
+"""add snapshot priority
+
+Revision ID: 8c6058a57fcd
+Revises: 37252fd84f78
+Create Date: 2026-10-18 13:41:27.640115
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "8c6058a57fcd"
+down_revision = "37252fd84f78"
+branch_labels = None
+depends_on = None
+
+claimable_states = [
+    "NOT_BUILT",
+    "BUILD_IN_PROGRESS",
+    "BUILD_FAILED",
+    "NOT_ANALYZED",
+    "ANALYSIS_IN_PROGRESS",
+    "ANALYSIS_FAILED",
+]
+claimable_where = sa.text(
+    "state IN ({})".format(", ".join(f"'{state}'" for state in claimable_states))
+)
+
+
+def upgrade() -> None:
+    op.add_column(
+        "snapshots",
+        sa.Column("priority", sa.Integer(), server_default="0", nullable=False),
+    )
+    # Build the indexes concurrently so workers can keep claiming snapshots while the migration runs.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_snapshots_claim_priority"),
+            "snapshots",
+            ["label", "state", sa.text("priority DESC"), "created_at"],
+            postgresql_where=claimable_where,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_snapshots_claim_fair_share"),
+            "snapshots",
+            ["label", "state", "project_url", sa.text("priority DESC"), "created_at"],
+            postgresql_where=claimable_where,
+            postgresql_concurrently=True,
+        )
+        # Superseded by the priority index, which has the same leading columns.
+        op.drop_index(
+            op.f("ix_snapshots_label_state_claimable"),
+            table_name="snapshots",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_snapshots_label_state_claimable"),
+            "snapshots",
+            ["label", "state"],
+            postgresql_where=claimable_where,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_snapshots_claim_fair_share"),
+            table_name="snapshots",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_snapshots_claim_priority"),
+            table_name="snapshots",
+            postgresql_concurrently=True,
+        )
+    op.drop_column("snapshots", "priority")
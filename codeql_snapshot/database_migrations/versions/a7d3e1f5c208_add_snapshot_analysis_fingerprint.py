@@ -0,0 +1,27 @@
+"""add snapshot analysis fingerprint
+
+Revision ID: a7d3e1f5c208
+Revises: f2c8d5a7e914
+Create Date: 2026-10-18 19:05:47.116529
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "a7d3e1f5c208"
+down_revision = "f2c8d5a7e914"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "snapshots",
+        sa.Column("analysis_fingerprint", sa.String(length=64), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("snapshots", "analysis_fingerprint")
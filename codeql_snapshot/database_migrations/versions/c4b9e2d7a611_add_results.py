@@ -0,0 +1,55 @@
+"""add results
+
+Revision ID: c4b9e2d7a611
+Revises: a7d3e1f5c208
+Create Date: 2026-10-18 13:39:31.485069
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c4b9e2d7a611"
+down_revision = "a7d3e1f5c208"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "results",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("snapshot_global_id", sa.String(length=64), nullable=False),
+        sa.Column("rule_id", sa.String(length=255), nullable=False),
+        sa.Column("path", sa.Text(), nullable=True),
+        sa.Column("start_line", sa.Integer(), nullable=True),
+        sa.Column("start_column", sa.Integer(), nullable=True),
+        sa.Column("end_line", sa.Integer(), nullable=True),
+        sa.Column("end_column", sa.Integer(), nullable=True),
+        sa.Column("fingerprint", sa.String(length=255), nullable=True),
+        sa.Column("level", sa.String(length=16), nullable=True),
+        sa.Column("security_severity", sa.Float(), nullable=True),
+        sa.Column("message", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["snapshot_global_id"],
+            ["snapshots.global_id"],
+            name=op.f("fk_results_snapshot_global_id_snapshots"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_results")),
+    )
+    op.create_index("ix_results_fingerprint", "results", ["fingerprint"], unique=False)
+    op.create_index("ix_results_rule_id", "results", ["rule_id"], unique=False)
+    op.create_index(
+        "ix_results_snapshot_global_id", "results", ["snapshot_global_id"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_results_snapshot_global_id", table_name="results")
+    op.drop_index("ix_results_rule_id", table_name="results")
+    op.drop_index("ix_results_fingerprint", table_name="results")
+    op.drop_table("results")
@@ -0,0 +1,52 @@
+"""notify snapshot state
+
+Revision ID: d41b7c9e2a63
+Revises: 8c6058a57fcd
+Create Date: 2026-10-18 14:12:05.318422
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d41b7c9e2a63"
+down_revision = "8c6058a57fcd"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Notify listeners on the codeql_snapshot channel whenever a snapshot is added or changes state.
+    # Notifications are only delivered when the transaction commits, so listeners never observe uncommitted states.
+    op.execute("""
+        CREATE FUNCTION notify_snapshot_state() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify(
+                'codeql_snapshot',
+                json_build_object(
+                    'global_id', NEW.global_id,
+                    'label', NEW.label,
+                    'state', NEW.state
+                )::text
+            );
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """)
+    op.execute("""
+        CREATE TRIGGER snapshots_notify_insert
+        AFTER INSERT ON snapshots
+        FOR EACH ROW EXECUTE FUNCTION notify_snapshot_state()
+        """)
+    op.execute("""
+        CREATE TRIGGER snapshots_notify_state
+        AFTER UPDATE OF state ON snapshots
+        FOR EACH ROW WHEN (OLD.state IS DISTINCT FROM NEW.state)
+        EXECUTE FUNCTION notify_snapshot_state()
+        """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER snapshots_notify_state ON snapshots")
+    op.execute("DROP TRIGGER snapshots_notify_insert ON snapshots")
+    op.execute("DROP FUNCTION notify_snapshot_state()")
@@ -0,0 +1,38 @@
+"""add snapshot build command
+
+Revision ID: e6a9f0c3b1d7
+Revises: d41b7c9e2a63
+Create Date: 2026-10-18 16:02:11.418305
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "e6a9f0c3b1d7"
+down_revision = "d41b7c9e2a63"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("snapshots", sa.Column("build_command", sa.Text(), nullable=True))
+    # Build the index concurrently so workers can keep claiming snapshots while the migration runs.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_snapshots_commit_language"),
+            "snapshots",
+            ["commit", "language"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_snapshots_commit_language"),
+            table_name="snapshots",
+            postgresql_concurrently=True,
+        )
+    op.drop_column("snapshots", "build_command")
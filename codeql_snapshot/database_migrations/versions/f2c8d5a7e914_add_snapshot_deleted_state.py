@@ -0,0 +1,42 @@
+"""add snapshot deleted state
+
+Revision ID: f2c8d5a7e914
+Revises: e6a9f0c3b1d7
+Create Date: 2026-10-18 17:24:39.802164
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "f2c8d5a7e914"
+down_revision = "e6a9f0c3b1d7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A new enum value cannot be used in the transaction that adds it, so it is committed before the index using it
+    # is created.
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE snapshotstate ADD VALUE IF NOT EXISTS 'DELETED'")
+        op.create_index(
+            op.f("ix_snapshots_deleted"),
+            "snapshots",
+            ["source_id"],
+            postgresql_where=sa.text("state = 'DELETED'"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_snapshots_deleted"),
+            table_name="snapshots",
+            postgresql_concurrently=True,
+        )
+    # Postgres cannot remove a value from an enum type, so the value is left in place. The snapshots marked as
+    # deleted are removed, their objects are left in the object store.
+    op.execute("DELETE FROM snapshots WHERE state = 'DELETED'")
@@ -0,0 +1,156 @@
+import tarfile
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Optional, Dict, Mapping, List, Iterable, Any
+from codeql_snapshot.helpers.zip import ZipError, zipdir_to_stream
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+# Codecs for the archives we create ourselves. Databases can also be bundled by CodeQL.
+CODECS = ["stored", "deflate", "zstd"]
+DATABASE_CODECS = CODECS + ["bundle"]
+# Sources can also be stored as a manifest of content-addressed files shared between all source objects.
+SOURCE_CODECS = CODECS + ["manifest"]
+
+# User metadata on the objects recording how they are encoded, so readers do not depend on the writer's settings.
+CODEC_METADATA = "x-amz-meta-archive-codec"
+LEVEL_METADATA = "x-amz-meta-archive-level"
+
+
+@dataclass(frozen=True)
+class ArchiveFormat:
+    """How a directory is archived: a zip file that is stored or deflated, a zstd compressed tar file,
+    or a CodeQL database bundle."""
+
+    codec: str
+    level: Optional[int] = None
+
+    @staticmethod
+    def parse(value: str) -> "ArchiveFormat":
+        codec, _, level = value.lower().partition(":")
+        if not level:
+            return ArchiveFormat(codec)
+        if not level.lstrip("-").isdigit():
+            raise ValueError(f"Invalid compression level {level}!")
+        return ArchiveFormat(codec, int(level))
+
+    @staticmethod
+    def from_metadata(
+        metadata: Mapping[str, str], default: "ArchiveFormat"
+    ) -> "ArchiveFormat":
+        # Objects created before the codec was recorded use the default format.
+        codec = metadata.get(CODEC_METADATA)
+        if not codec:
+            return default
+        level = metadata.get(LEVEL_METADATA)
+        return ArchiveFormat(codec, int(level) if level else None)
+
+    def __str__(self) -> str:
+        return f"{self.codec}:{self.level}" if self.level != None else self.codec
+
+    @property
+    def suffix(self) -> str:
+        if self.codec == "manifest":
+            return ".manifest"
+        return ".tar.zst" if self.codec == "zstd" else ".zip"
+
+    def metadata(self) -> Dict[str, str]:
+        metadata = {CODEC_METADATA: self.codec}
+        if self.level != None:
+            metadata[LEVEL_METADATA] = str(self.level)
+        return metadata
+
+    def validate(self, codecs: List[str] = CODECS) -> None:
+        if not self.codec in codecs:
+            raise ValueError(
+                f"Unknown codec {self.codec}, expected one of {', '.join(codecs)}!"
+            )
+        if self.codec == "zstd" and not zstandard:
+            raise ValueError(
+                "The zstd codec requires the zstandard package, install the zstd extra!"
+            )
+        if self.codec in ["stored", "bundle"] and self.level != None:
+            raise ValueError(f"The {self.codec} codec does not have a level!")
+        if (
+            self.codec in ["deflate", "manifest"]
+            and self.level != None
+            and not 0 <= self.level <= 9
+        ):
+            raise ValueError(f"The {self.codec} level must be between 0 and 9!")
+        if self.codec == "zstd" and self.level != None and not 1 <= self.level <= 22:
+            raise ValueError("The zstd level must be between 1 and 22!")
+
+
+# Source archives were stored zip files before the codec became configurable.
+STORED = ArchiveFormat("stored")
+BUNDLE = ArchiveFormat("bundle")
+
+
+def zstd_compressor(format: ArchiveFormat) -> Any:
+    # Compress on all cores, zstd splits the input in independent jobs so this does not affect the ratio much.
+    return zstandard.ZstdCompressor(
+        level=format.level if format.level != None else 3, threads=-1
+    )
+
+
+def archive_dir_to_stream(
+    source_dir: Path,
+    stream: IO[bytes],
+    format: ArchiveFormat,
+    entries: Optional[Iterable[Path]] = None,
+) -> None:
+    """Writes the content of a directory as an archive to a stream that does not have to be seekable.
+
+    Only the given entries below the directory are archived if provided, otherwise the whole directory is.
+    """
+    if format.codec == "zstd":
+        if not source_dir.is_dir():
+            raise ZipError(f"The provided source path {source_dir} is not a directory!")
+        with zstd_compressor(format).stream_writer(stream, closefd=False) as writer:
+            with tarfile.open(fileobj=writer, mode="w|") as tar:
+                if entries != None:
+                    for f in entries:
+                        tar.add(
+                            str(f),
+                            arcname=str(f.relative_to(source_dir)),
+                            recursive=False,
+                        )
+                else:
+                    for f in sorted(source_dir.iterdir()):
+                        tar.add(str(f), arcname=f.name)
+    elif format.codec == "deflate":
+        zipdir_to_stream(
+            source_dir, stream, zipfile.ZIP_DEFLATED, format.level, entries=entries
+        )
+    elif format.codec == "stored":
+        zipdir_to_stream(source_dir, stream, entries=entries)
+    else:
+        raise ZipError(f"Cannot create an archive with codec {format.codec}!")
+
+
+def archive_dir(source_dir: Path, archive_path: Path, format: ArchiveFormat) -> None:
+    with archive_path.open(mode="xb") as stream:
+        archive_dir_to_stream(source_dir, stream, format)
+
+
+def extract_archive(
+    archive_path: Path, target_dir: Path, format: ArchiveFormat
+) -> None:
+    if format.codec == "zstd":
+        if not zstandard:
+            raise ZipError(
+                "Cannot extract a zstd archive without the zstandard package, install the zstd extra!"
+            )
+        with archive_path.open(mode="rb") as stream:
+            with zstandard.ZstdDecompressor().stream_reader(stream) as reader:
+                with tarfile.open(fileobj=reader, mode="r|") as tar:
+                    tar.extractall(target_dir)
+    elif format.codec in ["stored", "deflate"]:
+        with zipfile.ZipFile(str(archive_path)) as zip:
+            zip.extractall(target_dir)
+    else:
+        raise ZipError(f"Cannot extract an archive with codec {format.codec}!")
@@ -0,0 +1,146 @@
+import fcntl
+import shutil
+from contextlib import contextmanager
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Callable, Iterator, Tuple, List, Mapping
+from minio import Minio
+from codeql_snapshot.helpers.transfer import TransferOptions, download_file
+import os
+
+# Once the cache is full, evict down to this fraction of its size, so not every new entry requires an eviction.
+EVICTION_WATERMARK = 0.9
+
+
+class ObjectCache:
+    """Directory with downloaded objects, shared by the worker processes on a node.
+
+    Entries are immutable files named after a hash of their name, which includes the ETag for objects, so a replaced
+    object is never served from the cache. Entries are grouped in shards that are locked with `flock` while an entry
+    is created or used, so concurrent processes download an object only once and never evict an entry in use. The
+    least recently used entries are evicted when the total size exceeds the maximum size.
+    """
+
+    def __init__(self, directory: Path, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        # Estimated total size of the entries, updated on every scan of the cache directory.
+        self.size: Optional[int] = None
+        self.size_lock = Lock()
+
+    def _paths(self, name: str) -> Tuple[Path, Path]:
+        digest = sha256(name.encode("UTF-8")).hexdigest()
+        return (
+            self.directory / "objects" / digest[:2] / digest,
+            self.directory / "locks" / digest[:2],
+        )
+
+    @contextmanager
+    def _lock(self, lock_path: Path, operation: int) -> Iterator[None]:
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        # The lock is released when the file is closed.
+        with lock_path.open("a") as fd:
+            fcntl.flock(fd, operation)
+            yield
+
+    @contextmanager
+    def entry(
+        self, name: str, size: int, create: Callable[[Path], None]
+    ) -> Iterator[Optional[Path]]:
+        """Yields the path of the entry with the given name, calling `create` with the path if the entry does not
+        exist yet. The entry cannot be evicted until the with block exits.
+
+        Yields None if an entry of the given size does not fit in the cache."""
+        if size > self.max_size:
+            yield None
+            return
+
+        path, lock_path = self._paths(name)
+        added = 0
+        with self._lock(lock_path, fcntl.LOCK_EX):
+            if path.exists():
+                # The modification time records when the entry was last used.
+                os.utime(path)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                create(path)
+                # Entries are shared through hard links, so prevent them from being modified in place.
+                path.chmod(0o444)
+                added = path.stat().st_size
+            yield path
+
+        if added:
+            self._reserve(added)
+
+    def _reserve(self, added: int) -> None:
+        with self.size_lock:
+            if self.size == None:
+                self.size = self._scan()[0]
+            else:
+                self.size += added
+            if self.size > self.max_size:
+                self.size = self._evict(int(self.max_size * EVICTION_WATERMARK))
+
+    def _scan(self) -> Tuple[int, List[Tuple[float, int, str]]]:
+        # Modification time, size and path of every file, including partial downloads.
+        entries = []
+        objects = self.directory / "objects"
+        for shard in objects.iterdir() if objects.exists() else []:
+            for path in shard.iterdir():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, str(path)))
+        return sum(size for _, size, _ in entries), entries
+
+    def _evict(self, target_size: int) -> int:
+        # One process evicts at a time, the others rely on its result.
+        with self._lock(self.directory / "evict.lock", fcntl.LOCK_EX):
+            size, entries = self._scan()
+            for _, entry_size, path in sorted(entries):
+                if size <= target_size:
+                    break
+                lock_path = self.directory / "locks" / Path(path).parent.name
+                try:
+                    with self._lock(lock_path, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                        os.unlink(path)
+                        size -= entry_size
+                except (BlockingIOError, FileNotFoundError):
+                    # In use by another process or thread, or already evicted.
+                    continue
+            return size
+
+
+def _link_or_copy(source: Path, target: Path) -> None:
+    try:
+        os.link(source, target)
+    except OSError:
+        # Across file systems, or on file systems without hard links.
+        shutil.copyfile(source, target)
+
+
+def download_cached_file(
+    cache: ObjectCache,
+    client: Minio,
+    bucket: str,
+    key: str,
+    path: Path,
+    options: TransferOptions,
+) -> Mapping[str, str]:
+    """Downloads an object through the cache and returns its metadata."""
+    stat = client.stat_object(bucket, key)
+    with cache.entry(
+        f"{bucket}/{key}/{stat.etag}",
+        stat.size,
+        # Entries have the same path in every process, so an interrupted download is resumed by the next one.
+        lambda cache_path: download_file(
+            client, bucket, key, cache_path, options, stat, resume=True
+        ),
+    ) as cache_path:
+        if cache_path:
+            _link_or_copy(cache_path, path)
+        else:
+            download_file(client, bucket, key, path, options, stat)
+    return stat.metadata
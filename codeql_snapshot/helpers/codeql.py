@@ -1,20 +1,211 @@
 import subprocess
 import json
 import semantic_version
+from dataclasses import dataclass
+from hashlib import sha256
 from pathlib import Path
+from select import select
+from threading import Lock, Thread
+from time import monotonic
+from typing import Optional, List, Dict, Any
+import os
+
+# Maximum number of seconds a new CLI server can take to run its first command.
+SERVER_START_TIMEOUT = 120
 
 
 class CodeQLException(Exception):
     pass
 
 
+@dataclass(frozen=True)
+class QueryEnvironment:
+    """The CodeQL version and the query packs it resolves, which determine the compiled queries and the results of
+    an analysis."""
+
+    version: semantic_version.Version
+    packs: Dict[str, Any]
+
+    def digest(self) -> str:
+        return sha256(
+            json.dumps(
+                {"version": str(self.version), "packs": self.packs}, sort_keys=True
+            ).encode("UTF-8")
+        ).hexdigest()
+
+
+class CliServerUnavailable(Exception):
+    pass
+
+
+class CliServer:
+    """A `codeql execute cli-server` process, which runs CodeQL commands one after the other in a single JVM.
+
+    A command is sent as a JSON array of its arguments followed by a NUL byte. The server writes the output of a
+    successful command to stdout followed by a NUL byte, and exits when a command fails.
+    """
+
+    def __init__(self) -> None:
+        self.process = subprocess.Popen(
+            ["codeql", "execute", "cli-server"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.stderr: List[bytes] = []
+        self.stderr_lock = Lock()
+        # The server keeps logging to stderr, so it is drained continuously to prevent the server from blocking.
+        self.stderr_reader = Thread(target=self._read_stderr, daemon=True)
+        self.stderr_reader.start()
+
+    def _read_stderr(self) -> None:
+        assert self.process.stderr
+        for line in self.process.stderr:
+            with self.stderr_lock:
+                self.stderr.append(line)
+
+    def is_alive(self) -> bool:
+        return self.process.poll() == None
+
+    def run(
+        self, args: List[str], timeout: Optional[float] = None
+    ) -> subprocess.CompletedProcess[str]:
+        assert self.process.stdin and self.process.stdout
+        with self.stderr_lock:
+            self.stderr = []
+        try:
+            self.process.stdin.write(json.dumps(args).encode("UTF-8") + b"\0")
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            # The server exited before it received the command.
+            raise CliServerUnavailable()
+
+        deadline = monotonic() + timeout if timeout else None
+        stdout = bytearray()
+        returncode = 0
+        while not stdout.endswith(b"\0"):
+            remaining = max(0, deadline - monotonic()) if deadline else None
+            if not select([self.process.stdout], [], [], remaining)[0]:
+                # The server is busy with the command, so it would not exit when its input is closed.
+                self.process.kill()
+                self.process.wait()
+                raise subprocess.TimeoutExpired(["codeql"] + args, timeout or 0)
+            data = os.read(self.process.stdout.fileno(), 64 * 1024)
+            if not data:
+                # The server exits with the exit code of a failed command. Exiting without an error still fails it.
+                returncode = self.process.wait() or 1
+                self.stderr_reader.join()
+                break
+            stdout += data
+
+        with self.stderr_lock:
+            stderr = b"".join(self.stderr)
+        return subprocess.CompletedProcess(
+            ["codeql"] + args,
+            returncode,
+            stdout.rstrip(b"\0").decode("UTF-8", errors="replace"),
+            stderr.decode("UTF-8", errors="replace"),
+        )
+
+    def close(self) -> None:
+        if self.process.stdin:
+            try:
+                # The server exits once its input is closed.
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class CliServerPool:
+    """CodeQL CLI servers shared by the jobs of a worker, so the JVM is started once instead of for every command.
+
+    A server runs a single command at a time, so a server is started for every command running concurrently. Servers
+    that exit, because a command failed, are replaced. When a new server does not work, commands fall back to
+    running in a process of their own.
+    """
+
+    def __init__(self) -> None:
+        self.idle: List[CliServer] = []
+        self.lock = Lock()
+        self.available = True
+
+    def _start(self) -> Optional[CliServer]:
+        try:
+            server = CliServer()
+            # Check that the server works, so a failing server is not mistaken for failing commands.
+            cp = server.run(["version", "--format=json"], SERVER_START_TIMEOUT)
+            if cp.returncode == 0:
+                return server
+            server.close()
+        except (OSError, CliServerUnavailable, subprocess.TimeoutExpired):
+            pass
+        with self.lock:
+            self.available = False
+        return None
+
+    def run(
+        self, args: List[str], timeout: Optional[float] = None
+    ) -> Optional[subprocess.CompletedProcess[str]]:
+        """Runs the command on an idle server, or on a new one if all servers are busy.
+
+        Returns None if the command could not be sent to a server, in which case it has not been run.
+        """
+        with self.lock:
+            if not self.available:
+                return None
+            server = self.idle.pop() if self.idle else None
+        if not server:
+            server = self._start()
+            if not server:
+                return None
+
+        try:
+            result = server.run(args, timeout)
+        except CliServerUnavailable:
+            server.close()
+            return None
+        if server.is_alive():
+            with self.lock:
+                self.idle.append(server)
+        return result
+
+    def close(self) -> None:
+        with self.lock:
+            servers = self.idle
+            self.idle = []
+        for server in servers:
+            server.close()
+
+
 class CodeQL:
+    def __init__(
+        self, timeout: Optional[float] = None, servers: Optional[CliServerPool] = None
+    ) -> None:
+        # Maximum number of seconds a single codeql command is allowed to run, so a hung extractor cannot block a worker forever.
+        self.timeout = timeout
+        # Runs the commands on long-lived CLI servers if provided, instead of starting a new process for every command.
+        self.servers = servers
+
     def _exec(self, command: str, *args: str) -> subprocess.CompletedProcess[str]:
         try:
+            if self.servers:
+                cp = self.servers.run([command] + [arg for arg in args], self.timeout)
+                if cp:
+                    return cp
             return subprocess.run(
                 ["codeql", command] + [arg for arg in args],
                 capture_output=True,
                 text=True,
+                timeout=self.timeout,
+            )
+        except subprocess.TimeoutExpired as e:
+            raise CodeQLException(
+                f"The codeql command {e.cmd} did not complete within {e.timeout} seconds!"
             )
         except OSError as e:
             raise CodeQLException(
@@ -29,6 +220,16 @@ class CodeQL:
         else:
             raise CodeQLException(f"Failed to run {cp.args} command!")
 
+    def resolve_qlpacks(self) -> Dict[str, Any]:
+        cp = self._exec("resolve", "qlpacks", "--format=json")
+        if cp.returncode == 0:
+            return json.loads(cp.stdout)
+        else:
+            raise CodeQLException(f"Failed to run {cp.args} command!")
+
+    def query_environment(self) -> QueryEnvironment:
+        return QueryEnvironment(self.version(), self.resolve_qlpacks())
+
     def database_create(
         self,
         language: str,
@@ -53,6 +254,44 @@ class CodeQL:
         if cp.returncode != 0:
             raise CodeQLException(f"Failed to run {cp.args} command!")
 
+    def database_create_cluster(
+        self,
+        languages: List[str],
+        source_root: Path,
+        cluster: Path,
+        **kwargs: str,
+    ) -> None:
+        """Creates a database per language in a subdirectory of the cluster named after the language, extracting the
+        source root once."""
+        arguments = [
+            "database",
+            "create",
+            "--db-cluster",
+            f"--language={','.join(languages)}",
+            f"--source-root={source_root}",
+        ]
+
+        for key, value in kwargs.items():
+            arguments.append(f"--{key}={value}")
+
+        cp = self._exec(
+            *arguments,
+            str(cluster),
+        )
+        if cp.returncode != 0:
+            raise CodeQLException(f"Failed to run {cp.args} command!")
+
+    def database_cleanup(self, database: Path) -> None:
+        cp = self._exec(
+            "database",
+            "cleanup",
+            "--mode=brutal",
+            str(database),
+        )
+
+        if cp.returncode != 0:
+            raise CodeQLException(f"Failed to run {cp.args} command!")
+
     def database_bundle(self, database: Path) -> Path:
         bundle_path = database.with_suffix(".zip")
 
@@ -90,7 +329,7 @@ class CodeQL:
             f"--output={sarif}",
             "--sarif-add-file-contents",
             *[f"--{key}={value}" for key, value in kwargs.items()],
-            str(database)
+            str(database),
         )
 
         if cp.returncode != 0:
@@ -0,0 +1,130 @@
+import fcntl
+import json
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Dict, Any, Iterator, Tuple
+from codeql_snapshot.helpers.codeql import CodeQL
+import os
+import time
+
+# Directory shared by all CodeQL versions, for the query packs CodeQL downloads.
+COMMON_CACHES = "common"
+# Records the CodeQL version and query packs the queries in a cache directory were compiled with.
+METADATA = "cache.json"
+# Records the size and last use of every cache directory, so eviction does not have to measure all of them.
+INDEX = "index.json"
+
+
+class CompilationCache:
+    """Directory with compiled queries, shared by the analyses of all workers on a node.
+
+    Compiled queries depend on the CodeQL version and the query packs, so there is a directory per combination of
+    both. A directory is locked while an analysis uses it. After every analysis the size of its directory is recorded
+    in an index, and the least recently used directories are removed when the total size in the index exceeds the
+    maximum size. Directories of CodeQL versions no longer in use are therefore removed first.
+    """
+
+    def __init__(self, directory: Path, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        # Resolved once, the CodeQL installation of a worker does not change while it runs.
+        self.key: Optional[Tuple[str, Dict[str, Any]]] = None
+        self.key_lock = Lock()
+
+    def _resolve_key(self, codeql: CodeQL) -> Tuple[str, Dict[str, Any]]:
+        with self.key_lock:
+            if not self.key:
+                environment = codeql.query_environment()
+                self.key = (
+                    f"{environment.version}-{environment.digest()[:16]}",
+                    {"version": str(environment.version), "packs": environment.packs},
+                )
+            return self.key
+
+    def _lock_path(self, name: str) -> Path:
+        return self.directory / "locks" / name
+
+    @contextmanager
+    def _lock(self, lock_path: Path, operation: int) -> Iterator[None]:
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        # The lock is released when the file is closed.
+        with lock_path.open("a") as fd:
+            fcntl.flock(fd, operation)
+            yield
+
+    def _prepare(self, path: Path, metadata: Dict[str, Any]) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        metadata_path = path / METADATA
+        if (
+            not metadata_path.exists()
+            or json.loads(metadata_path.read_text()) != metadata
+        ):
+            # Queries compiled by another CodeQL installation cannot be trusted, start over.
+            shutil.rmtree(path)
+            path.mkdir()
+            metadata_path.write_text(json.dumps(metadata))
+
+    @contextmanager
+    def use(self, codeql: CodeQL) -> Iterator[Dict[str, str]]:
+        """Yields the options that point a CodeQL analysis at the cache. The cache directory of the analysis cannot
+        be removed until the with block exits."""
+        key, metadata = self._resolve_key(codeql)
+        path = self.directory / key
+        try:
+            while True:
+                with self._lock(self._lock_path(key), fcntl.LOCK_EX):
+                    self._prepare(path, metadata)
+                # Other analyses can use the directory concurrently. A shared lock cannot be acquired atomically in
+                # place of an exclusive one, so the directory can be evicted in between and is then prepared again.
+                with self._lock(self._lock_path(key), fcntl.LOCK_SH):
+                    if (path / METADATA).exists():
+                        yield {
+                            "compilation-cache": str(path),
+                            "common-caches": str(self.directory / COMMON_CACHES),
+                        }
+                        break
+        finally:
+            self._record(key)
+
+    def _record(self, key: str) -> None:
+        # Measured outside of the index lock, only the directory of the analysis can have grown.
+        size = _directory_size(self.directory / key)
+        # One process updates the index at a time.
+        with self._lock(self.directory / "index.lock", fcntl.LOCK_EX):
+            index_path = self.directory / INDEX
+            index: Dict[str, Dict[str, float]] = (
+                json.loads(index_path.read_text()) if index_path.exists() else {}
+            )
+            index[key] = {"size": size, "used": time.time()}
+            total = sum(entry["size"] for entry in index.values())
+            for name, entry in sorted(index.items(), key=lambda item: item[1]["used"]):
+                if total <= self.max_size:
+                    break
+                try:
+                    with self._lock(
+                        self._lock_path(name), fcntl.LOCK_EX | fcntl.LOCK_NB
+                    ):
+                        shutil.rmtree(self.directory / name, ignore_errors=True)
+                except BlockingIOError:
+                    # In use by another analysis.
+                    continue
+                total -= entry["size"]
+                del index[name]
+
+            partial_path = index_path.with_name(f"{INDEX}.part")
+            partial_path.write_text(json.dumps(index))
+            os.replace(partial_path, index_path)
+
+
+def _directory_size(path: Path) -> int:
+    size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                # Removed by a concurrent analysis.
+                continue
+    return size
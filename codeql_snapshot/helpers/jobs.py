@@ -0,0 +1,727 @@
+import click
+from dataclasses import dataclass
+from sqlalchemy import Engine
+from typing import Optional, Dict, List, Set, Callable, TypeVar, Any, Tuple
+from codeql_snapshot.models import SnapshotState
+from codeql_snapshot.helpers.queue import (
+    SnapshotJob,
+    Lease,
+    Heartbeat,
+    claim_snapshots,
+    claim_source_snapshots,
+    release_snapshots,
+    update_snapshot_state,
+    find_reusable_snapshot,
+    get_analysis_fingerprint,
+    BUILT_STATES,
+)
+from codeql_snapshot.helpers.object_store import (
+    has_source_object,
+    get_source_object,
+    extract_source_manifest,
+    create_database_object,
+    has_database_object,
+    get_database_object,
+    get_database_object_etag,
+    copy_database_object,
+    create_sarif_object,
+    has_sarif_object,
+    copy_sarif_object,
+)
+from codeql_snapshot.helpers.archive import (
+    ArchiveFormat,
+    STORED,
+    BUNDLE,
+    archive_dir,
+    extract_archive,
+)
+from codeql_snapshot.helpers.codeql import CodeQL, CodeQLException
+from codeql_snapshot.helpers.compilation_cache import CompilationCache
+from codeql_snapshot.helpers.sarif import store_results, copy_results
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from subprocess import run, TimeoutExpired
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from hashlib import sha256
+from threading import Lock
+import json
+import shlex
+import shutil
+import os
+
+T = TypeVar("T")
+
+# Memory left for the operating system and the worker itself, such as the CodeQL CLI servers, when splitting the
+# memory between concurrent jobs.
+RESERVED_MEMORY = 1024 * 1024 * 1024
+
+
+def resource_budget(jobs: int, reserved_per_job: int = 0) -> Dict[str, str]:
+    """Split the cores and memory available to this process evenly between the given number of concurrent jobs.
+
+    The memory the worker itself uses for every job, such as its transfer buffers, is reserved before the rest is
+    split, together with a margin for the operating system and the worker. The result can be passed as keyword
+    arguments to the CodeQL database commands."""
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+
+    budget = {"threads": str(max(1, cores // jobs))}
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        # At least half of the memory is left for CodeQL, a smaller budget would fail every job on small machines.
+        available = max(memory // 2, memory - RESERVED_MEMORY - reserved_per_job * jobs)
+        budget["ram"] = str(max(1, available // (1024 * 1024) // jobs))
+    except (ValueError, OSError, AttributeError):
+        # Let CodeQL determine the amount of memory to use if we cannot determine it.
+        pass
+    return budget
+
+
+def run_in_parallel(
+    jobs: List[SnapshotJob], run: Callable[[SnapshotJob], T], parallelism: int
+) -> List[T]:
+    # The heavy lifting happens in CodeQL subprocesses, so threads are sufficient to keep multiple jobs running
+    # while sharing the database engine and the object store client.
+    if parallelism == 1 or len(jobs) <= 1:
+        return [run(job) for job in jobs]
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        return list(executor.map(run, jobs))
+
+
+@dataclass
+class JobResult:
+    state: Optional[SnapshotState]
+    database: Optional[Path] = None
+    sarif: Optional[Path] = None
+    database_format: ArchiveFormat = BUNDLE
+    # Snapshot whose database, and results if analyzed, are copied instead of building a new database.
+    reused_from: Optional[str] = None
+    # Results of the snapshots built together in a database cluster, published instead of this result.
+    cluster: Optional[List[Tuple[SnapshotJob, "JobResult"]]] = None
+
+
+def analyze_database(
+    codeql: CodeQL,
+    job: SnapshotJob,
+    database_path: Path,
+    resources: Dict[str, str],
+    compilation_cache: Optional[CompilationCache] = None,
+) -> Path:
+    sarif_path = database_path.with_suffix(".sarif")
+
+    options = {"sarif-category": job.category} if job.category else {}
+    with (
+        compilation_cache.use(codeql) if compilation_cache else nullcontext({})
+    ) as cache_options:
+        codeql.database_analyze(
+            database_path, sarif_path, **options, **cache_options, **resources
+        )
+
+    return sarif_path
+
+
+def ingest_results(engine: Engine, job: SnapshotJob, sarif_path: Path) -> SnapshotState:
+    """Stores the results of the SARIF file of an analysis, returning the state of the analyzed snapshot."""
+    try:
+        stored = store_results(engine, job.global_id, sarif_path)
+        click.echo(f"Stored {stored} result(s) of snapshot {job.global_id}.")
+        return SnapshotState.ANALYZED
+    except ValueError as e:
+        click.echo(
+            f"Failed to read the results of snapshot {job.global_id} with error {e}"
+        )
+        return SnapshotState.ANALYSIS_FAILED
+
+
+class JobRunner:
+    """Processes claimed snapshots in three steps so they can be pipelined.
+
+    The fetch step downloads the inputs from the object store, the execute step runs CodeQL on the local inputs,
+    and the publish step uploads the produced artifacts and records the new state of the snapshot.
+    """
+
+    name: str
+    state: SnapshotState
+    retry_state: SnapshotState
+    claimed_state: SnapshotState
+    failed_state: SnapshotState
+
+    def __init__(
+        self,
+        ctx: click.Context,
+        resources: Optional[Dict[str, str]] = None,
+        lease_duration: timedelta = timedelta(minutes=5),
+        timeout: Optional[float] = None,
+        fair_share: bool = False,
+    ) -> None:
+        self.ctx = ctx
+        self.resources = resources or {}
+        self.timeout = timeout
+        self.fair_share = fair_share
+        self.lease = Lease(lease_duration)
+        self.heartbeat = Heartbeat(self.engine, self.lease)
+
+    @property
+    def engine(self) -> Engine:
+        return self.ctx.obj["database"]["engine"]
+
+    def claim(
+        self,
+        label: Optional[str],
+        retry: bool = False,
+        snapshot_global_id: Optional[str] = None,
+        batch: int = 1,
+    ) -> List[SnapshotJob]:
+        jobs = claim_snapshots(
+            self.engine,
+            self.retry_state if retry else self.state,
+            self.claimed_state,
+            label,
+            self.lease,
+            snapshot_global_id,
+            batch,
+            self.fair_share,
+        )
+        self.heartbeat.add(jobs)
+        return jobs
+
+    def release(self, jobs: List[SnapshotJob]) -> None:
+        self.heartbeat.remove(jobs)
+        release_snapshots(self.engine, jobs, self.claimed_state, self.state, self.lease)
+
+    def fetch(self, job: SnapshotJob, directory: Path) -> Optional[Path]:
+        raise NotImplementedError()
+
+    def execute(
+        self, job: SnapshotJob, input: Optional[Path], directory: Path
+    ) -> JobResult:
+        raise NotImplementedError()
+
+    def publish(self, job: SnapshotJob, result: JobResult) -> None:
+        raise NotImplementedError()
+
+    def update_state(
+        self,
+        job: SnapshotJob,
+        newstate: SnapshotState,
+        build_command: Optional[str] = None,
+        analysis_fingerprint: Optional[str] = None,
+    ) -> None:
+        self.heartbeat.remove([job])
+        if not update_snapshot_state(
+            self.engine,
+            job.global_id,
+            self.claimed_state,
+            newstate,
+            self.lease,
+            build_command,
+            analysis_fingerprint,
+        ):
+            click.echo(
+                f"Could not find snapshot to update state from {self.claimed_state} to {newstate}!"
+            )
+
+    def fail(self, job: SnapshotJob, error: Exception) -> None:
+        """Marks the snapshot of a job that raised an unexpected error as failed, so a snapshot that cannot be
+        processed does not stop the worker nor stay claimed until its lease expires."""
+        click.echo(
+            f"Failed to {self.name} snapshot {job.global_id} with error {error!r}"
+        )
+        try:
+            self.update_state(job, self.failed_state)
+        finally:
+            self.heartbeat.remove([job])
+
+    def run(self, job: SnapshotJob) -> None:
+        try:
+            with TemporaryDirectory() as tmpdir:
+                directory = Path(tmpdir)
+                input = self.fetch(job, directory)
+                self.publish(job, self.execute(job, input, directory))
+        except Exception as e:
+            self.fail(job, e)
+
+
+class BuildJobRunner(JobRunner):
+    name = "build"
+    state = SnapshotState.NOT_BUILT
+    retry_state = SnapshotState.BUILD_FAILED
+    claimed_state = SnapshotState.BUILD_IN_PROGRESS
+    failed_state = SnapshotState.BUILD_FAILED
+
+    def __init__(
+        self,
+        ctx: click.Context,
+        command: Optional[str] = None,
+        exec: Optional[str] = None,
+        analyze: bool = False,
+        reuse: bool = True,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(ctx, **kwargs)
+        self.command = command
+        self.exec = exec
+        # Analyze the database on local disk right after it is built, skipping the round trip through the object store.
+        self.analyze = analyze
+        self.database_format: ArchiveFormat = ctx.obj["storage"]["formats"]["database"]
+        # Reuse the database of a snapshot of the same commit that was built the same way, e.g. on another branch.
+        self.reuse = reuse
+        if command:
+            self.build_command = f"command {command}"
+        elif exec:
+            self.build_command = f"exec {exec}"
+        else:
+            self.build_command = "autobuild"
+        self.reusable: Dict[str, Tuple[str, SnapshotState]] = {}
+
+    def find_reusable(self, job: SnapshotJob) -> Optional[Tuple[str, SnapshotState]]:
+        found = find_reusable_snapshot(self.engine, job.global_id, self.build_command)
+        if not found or not has_database_object(self.ctx, found[0]):
+            return None
+        global_id, state = found
+        if state == SnapshotState.ANALYZED and has_sarif_object(self.ctx, global_id):
+            return global_id, SnapshotState.ANALYZED
+        # The reused database still has to be analyzed for this snapshot.
+        return global_id, SnapshotState.NOT_ANALYZED
+
+    def fetch(self, job: SnapshotJob, directory: Path) -> Optional[Path]:
+        if self.reuse:
+            reusable = self.find_reusable(job)
+            if reusable:
+                # Nothing to download, the objects are copied by the object store when publishing.
+                self.reusable[job.global_id] = reusable
+                return None
+
+        return self.fetch_source(job, directory)
+
+    def fetch_source(self, job: SnapshotJob, directory: Path) -> Optional[Path]:
+        if not has_source_object(self.ctx, job.source_id):
+            return None
+
+        tmpzip = (directory / job.source_id).with_suffix(".zip")
+
+        format = get_source_object(self.ctx, job.source_id, tmpzip)
+
+        tmp_source_root: Path = directory / job.source_id
+        tmp_source_root.mkdir()
+
+        if format.codec == "manifest":
+            extract_source_manifest(self.ctx, tmpzip, tmp_source_root)
+        else:
+            extract_archive(tmpzip, tmp_source_root, format)
+        tmpzip.unlink()
+
+        return tmp_source_root
+
+    def execute(
+        self, job: SnapshotJob, input: Optional[Path], directory: Path
+    ) -> JobResult:
+        reusable = self.reusable.pop(job.global_id, None)
+        if reusable:
+            click.echo(f"Reusing the database of snapshot {reusable[0]}.")
+            return JobResult(reusable[1], reused_from=reusable[0])
+
+        if not input:
+            return JobResult(SnapshotState.SNAPSHOT_FAILED)
+
+        database_path = directory / f"{job.global_id}-db"
+        codeql = CodeQL(self.timeout, self.ctx.obj["codeql"]["servers"])
+        try:
+            if self.command:
+                codeql.database_create(
+                    job.language,
+                    input,
+                    database_path,
+                    command=self.command,
+                    **self.resources,
+                )
+            elif self.exec:
+                args = shlex.split(self.exec) + [
+                    job.language,
+                    str(input),
+                    str(database_path),
+                ]
+
+                env = dict(os.environ)
+                if "threads" in self.resources:
+                    env["CODEQL_THREADS"] = self.resources["threads"]
+                if "ram" in self.resources:
+                    env["CODEQL_RAM"] = self.resources["ram"]
+
+                try:
+                    cp = run(args, env=env, timeout=self.timeout)
+                    if cp.returncode != 0:
+                        raise CodeQLException("custom build execution failed!")
+                except TimeoutExpired as e:
+                    raise CodeQLException(
+                        f"Custom build command did not complete within {e.timeout} seconds!"
+                    )
+                except OSError as e:
+                    raise CodeQLException(
+                        f"Failed to execute custom build command with error: {e.strerror}!"
+                    )
+            else:
+                codeql.database_create(
+                    job.language, input, database_path, **self.resources
+                )
+
+            return self.complete(job, codeql, database_path)
+        except CodeQLException as e:
+            click.echo(f"Failed to create database with error {e}")
+            return self.failed(database_path)
+
+    def complete(
+        self, job: SnapshotJob, codeql: CodeQL, database_path: Path
+    ) -> JobResult:
+        """Analyzes the built database if requested and archives it for the upload."""
+        sarif_path: Optional[Path] = None
+        newstate = SnapshotState.NOT_ANALYZED
+        if self.analyze:
+            try:
+                sarif_path = analyze_database(
+                    codeql,
+                    job,
+                    database_path,
+                    self.resources,
+                    self.ctx.obj["codeql"]["compilation_cache"],
+                )
+                newstate = SnapshotState.ANALYZED
+            except CodeQLException as e:
+                click.echo(f"Failed to analyze database with error {e}")
+                newstate = SnapshotState.ANALYSIS_FAILED
+
+        if self.database_format == BUNDLE:
+            bundle_path = codeql.database_bundle(database_path)
+        else:
+            codeql.database_cleanup(database_path)
+            bundle_path = database_path.with_suffix(self.database_format.suffix)
+            archive_dir(database_path, bundle_path, self.database_format)
+        return JobResult(newstate, bundle_path, sarif_path, self.database_format)
+
+    def failed(self, database_path: Path) -> JobResult:
+        if database_path.exists():
+            # Keep the partial database for troubleshooting, CodeQL cannot bundle it.
+            format = STORED if self.database_format == BUNDLE else self.database_format
+            zipped_database_path = database_path.with_suffix(format.suffix)
+            archive_dir(database_path, zipped_database_path, format)
+            return JobResult(
+                SnapshotState.BUILD_FAILED,
+                zipped_database_path,
+                database_format=format,
+            )
+        return JobResult(SnapshotState.BUILD_FAILED)
+
+    def fail(self, job: SnapshotJob, error: Exception) -> None:
+        self.reusable.pop(job.global_id, None)
+        super().fail(job, error)
+
+    def publish(self, job: SnapshotJob, result: JobResult) -> None:
+        state = result.state
+        if result.reused_from:
+            copy_database_object(self.ctx, result.reused_from, job.global_id)
+            if result.state == SnapshotState.ANALYZED:
+                copy_sarif_object(self.ctx, result.reused_from, job.global_id)
+                copy_results(self.engine, result.reused_from, job.global_id)
+        else:
+            self.upload(job, result)
+            if result.sarif:
+                state = ingest_results(self.engine, job, result.sarif)
+        if state:
+            self.update_state(
+                job,
+                state,
+                self.build_command if state in BUILT_STATES else None,
+            )
+
+    def upload(self, job: SnapshotJob, result: JobResult) -> None:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            uploads = []
+            if result.database:
+                uploads.append(
+                    executor.submit(
+                        create_database_object,
+                        self.ctx,
+                        job.global_id,
+                        result.database,
+                        result.database_format,
+                    )
+                )
+            if result.sarif:
+                uploads.append(
+                    executor.submit(
+                        create_sarif_object, self.ctx, job.global_id, result.sarif
+                    )
+                )
+            for upload in uploads:
+                upload.result()
+
+
+class ClusterBuildJobRunner(BuildJobRunner):
+    """Builds the databases of all the languages of a source with a single CodeQL database cluster run.
+
+    The waiting snapshots of a source are claimed together and processed as a single job, identified by one of them,
+    so the source is downloaded and extracted once. Custom build executables build a single language and cannot be
+    used.
+    """
+
+    def __init__(self, ctx: click.Context, *args: Any, **kwargs: Any) -> None:
+        super().__init__(ctx, *args, **kwargs)
+        if self.exec:
+            raise ValueError("Cannot build a database cluster with a custom build!")
+        self.clusters: Dict[str, List[SnapshotJob]] = {}
+
+    def claim(
+        self,
+        label: Optional[str],
+        retry: bool = False,
+        snapshot_global_id: Optional[str] = None,
+        batch: int = 1,
+    ) -> List[SnapshotJob]:
+        jobs = super().claim(label, retry, snapshot_global_id, batch)
+        if not jobs:
+            return jobs
+
+        siblings = claim_source_snapshots(
+            self.engine,
+            self.retry_state if retry else self.state,
+            self.claimed_state,
+            label,
+            self.lease,
+            {job.source_id for job in jobs},
+        )
+        self.heartbeat.add(siblings)
+
+        clusters: Dict[str, List[SnapshotJob]] = {}
+        for job in jobs + siblings:
+            clusters.setdefault(job.source_id, []).append(job)
+        for members in clusters.values():
+            self.clusters[members[0].global_id] = members
+        return [members[0] for members in clusters.values()]
+
+    def release(self, jobs: List[SnapshotJob]) -> None:
+        super().release(
+            [
+                member
+                for job in jobs
+                for member in self.clusters.pop(job.global_id, [job])
+            ]
+        )
+
+    def fail(self, job: SnapshotJob, error: Exception) -> None:
+        for member in self.clusters.pop(job.global_id, [job]):
+            super().fail(member, error)
+
+    def fetch(self, job: SnapshotJob, directory: Path) -> Optional[Path]:
+        members = self.clusters[job.global_id]
+        if self.reuse:
+            for member in members:
+                reusable = self.find_reusable(member)
+                if reusable:
+                    self.reusable[member.global_id] = reusable
+            if all(member.global_id in self.reusable for member in members):
+                return None
+
+        return self.fetch_source(job, directory)
+
+    def execute(
+        self, job: SnapshotJob, input: Optional[Path], directory: Path
+    ) -> JobResult:
+        results: List[Tuple[SnapshotJob, JobResult]] = []
+        members: List[SnapshotJob] = []
+        for member in self.clusters[job.global_id]:
+            reusable = self.reusable.pop(member.global_id, None)
+            if reusable:
+                click.echo(
+                    f"Reusing the database of snapshot {reusable[0]} for snapshot {member.global_id}."
+                )
+                results.append(
+                    (member, JobResult(reusable[1], reused_from=reusable[0]))
+                )
+            else:
+                members.append(member)
+
+        if not members:
+            return JobResult(None, cluster=results)
+        if not input:
+            return JobResult(
+                None,
+                cluster=results
+                + [
+                    (member, JobResult(SnapshotState.SNAPSHOT_FAILED))
+                    for member in members
+                ],
+            )
+
+        languages = sorted({member.language for member in members})
+        click.echo(
+            f"Building a database cluster for {', '.join(languages)} from source {job.source_id}."
+        )
+        cluster_path = directory / f"{job.source_id}-db"
+        codeql = CodeQL(self.timeout, self.ctx.obj["codeql"]["servers"])
+        built = True
+        try:
+            options = {"command": self.command} if self.command else {}
+            codeql.database_create_cluster(
+                languages, input, cluster_path, **options, **self.resources
+            )
+        except CodeQLException as e:
+            click.echo(f"Failed to create database cluster with error {e}")
+            built = False
+
+        # Move every database to the location of a single build before any of them is archived, snapshots of the
+        # same language but a different category get a copy.
+        database_paths: Dict[str, Path] = {}
+        for member in members:
+            database_path = directory / f"{member.global_id}-db"
+            if member.language in database_paths:
+                shutil.copytree(database_paths[member.language], database_path)
+            elif (cluster_path / member.language).exists():
+                (cluster_path / member.language).rename(database_path)
+                database_paths[member.language] = database_path
+
+        for member in members:
+            database_path = directory / f"{member.global_id}-db"
+            if not built:
+                results.append((member, self.failed(database_path)))
+                continue
+            try:
+                results.append((member, self.complete(member, codeql, database_path)))
+            except CodeQLException as e:
+                click.echo(f"Failed to create database with error {e}")
+                results.append((member, self.failed(database_path)))
+
+        return JobResult(None, cluster=results)
+
+    def publish(self, job: SnapshotJob, result: JobResult) -> None:
+        members = self.clusters[job.global_id]
+        for member, member_result in result.cluster or []:
+            super().publish(member, member_result)
+            # No longer claimed, so it is not failed when publishing a later member fails.
+            members.remove(member)
+        del self.clusters[job.global_id]
+
+
+class AnalysisJobRunner(JobRunner):
+    name = "analyze"
+    state = SnapshotState.NOT_ANALYZED
+    retry_state = SnapshotState.ANALYSIS_FAILED
+    claimed_state = SnapshotState.ANALYSIS_IN_PROGRESS
+    failed_state = SnapshotState.ANALYSIS_FAILED
+
+    def __init__(self, ctx: click.Context, force: bool = False, **kwargs: Any) -> None:
+        super().__init__(ctx, **kwargs)
+        # Analyze snapshots even if their results are up to date.
+        self.force = force
+        # Resolved once, the CodeQL installation of a worker does not change while it runs.
+        self.query_digest: Optional[str] = None
+        self.query_digest_lock = Lock()
+        self.fingerprints: Dict[str, str] = {}
+        self.unchanged: Set[str] = set()
+
+    def fingerprint(self, database_etag: str) -> str:
+        """Identifies the inputs that determine the results of an analysis: the database, the CodeQL version and the
+        query packs."""
+        with self.query_digest_lock:
+            if not self.query_digest:
+                codeql = CodeQL(self.timeout, self.ctx.obj["codeql"]["servers"])
+                self.query_digest = codeql.query_environment().digest()
+        return sha256(
+            json.dumps(
+                {"database": database_etag, "queries": self.query_digest},
+                sort_keys=True,
+            ).encode("UTF-8")
+        ).hexdigest()
+
+    def fetch(self, job: SnapshotJob, directory: Path) -> Optional[Path]:
+        database_etag = get_database_object_etag(self.ctx, job.global_id)
+        if not database_etag:
+            return None
+
+        try:
+            fingerprint = self.fingerprint(database_etag)
+            self.fingerprints[job.global_id] = fingerprint
+            if (
+                not self.force
+                and get_analysis_fingerprint(self.engine, job.global_id) == fingerprint
+                and has_sarif_object(self.ctx, job.global_id)
+            ):
+                # Nothing to download, the results in the object store are up to date.
+                self.unchanged.add(job.global_id)
+                return None
+        except CodeQLException as e:
+            click.echo(
+                f"Failed to determine analysis fingerprint with error {e}, analyzing snapshot {job.global_id}."
+            )
+
+        tmpzip = (directory / job.global_id).with_suffix(".zip")
+
+        format = get_database_object(self.ctx, job.global_id, tmpzip)
+        if format == BUNDLE:
+            # Unbundled by CodeQL in the execute step.
+            return tmpzip
+
+        database_path = tmpzip.with_suffix("")
+        database_path.mkdir()
+        extract_archive(tmpzip, database_path, format)
+        tmpzip.unlink()
+        return database_path
+
+    def fail(self, job: SnapshotJob, error: Exception) -> None:
+        self.fingerprints.pop(job.global_id, None)
+        self.unchanged.discard(job.global_id)
+        super().fail(job, error)
+
+    def execute(
+        self, job: SnapshotJob, input: Optional[Path], directory: Path
+    ) -> JobResult:
+        if job.global_id in self.unchanged:
+            self.unchanged.discard(job.global_id)
+            click.echo(
+                f"Skipping analysis of snapshot {job.global_id}, its results are up to date."
+            )
+            return JobResult(SnapshotState.ANALYZED)
+
+        if not input:
+            click.echo(f"No database for snapshot with id {job.global_id}!")
+            return JobResult(SnapshotState.ANALYSIS_FAILED)
+
+        try:
+            codeql = CodeQL(self.timeout, self.ctx.obj["codeql"]["servers"])
+
+            if input.is_dir():
+                database_path = input
+            else:
+                codeql.database_unbundle(input)
+                database_path = input.with_suffix("")
+            sarif_path = analyze_database(
+                codeql,
+                job,
+                database_path,
+                self.resources,
+                self.ctx.obj["codeql"]["compilation_cache"],
+            )
+
+            return JobResult(SnapshotState.ANALYZED, sarif=sarif_path)
+        except CodeQLException as e:
+            click.echo(f"Failed to create database with error {e}")
+            return JobResult(SnapshotState.ANALYSIS_FAILED)
+
+    def publish(self, job: SnapshotJob, result: JobResult) -> None:
+        fingerprint = self.fingerprints.pop(job.global_id, None)
+        state = result.state
+        if result.sarif:
+            create_sarif_object(self.ctx, job.global_id, result.sarif)
+            state = ingest_results(self.engine, job, result.sarif)
+        if state:
+            self.update_state(
+                job,
+                state,
+                analysis_fingerprint=(
+                    fingerprint if state == SnapshotState.ANALYZED else None
+                ),
+            )
@@ -0,0 +1,316 @@
+import json
+import shutil
+import stat
+import tarfile
+import zlib
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+from pathlib import Path, PurePosixPath
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from threading import Lock
+from typing import (
+    IO,
+    Optional,
+    List,
+    Iterable,
+    Iterator,
+    Callable,
+    Tuple,
+    Set,
+    Deque,
+    ContextManager,
+)
+from minio import Minio
+from minio.commonconfig import CopySource, REPLACE
+from minio.error import S3Error
+from codeql_snapshot.helpers.archive import ArchiveFormat
+from codeql_snapshot.helpers.transfer import TransferOptions, ObjectWriter
+from codeql_snapshot.helpers.cache import ObjectCache
+from codeql_snapshot.helpers.zip import ZipError
+import click
+import os
+
+# Files are stored once in the source bucket, keyed by the SHA-256 digest of their content.
+BLOB_PREFIX = "blobs/"
+MANIFEST_VERSION = 1
+# Number of entries that can wait for their blob to be stored, per concurrent transfer.
+ENTRIES_PER_TRANSFER = 4
+# Size above which the content of a file read from a stream is kept on disk instead of in memory while it waits.
+SPOOL_SIZE = 1024 * 1024
+# Reused blobs last modified longer ago are copied onto themselves, so their modification time shows they are still
+# in use and reconcile does not consider them orphaned while the manifest referring to them is being stored.
+BLOB_REFRESH_AGE = timedelta(hours=1)
+
+Reader = Callable[[], ContextManager[IO[bytes]]]
+
+
+@dataclass
+class ManifestEntry:
+    """A file, directory or symbolic link of a source tree. Files refer to the blob with their content."""
+
+    path: str
+    type: str = "file"
+    mode: int = 0o644
+    blob: Optional[str] = None
+    size: int = 0
+    target: Optional[str] = None
+
+
+def blob_key(digest: str) -> str:
+    return f"{BLOB_PREFIX}{digest}"
+
+
+def blob_last_modified(client: Minio, bucket: str, digest: str) -> Optional[datetime]:
+    """Returns when the blob was last modified, or None if it does not exist."""
+    try:
+        return client.stat_object(bucket, blob_key(digest)).last_modified
+    except S3Error as err:
+        if err.code == "NoSuchKey":
+            return None
+        raise err
+
+
+def _reuse_blob(client: Minio, bucket: str, digest: str) -> bool:
+    """Returns whether the blob exists, refreshing its modification time if it has not been modified recently."""
+    last_modified = blob_last_modified(client, bucket, digest)
+    if not last_modified:
+        return False
+    if last_modified > datetime.now(timezone.utc) - BLOB_REFRESH_AGE:
+        return True
+    try:
+        client.copy_object(
+            bucket,
+            blob_key(digest),
+            CopySource(bucket, blob_key(digest)),
+            metadata_directive=REPLACE,
+        )
+        return True
+    except S3Error as err:
+        # Removed by reconcile in the meantime.
+        if err.code == "NoSuchKey":
+            return False
+        raise err
+
+
+def _read_chunks(fd: IO[bytes]) -> Iterator[bytes]:
+    return iter(lambda: fd.read(1024 * 1024), b"")
+
+
+def _rewind(spool: IO[bytes]) -> ContextManager[IO[bytes]]:
+    # A spool is read more than once, so it is not closed after reading. Its disk space is freed once the entry
+    # referring to it is gone.
+    spool.seek(0)
+    return nullcontext(spool)
+
+
+def tree_entries(
+    source_root: Path, paths: Iterable[Path]
+) -> Iterator[Tuple[ManifestEntry, Optional[Reader]]]:
+    """Describes the given paths below the source root. Symbolic links are followed, like for zip archives."""
+    for path in paths:
+        relative_path = path.relative_to(source_root).as_posix()
+        mode = stat.S_IMODE(path.stat().st_mode)
+        if path.is_dir():
+            yield ManifestEntry(relative_path, "directory", mode), None
+        else:
+            yield ManifestEntry(
+                relative_path, "file", mode
+            ), lambda path=path: path.open("rb")
+
+
+def tar_entries(
+    stream: IO[bytes],
+) -> Iterator[Tuple[ManifestEntry, Optional[Reader]]]:
+    """Describes the members of an uncompressed tar stream, such as the output of git archive."""
+    with tarfile.open(fileobj=stream, mode="r|") as tar:
+        for member in tar:
+            path = member.name.rstrip("/")
+            if member.isdir():
+                yield ManifestEntry(path, "directory", member.mode), None
+            elif member.issym():
+                yield ManifestEntry(path, "symlink", target=member.linkname), None
+            elif member.isfile():
+                # The stream cannot be read out of order, so the content is copied before moving on to the next
+                # member. Large files are spooled to disk, so memory use does not depend on the size of the files.
+                fd = tar.extractfile(member)
+                assert fd
+                spool = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+                shutil.copyfileobj(fd, spool, 1024 * 1024)
+                yield ManifestEntry(
+                    path, "file", member.mode
+                ), lambda spool=spool: _rewind(spool)
+
+
+def create_manifest(
+    client: Minio,
+    bucket: str,
+    key: str,
+    entries: Iterable[Tuple[ManifestEntry, Optional[Reader]]],
+    options: TransferOptions,
+    format: ArchiveFormat,
+) -> None:
+    """Stores the content of the files that are not yet in the bucket as blobs, followed by the manifest
+    listing all entries under the given key."""
+    level = format.level if format.level != None else zlib.Z_DEFAULT_COMPRESSION
+    stored: Set[str] = set()
+    stored_lock = Lock()
+
+    def store(entry: ManifestEntry, read: Reader) -> ManifestEntry:
+        digest = sha256()
+        with read() as fd:
+            for chunk in _read_chunks(fd):
+                digest.update(chunk)
+                entry.size += len(chunk)
+        entry.blob = digest.hexdigest()
+
+        with stored_lock:
+            if entry.blob in stored:
+                return entry
+            stored.add(entry.blob)
+        if not _reuse_blob(client, bucket, entry.blob):
+            compressor = zlib.compressobj(level)
+            with read() as fd, ObjectWriter(
+                client, bucket, blob_key(entry.blob), options
+            ) as writer:
+                for chunk in _read_chunks(fd):
+                    writer.write(compressor.compress(chunk))
+                writer.write(compressor.flush())
+        return entry
+
+    manifest: List[ManifestEntry] = []
+    with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+        # Blobs are stored concurrently, while bounding the number of entries held in memory.
+        pending: Deque[Future[ManifestEntry]] = deque()
+        try:
+            with click.progressbar(entries) as progress:
+                for entry, read in progress:
+                    if read:
+                        pending.append(executor.submit(store, entry, read))
+                    else:
+                        manifest.append(entry)
+                    if len(pending) >= options.concurrency * ENTRIES_PER_TRANSFER:
+                        manifest.append(pending.popleft().result())
+            while pending:
+                manifest.append(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+
+    manifest.sort(key=lambda entry: entry.path)
+    data = zlib.compress(
+        json.dumps(
+            {
+                "version": MANIFEST_VERSION,
+                "entries": [
+                    {k: v for k, v in asdict(entry).items() if v != None}
+                    for entry in manifest
+                ],
+            }
+        ).encode("UTF-8")
+    )
+    # The manifest is written last, so it only exists when all the blobs it refers to do.
+    with ObjectWriter(client, bucket, key, options, format.metadata()) as writer:
+        writer.write(data)
+
+
+def read_manifest(manifest_path: Path) -> List[ManifestEntry]:
+    return parse_manifest(manifest_path.read_bytes())
+
+
+def parse_manifest(data: bytes) -> List[ManifestEntry]:
+    manifest = json.loads(zlib.decompress(data))
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ZipError(
+            f"Unsupported source manifest version {manifest.get('version')}!"
+        )
+    entries = [ManifestEntry(**entry) for entry in manifest["entries"]]
+    for entry in entries:
+        path = PurePosixPath(entry.path)
+        if path.is_absolute() or ".." in path.parts:
+            raise ZipError(f"Source manifest contains invalid path {entry.path}!")
+    return entries
+
+
+def _fetch_blob(client: Minio, bucket: str, digest: str, path: Path) -> None:
+    # Write to a temporary file first, so a partially written blob is never mistaken for a complete one.
+    decompressor = zlib.decompressobj()
+    content_digest = sha256()
+    with NamedTemporaryFile(dir=path.parent, delete=False) as fd:
+        try:
+            response = client.get_object(bucket, blob_key(digest))
+            try:
+                for data in response.stream(amt=1024 * 1024):
+                    chunk = decompressor.decompress(data)
+                    content_digest.update(chunk)
+                    fd.write(chunk)
+                chunk = decompressor.flush()
+                content_digest.update(chunk)
+                fd.write(chunk)
+            finally:
+                response.close()
+                response.release_conn()
+            if content_digest.hexdigest() != digest:
+                raise ZipError(f"Content of blob {digest} does not match its digest!")
+        except BaseException:
+            os.unlink(fd.name)
+            raise
+    os.replace(fd.name, path)
+
+
+def extract_manifest(
+    client: Minio,
+    bucket: str,
+    manifest_path: Path,
+    target_dir: Path,
+    options: TransferOptions,
+    cache: Optional[ObjectCache] = None,
+) -> None:
+    """Recreates the source tree described by a manifest.
+
+    Blobs found in the cache are copied from there, only the missing blobs are downloaded and added to the cache.
+    """
+    entries = read_manifest(manifest_path)
+
+    for entry in entries:
+        if entry.type == "directory":
+            (target_dir / entry.path).mkdir(parents=True, exist_ok=True)
+        else:
+            (target_dir / entry.path).parent.mkdir(parents=True, exist_ok=True)
+
+    def materialize(entry: ManifestEntry) -> None:
+        assert entry.blob
+        path = target_dir / entry.path
+        cached_path = None
+        if cache:
+            digest = entry.blob
+            with cache.entry(
+                f"{bucket}/{blob_key(digest)}",
+                entry.size,
+                lambda cache_path: _fetch_blob(client, bucket, digest, cache_path),
+            ) as cached_path:
+                if cached_path:
+                    # Copy instead of linking, builds can modify the files in the source tree.
+                    shutil.copyfile(cached_path, path)
+        if not cached_path:
+            _fetch_blob(client, bucket, entry.blob, path)
+        path.chmod(entry.mode)
+
+    with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+        list(
+            executor.map(
+                materialize, [entry for entry in entries if entry.type == "file"]
+            )
+        )
+
+    for entry in entries:
+        if entry.type == "symlink":
+            assert entry.target
+            os.symlink(entry.target, target_dir / entry.path)
+    # Last, so read-only directories can still be filled.
+    for entry in entries:
+        if entry.type == "directory":
+            (target_dir / entry.path).chmod(entry.mode)
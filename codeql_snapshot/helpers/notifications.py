@@ -0,0 +1,88 @@
+import json
+from dataclasses import dataclass
+from sqlalchemy import Engine
+from typing import Optional, List, Callable, Any
+from codeql_snapshot.models import SnapshotState
+from threading import Event
+from time import monotonic
+import select
+
+# Channel on which the database announces new snapshots and state transitions, see the notify_snapshot_state trigger.
+CHANNEL = "codeql_snapshot"
+
+
+@dataclass(frozen=True)
+class SnapshotNotification:
+    global_id: str
+    label: Optional[str]
+    state: SnapshotState
+
+
+class SnapshotListener:
+    """Receives a notification whenever a snapshot is added or changes state.
+
+    Notifications are queued from the moment the listener is created, so a caller can first check the current
+    state in the database and then wait without missing a transition that happened in between.
+    """
+
+    def __init__(self, engine: Engine) -> None:
+        connection = engine.raw_connection()
+        self.driver_connection: Any = connection.driver_connection
+        # The connection is in autocommit mode and keeps listening, so it must not be handed back to the pool.
+        connection.detach()
+        self.driver_connection.autocommit = True
+        with self.driver_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+
+    def __enter__(self) -> "SnapshotListener":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.driver_connection.close()
+
+    def receive(self, timeout: float) -> List[SnapshotNotification]:
+        """Returns the pending notifications, waiting at most timeout seconds for one to arrive."""
+        if not self.driver_connection.notifies:
+            select.select([self.driver_connection], [], [], timeout)
+        self.driver_connection.poll()
+
+        notifications = []
+        while self.driver_connection.notifies:
+            notify = self.driver_connection.notifies.pop(0)
+            if notify.channel != CHANNEL:
+                continue
+            payload = json.loads(notify.payload)
+            notifications.append(
+                SnapshotNotification(
+                    global_id=payload["global_id"],
+                    label=payload["label"],
+                    state=SnapshotState[payload["state"]],
+                )
+            )
+        return notifications
+
+    def wait_for(
+        self,
+        predicate: Callable[[SnapshotNotification], bool],
+        timeout: Optional[float] = None,
+        stop: Optional[Event] = None,
+    ) -> Optional[SnapshotNotification]:
+        """Waits for a notification matching the predicate.
+
+        Returns None if no such notification arrived within timeout seconds or if the stop event was set.
+        """
+        deadline = monotonic() + timeout if timeout else None
+        while not (stop and stop.is_set()):
+            # Wake up regularly to check the stop event, which is set from a signal handler.
+            remaining = 1.0
+            if deadline:
+                remaining = min(remaining, deadline - monotonic())
+                if remaining <= 0:
+                    break
+            for notification in self.receive(remaining):
+                if predicate(notification):
+                    return notification
+        return None
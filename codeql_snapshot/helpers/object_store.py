@@ -1,10 +1,41 @@
 import click
 from codeql_snapshot.models import Snapshot
 from pathlib import Path
+from datetime import datetime
+from typing import Optional, Dict, Mapping, Sequence, Iterable, Iterator
 from minio import Minio
+from minio.datatypes import Object
 from minio.error import S3Error
-from codeql_snapshot.helpers.zip import zipdir
-from tempfile import TemporaryDirectory
+from minio.commonconfig import ComposeSource
+from minio.deleteobjects import DeleteObject
+from codeql_snapshot.helpers.archive import (
+    ArchiveFormat,
+    STORED,
+    BUNDLE,
+    archive_dir_to_stream,
+)
+from codeql_snapshot.helpers.source import (
+    walk_source,
+    archive_commit_to_stream,
+    open_commit_archive,
+)
+from codeql_snapshot.helpers.manifest import (
+    create_manifest,
+    extract_manifest,
+    tree_entries,
+    tar_entries,
+    blob_key,
+    blob_last_modified,
+    BLOB_PREFIX,
+)
+from codeql_snapshot.helpers.zip import walk
+from codeql_snapshot.helpers.transfer import (
+    TransferOptions,
+    ObjectWriter,
+    upload_file,
+    download_file,
+)
+from codeql_snapshot.helpers.cache import ObjectCache, download_cached_file
 
 
 def _has_object(client: Minio, bucket: str, key: str) -> bool:
@@ -18,18 +49,92 @@ def _has_object(client: Minio, bucket: str, key: str) -> bool:
             raise err
 
 
-def _get_object(client: Minio, bucket: str, key: str, object_file: Path) -> None:
-    client.fget_object(bucket, key, str(object_file))
+def _get_object_etag(client: Minio, bucket: str, key: str) -> Optional[str]:
+    try:
+        return client.stat_object(bucket, key).etag
+    except S3Error as err:
+        if err.code == "NoSuchKey":
+            return None
+        else:
+            raise err
+
+
+def _get_object_metadata(client: Minio, bucket: str, key: str) -> Mapping[str, str]:
+    return client.stat_object(bucket, key).metadata
 
 
-def _create_object(client: Minio, bucket: str, key: str, object_file: Path) -> None:
-    client.fput_object(bucket, key, str(object_file))
+def _get_object(
+    client: Minio,
+    bucket: str,
+    key: str,
+    object_file: Path,
+    options: TransferOptions,
+    cache: Optional[ObjectCache] = None,
+) -> Mapping[str, str]:
+    if cache:
+        return download_cached_file(cache, client, bucket, key, object_file, options)
+    return download_file(client, bucket, key, object_file, options)
+
+
+def _create_object(
+    client: Minio,
+    bucket: str,
+    key: str,
+    object_file: Path,
+    options: TransferOptions,
+    metadata: Optional[Dict[str, str]] = None,
+) -> None:
+    upload_file(client, bucket, key, object_file, options, metadata)
+
+
+def _copy_object(client: Minio, bucket: str, source_key: str, key: str) -> None:
+    # Copied by the object store itself. Compose copies objects larger than 5 GiB in parts, but only keeps the user
+    # metadata when it is passed explicitly.
+    metadata = {
+        name: value
+        for name, value in client.stat_object(bucket, source_key).metadata.items()
+        if name.lower().startswith("x-amz-meta-")
+    }
+    client.compose_object(
+        bucket, key, [ComposeSource(bucket, source_key)], metadata=metadata or None
+    )
 
 
 def _remove_object(client: Minio, bucket: str, key: str) -> None:
+    # Removing an object that does not exist succeeds, so there is no need to check whether it exists first.
     client.remove_object(bucket, key)
 
 
+def _remove_objects(client: Minio, bucket: str, keys: Iterable[str]) -> None:
+    # Removed with a request per 1000 keys. The errors are only reported once all requests are made.
+    errors = list(
+        client.remove_objects(bucket, (DeleteObject(key) for key in set(keys)))
+    )
+    if errors:
+        raise S3Error(
+            errors[0].code,
+            f"Failed to remove {len(errors)} object(s), the first with error {errors[0].message}",
+            errors[0].name,
+            None,
+            None,
+            None,
+            bucket,
+            errors[0].name,
+        )
+
+
+def _list_objects(
+    client: Minio,
+    bucket: str,
+    prefix: Optional[str] = None,
+    start_after: Optional[str] = None,
+) -> Iterator[Object]:
+    # Listed lazily in the binary order of the keys, a request per 1000 keys.
+    return client.list_objects(
+        bucket, prefix=prefix, recursive=True, start_after=start_after
+    )
+
+
 def has_source_object(ctx: click.Context, snapshot_source_id: str) -> bool:
     return _has_object(
         ctx.obj["storage"]["client"],
@@ -42,28 +147,115 @@ def create_source_object(
     ctx: click.Context,
     snapshot_source_id: str,
     source_root: Path,
+    exclude: Sequence[str] = (),
+    gitignore: bool = False,
+    commit: Optional[str] = None,
+) -> None:
+    """Archives the source root into the source bucket.
+
+    If a commit is provided, the files tracked in that commit are archived instead of the working tree.
+    """
+    format: ArchiveFormat = ctx.obj["storage"]["formats"]["source"]
+    if format.codec == "manifest":
+        _create_source_manifest(
+            ctx, snapshot_source_id, source_root, exclude, gitignore, commit
+        )
+        return
+
+    # Compress straight into the object store, so the upload overlaps with the compression of the remaining files.
+    with ObjectWriter(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["source"],
+        snapshot_source_id,
+        ctx.obj["storage"]["transfer"],
+        format.metadata(),
+    ) as writer:
+        if commit:
+            archive_commit_to_stream(source_root, commit, writer, format, exclude)
+        elif exclude or gitignore:
+            archive_dir_to_stream(
+                source_root,
+                writer,
+                format,
+                walk_source(source_root, exclude, gitignore),
+            )
+        else:
+            archive_dir_to_stream(source_root, writer, format)
+
+
+def _create_source_manifest(
+    ctx: click.Context,
+    snapshot_source_id: str,
+    source_root: Path,
+    exclude: Sequence[str],
+    gitignore: bool,
+    commit: Optional[str],
+) -> None:
+    args = (
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["source"],
+        snapshot_source_id,
+    )
+    format: ArchiveFormat = ctx.obj["storage"]["formats"]["source"]
+    if commit:
+        with open_commit_archive(
+            source_root, commit, ["--format=tar"], exclude
+        ) as archive:
+            create_manifest(
+                *args, tar_entries(archive), ctx.obj["storage"]["transfer"], format
+            )
+    else:
+        paths = (
+            walk_source(source_root, exclude, gitignore)
+            if exclude or gitignore
+            else walk(source_root)
+        )
+        create_manifest(
+            *args,
+            tree_entries(source_root, paths),
+            ctx.obj["storage"]["transfer"],
+            format,
+        )
+
+
+def extract_source_manifest(
+    ctx: click.Context, manifest_path: Path, target_dir: Path
 ) -> None:
-    with TemporaryDirectory() as tmpdir:
-        tmpzip = (Path(tmpdir) / snapshot_source_id).with_suffix(".zip")
-        zipdir(source_root, tmpzip)
+    extract_manifest(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["source"],
+        manifest_path,
+        target_dir,
+        ctx.obj["storage"]["transfer"],
+        ctx.obj["storage"]["cache"],
+    )
 
-        _create_object(
+
+def get_source_object_format(
+    ctx: click.Context, snapshot_source_id: str
+) -> ArchiveFormat:
+    return ArchiveFormat.from_metadata(
+        _get_object_metadata(
             ctx.obj["storage"]["client"],
             ctx.obj["storage"]["buckets"]["source"],
             snapshot_source_id,
-            tmpzip,
-        )
+        ),
+        STORED,
+    )
 
 
 def get_source_object(
     ctx: click.Context, snapshot_source_id: str, object_file: Path
-) -> None:
-    _get_object(
+) -> ArchiveFormat:
+    metadata = _get_object(
         ctx.obj["storage"]["client"],
         ctx.obj["storage"]["buckets"]["source"],
         snapshot_source_id,
         object_file,
+        ctx.obj["storage"]["transfer"],
+        ctx.obj["storage"]["cache"],
     )
+    return ArchiveFormat.from_metadata(metadata, STORED)
 
 
 def remove_source_object(ctx: click.Context, snapshot_source_id: str) -> None:
@@ -74,6 +266,57 @@ def remove_source_object(ctx: click.Context, snapshot_source_id: str) -> None:
     )
 
 
+def remove_source_objects(
+    ctx: click.Context, snapshot_source_ids: Iterable[str]
+) -> None:
+    _remove_objects(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["source"],
+        snapshot_source_ids,
+    )
+
+
+def list_source_objects(ctx: click.Context) -> Iterator[Object]:
+    """Lists the source objects in key order, without the blobs of source manifests."""
+    client = ctx.obj["storage"]["client"]
+    bucket = ctx.obj["storage"]["buckets"]["source"]
+    for obj in _list_objects(client, bucket):
+        if obj.object_name.startswith(BLOB_PREFIX):
+            # Continue after the last possible blob key, instead of listing all the blobs.
+            yield from _list_objects(
+                client,
+                bucket,
+                start_after=BLOB_PREFIX[:-1] + chr(ord(BLOB_PREFIX[-1]) + 1),
+            )
+            return
+        yield obj
+
+
+def list_source_blobs(ctx: click.Context) -> Iterator[Object]:
+    """Lists the blobs of source manifests in key order."""
+    return _list_objects(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["source"],
+        prefix=BLOB_PREFIX,
+    )
+
+
+def get_source_blob_last_modified(
+    ctx: click.Context, digest: str
+) -> Optional[datetime]:
+    return blob_last_modified(
+        ctx.obj["storage"]["client"], ctx.obj["storage"]["buckets"]["source"], digest
+    )
+
+
+def remove_source_blobs(ctx: click.Context, digests: Iterable[str]) -> None:
+    _remove_objects(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["source"],
+        (blob_key(digest) for digest in digests),
+    )
+
+
 def has_database_object(ctx: click.Context, snapshot_global_id: str) -> bool:
     return _has_object(
         ctx.obj["storage"]["client"],
@@ -82,26 +325,70 @@ def has_database_object(ctx: click.Context, snapshot_global_id: str) -> bool:
     )
 
 
+def get_database_object_etag(
+    ctx: click.Context, snapshot_global_id: str
+) -> Optional[str]:
+    """Returns the entity tag of the database, which changes whenever the database is rebuilt, or None if there is
+    no database."""
+    return _get_object_etag(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["database"],
+        snapshot_global_id,
+    )
+
+
 def create_database_object(
-    ctx: click.Context, snapshot_global_id: str, database_bundle: Path
+    ctx: click.Context,
+    snapshot_global_id: str,
+    database_bundle: Path,
+    format: ArchiveFormat = BUNDLE,
 ) -> None:
     _create_object(
         ctx.obj["storage"]["client"],
         ctx.obj["storage"]["buckets"]["database"],
         snapshot_global_id,
         database_bundle,
+        ctx.obj["storage"]["transfer"],
+        format.metadata(),
+    )
+
+
+def copy_database_object(
+    ctx: click.Context, source_snapshot_global_id: str, snapshot_global_id: str
+) -> None:
+    _copy_object(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["database"],
+        source_snapshot_global_id,
+        snapshot_global_id,
+    )
+
+
+def get_database_object_format(
+    ctx: click.Context, snapshot_global_id: str
+) -> ArchiveFormat:
+    return ArchiveFormat.from_metadata(
+        _get_object_metadata(
+            ctx.obj["storage"]["client"],
+            ctx.obj["storage"]["buckets"]["database"],
+            snapshot_global_id,
+        ),
+        BUNDLE,
     )
 
 
 def get_database_object(
     ctx: click.Context, snapshot_global_id: str, object_file: Path
-) -> None:
-    _get_object(
+) -> ArchiveFormat:
+    metadata = _get_object(
         ctx.obj["storage"]["client"],
         ctx.obj["storage"]["buckets"]["database"],
         snapshot_global_id,
         object_file,
+        ctx.obj["storage"]["transfer"],
+        ctx.obj["storage"]["cache"],
     )
+    return ArchiveFormat.from_metadata(metadata, BUNDLE)
 
 
 def remove_database_object(ctx: click.Context, snapshot_global_id: str) -> None:
@@ -112,6 +399,22 @@ def remove_database_object(ctx: click.Context, snapshot_global_id: str) -> None:
     )
 
 
+def remove_database_objects(
+    ctx: click.Context, snapshot_global_ids: Iterable[str]
+) -> None:
+    _remove_objects(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["database"],
+        snapshot_global_ids,
+    )
+
+
+def list_database_objects(ctx: click.Context) -> Iterator[Object]:
+    return _list_objects(
+        ctx.obj["storage"]["client"], ctx.obj["storage"]["buckets"]["database"]
+    )
+
+
 def has_sarif_object(ctx: click.Context, snapshot_global_id: str) -> bool:
     return _has_object(
         ctx.obj["storage"]["client"],
@@ -128,6 +431,18 @@ def create_sarif_object(
         ctx.obj["storage"]["buckets"]["sarif"],
         snapshot_global_id,
         sarif,
+        ctx.obj["storage"]["transfer"],
+    )
+
+
+def copy_sarif_object(
+    ctx: click.Context, source_snapshot_global_id: str, snapshot_global_id: str
+) -> None:
+    _copy_object(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["sarif"],
+        source_snapshot_global_id,
+        snapshot_global_id,
     )
 
 
@@ -139,6 +454,8 @@ def get_sarif_object(
         ctx.obj["storage"]["buckets"]["sarif"],
         snapshot_global_id,
         object_file,
+        ctx.obj["storage"]["transfer"],
+        ctx.obj["storage"]["cache"],
     )
 
 
@@ -148,3 +465,19 @@ def remove_sarif_object(ctx: click.Context, snapshot_global_id: str) -> None:
         ctx.obj["storage"]["buckets"]["sarif"],
         snapshot_global_id,
     )
+
+
+def remove_sarif_objects(
+    ctx: click.Context, snapshot_global_ids: Iterable[str]
+) -> None:
+    _remove_objects(
+        ctx.obj["storage"]["client"],
+        ctx.obj["storage"]["buckets"]["sarif"],
+        snapshot_global_ids,
+    )
+
+
+def list_sarif_objects(ctx: click.Context) -> Iterator[Object]:
+    return _list_objects(
+        ctx.obj["storage"]["client"], ctx.obj["storage"]["buckets"]["sarif"]
+    )
@@ -0,0 +1,164 @@
+import click
+from dataclasses import dataclass, field
+from typing import Optional, List, Callable
+from codeql_snapshot.helpers.queue import SnapshotJob
+from codeql_snapshot.helpers.jobs import JobRunner, JobResult
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from queue import Queue
+from threading import Condition, Event, Thread
+
+
+@dataclass
+class PipelineTask:
+    runner: JobRunner
+    job: SnapshotJob
+    directory: TemporaryDirectory = field(default_factory=TemporaryDirectory)
+    input: Optional[Path] = None
+    result: Optional[JobResult] = None
+
+
+class Pipeline:
+    """Overlaps the fetch, execute and publish steps of consecutive jobs.
+
+    A fetch thread claims snapshots and downloads their inputs, `jobs` execute threads run CodeQL, and the calling
+    thread uploads the results. The stages are connected by bounded queues so at most `prefetch` jobs are waiting
+    in between two stages. When there is nothing left to claim the pipeline stops, unless an idle callback is given
+    that blocks until new work may have arrived.
+    """
+
+    def __init__(
+        self,
+        runners: List[JobRunner],
+        label: Optional[str],
+        stop: Event,
+        batch: int = 1,
+        jobs: int = 1,
+        prefetch: int = 1,
+        idle: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.runners = runners
+        self.label = label
+        self.stop = stop
+        self.batch = batch
+        self.jobs = jobs
+        self.idle = idle
+        self.fetched: Queue[Optional[PipelineTask]] = Queue(maxsize=prefetch)
+        self.executed: Queue[Optional[PipelineTask]] = Queue(maxsize=prefetch)
+        self.in_flight = 0
+        self.in_flight_changed = Condition()
+        self.errors: List[BaseException] = []
+
+    def _fail(self, error: BaseException) -> None:
+        self.errors.append(error)
+        self.stop.set()
+
+    def _done(self, task: PipelineTask) -> None:
+        task.directory.cleanup()
+        with self.in_flight_changed:
+            self.in_flight -= 1
+            self.in_flight_changed.notify_all()
+
+    def _release(self, task: PipelineTask) -> None:
+        try:
+            task.runner.release([task.job])
+        except Exception as e:
+            self._fail(e)
+        self._done(task)
+
+    def _job_failed(self, task: PipelineTask, error: Exception) -> None:
+        # Only the failed job is given up on, the pipeline keeps processing the other jobs.
+        try:
+            task.runner.fail(task.job, error)
+        except Exception as e:
+            self._fail(e)
+        self._done(task)
+
+    def _fetch(self) -> None:
+        try:
+            while not self.stop.is_set():
+                claimed = False
+                for runner in self.runners:
+                    if self.stop.is_set():
+                        break
+
+                    jobs = runner.claim(self.label, batch=self.batch)
+                    with self.in_flight_changed:
+                        self.in_flight += len(jobs)
+                    for job in jobs:
+                        claimed = True
+                        task = PipelineTask(runner, job)
+                        if self.stop.is_set():
+                            self._release(task)
+                            continue
+                        try:
+                            task.input = runner.fetch(job, Path(task.directory.name))
+                        except Exception as e:
+                            self._job_failed(task, e)
+                            continue
+                        self.fetched.put(task)
+
+                # Jobs that are still in flight can make snapshots claimable by a later stage, so only stop
+                # when there is nothing left to claim and nothing left in flight.
+                if not claimed:
+                    with self.in_flight_changed:
+                        if self.in_flight > 0:
+                            self.in_flight_changed.wait()
+                            continue
+                    if not self.idle:
+                        break
+                    self.idle()
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for _ in range(self.jobs):
+                self.fetched.put(None)
+
+    def _execute(self) -> None:
+        while (task := self.fetched.get()) is not None:
+            if self.stop.is_set():
+                self._release(task)
+                continue
+            try:
+                click.echo(
+                    f"Running {task.runner.name} for snapshot {task.job.global_id}."
+                )
+                task.result = task.runner.execute(
+                    task.job, task.input, Path(task.directory.name)
+                )
+            except Exception as e:
+                self._job_failed(task, e)
+                continue
+            self.executed.put(task)
+        self.executed.put(None)
+
+    def run(self) -> int:
+        threads = [Thread(target=self._fetch, daemon=True)] + [
+            Thread(target=self._execute, daemon=True) for _ in range(self.jobs)
+        ]
+        for thread in threads:
+            thread.start()
+
+        processed = 0
+        remaining = self.jobs
+        while remaining > 0:
+            task = self.executed.get()
+            if task is None:
+                remaining -= 1
+                continue
+
+            try:
+                if task.result:
+                    task.runner.publish(task.job, task.result)
+                processed += 1
+            except Exception as e:
+                self._job_failed(task, e)
+                continue
+            self._done(task)
+
+        for thread in threads:
+            thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+        return processed
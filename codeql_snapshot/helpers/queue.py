@@ -0,0 +1,368 @@
+import click
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional, List, Set, Iterable, Tuple
+from sqlalchemy import (
+    Engine,
+    Row,
+    Select,
+    ColumnElement,
+    select,
+    update,
+    func,
+    or_,
+    and_,
+)
+from sqlalchemy.orm import Session, aliased
+from codeql_snapshot.models import Snapshot, SnapshotState, SnapshotLanguage
+from threading import Event, Lock, Thread
+from socket import gethostname
+from uuid import uuid4
+import os
+
+
+@dataclass(frozen=True)
+class SnapshotJob:
+    global_id: str
+    source_id: str
+    language: str
+    category: Optional[str]
+
+
+@dataclass(frozen=True)
+class Lease:
+    duration: timedelta
+    owner: str = field(
+        default_factory=lambda: f"{gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+    )
+
+    def expires_at(self) -> ColumnElement[datetime]:
+        return database_utcnow() + self.duration
+
+
+def database_utcnow() -> ColumnElement[datetime]:
+    """The current UTC time of the database, which lease expiry is computed and checked against, so workers whose
+    clocks are skewed still agree on when a lease expired."""
+    # Timestamps are stored in UTC without a time zone.
+    return func.timezone("UTC", func.now())
+
+
+def _select_jobs() -> Select[Tuple[str, str, SnapshotLanguage, Optional[str]]]:
+    return select(
+        Snapshot.global_id,
+        Snapshot.source_id,
+        Snapshot.language,
+        Snapshot.category,
+    )
+
+
+def select_claimable_snapshots(
+    state: SnapshotState,
+    label: Optional[str],
+    batch: int = 1,
+    fair_share: bool = False,
+) -> Select[Tuple[str, str, SnapshotLanguage, Optional[str]]]:
+    if fair_share:
+        # Rank the snapshots of each project by priority and claim the best ranked snapshots first,
+        # so a large backlog of one project cannot starve the other projects.
+        ranked = (
+            select(
+                Snapshot.global_id,
+                func.row_number()
+                .over(
+                    partition_by=Snapshot.project_url,
+                    order_by=(Snapshot.priority.desc(), Snapshot.created_at),
+                )
+                .label("rank"),
+            )
+            .where(Snapshot.label == label)
+            .where(Snapshot.state == state)
+            .subquery()
+        )
+        return (
+            _select_jobs()
+            .join(ranked, ranked.c.global_id == Snapshot.global_id)
+            .order_by(ranked.c.rank, Snapshot.priority.desc(), Snapshot.created_at)
+            .limit(batch)
+            .with_for_update(of=Snapshot, skip_locked=True)
+        )
+
+    return (
+        _select_jobs()
+        .where(Snapshot.label == label)
+        .where(Snapshot.state == state)
+        .order_by(Snapshot.priority.desc(), Snapshot.created_at)
+        .limit(batch)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def select_expired_snapshots(
+    claimed_state: SnapshotState, label: Optional[str], batch: int = 1
+) -> Select[Tuple[str, str, SnapshotLanguage, Optional[str]]]:
+    # Snapshots left behind by workers that stopped renewing their lease.
+    return (
+        _select_jobs()
+        .where(Snapshot.label == label)
+        .where(Snapshot.state == claimed_state)
+        .where(Snapshot.lease_expires_at < database_utcnow())
+        .order_by(Snapshot.lease_expires_at)
+        .limit(batch)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def claim_snapshots(
+    engine: Engine,
+    state: SnapshotState,
+    claimed_state: SnapshotState,
+    label: Optional[str],
+    lease: Lease,
+    snapshot_global_id: Optional[str] = None,
+    batch: int = 1,
+    fair_share: bool = False,
+) -> List[SnapshotJob]:
+    with Session(engine) as session, session.begin():
+        if snapshot_global_id:
+            rows = list(
+                session.execute(
+                    _select_jobs()
+                    .where(Snapshot.label == label)
+                    .where(Snapshot.global_id == snapshot_global_id)
+                    .where(
+                        or_(
+                            Snapshot.state == state,
+                            and_(
+                                Snapshot.state == claimed_state,
+                                Snapshot.lease_expires_at < database_utcnow(),
+                            ),
+                        )
+                    )
+                    .with_for_update()
+                )
+            )
+        else:
+            # Expired leases are reclaimed first, they have been waiting the longest.
+            rows = list(
+                session.execute(select_expired_snapshots(claimed_state, label, batch))
+            )
+            if len(rows) < batch:
+                rows += session.execute(
+                    select_claimable_snapshots(
+                        state, label, batch - len(rows), fair_share
+                    )
+                )
+
+        return _claim_rows(session, rows, claimed_state, lease)
+
+
+def claim_source_snapshots(
+    engine: Engine,
+    state: SnapshotState,
+    claimed_state: SnapshotState,
+    label: Optional[str],
+    lease: Lease,
+    source_ids: Iterable[str],
+) -> List[SnapshotJob]:
+    """Claims the snapshots of the given sources that are still waiting, e.g. the other languages of the same
+    commit."""
+    with Session(engine) as session, session.begin():
+        rows = list(
+            session.execute(
+                _select_jobs()
+                .where(Snapshot.label == label)
+                .where(Snapshot.state == state)
+                .where(Snapshot.source_id.in_(list(source_ids)))
+                .order_by(Snapshot.source_id, Snapshot.language)
+                .with_for_update(skip_locked=True)
+            )
+        )
+        return _claim_rows(session, rows, claimed_state, lease)
+
+
+def _claim_rows(
+    session: Session,
+    rows: Iterable[Row[Tuple[str, str, SnapshotLanguage, Optional[str]]]],
+    claimed_state: SnapshotState,
+    lease: Lease,
+) -> List[SnapshotJob]:
+    jobs = [
+        SnapshotJob(
+            global_id=row.global_id,
+            source_id=row.source_id,
+            language=row.language.value,
+            category=row.category,
+        )
+        for row in rows
+    ]
+
+    # Claim all the locked rows with a single statement instead of updating them one by one.
+    if jobs:
+        session.execute(
+            update(Snapshot)
+            .where(Snapshot.global_id.in_([job.global_id for job in jobs]))
+            .values(
+                state=claimed_state,
+                lease_owner=lease.owner,
+                lease_expires_at=lease.expires_at(),
+            )
+            .execution_options(synchronize_session=False)
+        )
+    return jobs
+
+
+def renew_leases(engine: Engine, lease: Lease, global_ids: Iterable[str]) -> None:
+    with Session(engine) as session, session.begin():
+        session.execute(
+            update(Snapshot)
+            .where(Snapshot.global_id.in_(list(global_ids)))
+            .where(Snapshot.lease_owner == lease.owner)
+            .values(lease_expires_at=lease.expires_at())
+            .execution_options(synchronize_session=False)
+        )
+
+
+def release_snapshots(
+    engine: Engine,
+    jobs: List[SnapshotJob],
+    claimed_state: SnapshotState,
+    state: SnapshotState,
+    lease: Lease,
+) -> None:
+    if not jobs:
+        return
+
+    with Session(engine) as session, session.begin():
+        session.execute(
+            update(Snapshot)
+            .where(Snapshot.global_id.in_([job.global_id for job in jobs]))
+            .where(Snapshot.state == claimed_state)
+            .where(Snapshot.lease_owner == lease.owner)
+            .values(state=state, lease_owner=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def update_snapshot_state(
+    engine: Engine,
+    global_id: str,
+    claimed_state: SnapshotState,
+    new_state: SnapshotState,
+    lease: Lease,
+    build_command: Optional[str] = None,
+    analysis_fingerprint: Optional[str] = None,
+) -> bool:
+    with Session(engine) as session, session.begin():
+        stmt = select(Snapshot).where(Snapshot.global_id == global_id).with_for_update()
+
+        snapshot = session.scalar(stmt)
+        if not snapshot:
+            return False
+
+        # Another worker took over the snapshot after our lease expired, so its outcome takes precedence.
+        if snapshot.state != claimed_state or snapshot.lease_owner != lease.owner:
+            return False
+
+        snapshot.state = new_state
+        snapshot.lease_owner = None
+        snapshot.lease_expires_at = None
+        if build_command != None:
+            snapshot.build_command = build_command
+        # The stored results only match the fingerprint after a successful analysis, e.g. a failure to store the
+        # results of an analysis must not let the next analysis be skipped.
+        if analysis_fingerprint != None or new_state != SnapshotState.ANALYZED:
+            snapshot.analysis_fingerprint = analysis_fingerprint
+        return True
+
+
+def get_analysis_fingerprint(engine: Engine, global_id: str) -> Optional[str]:
+    with Session(engine) as session:
+        return session.scalar(
+            select(Snapshot.analysis_fingerprint).where(Snapshot.global_id == global_id)
+        )
+
+
+# States of snapshots that have a database.
+BUILT_STATES = [
+    SnapshotState.NOT_ANALYZED,
+    SnapshotState.ANALYSIS_IN_PROGRESS,
+    SnapshotState.ANALYSIS_FAILED,
+    SnapshotState.ANALYZED,
+]
+
+
+def select_reusable_snapshot(
+    global_id: str, build_command: str
+) -> Select[Tuple[str, SnapshotState]]:
+    target = aliased(Snapshot)
+    return (
+        select(Snapshot.global_id, Snapshot.state)
+        .join(
+            target,
+            and_(
+                target.global_id == global_id,
+                target.commit == Snapshot.commit,
+                target.language == Snapshot.language,
+                target.category.is_not_distinct_from(Snapshot.category),
+            ),
+        )
+        .where(Snapshot.global_id != global_id)
+        .where(Snapshot.build_command == build_command)
+        .where(Snapshot.state.in_(BUILT_STATES))
+        .order_by(
+            (Snapshot.state == SnapshotState.ANALYZED).desc(),
+            Snapshot.updated_at.desc(),
+        )
+        .limit(1)
+    )
+
+
+def find_reusable_snapshot(
+    engine: Engine, global_id: str, build_command: str
+) -> Optional[Tuple[str, SnapshotState]]:
+    """Finds another snapshot of the same commit, language and category, for instance on another branch, with a
+    database built with the same build command. Analyzed snapshots are preferred, so their results can be reused too.
+    """
+    with Session(engine) as session:
+        row = session.execute(
+            select_reusable_snapshot(global_id, build_command)
+        ).first()
+        return (row.global_id, row.state) if row else None
+
+
+class Heartbeat:
+    """Periodically renews the lease on the snapshots a worker is processing."""
+
+    def __init__(self, engine: Engine, lease: Lease) -> None:
+        self.engine = engine
+        self.lease = lease
+        self.global_ids: Set[str] = set()
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    def add(self, jobs: List[SnapshotJob]) -> None:
+        with self.lock:
+            self.global_ids.update(job.global_id for job in jobs)
+            if not self.thread:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def remove(self, jobs: List[SnapshotJob]) -> None:
+        with self.lock:
+            self.global_ids.difference_update(job.global_id for job in jobs)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def _run(self) -> None:
+        # Renew well before expiry so a single failed renewal does not cost us the lease.
+        while not self.stopped.wait(self.lease.duration.total_seconds() / 3):
+            with self.lock:
+                global_ids = list(self.global_ids)
+            if not global_ids:
+                continue
+            try:
+                renew_leases(self.engine, self.lease, global_ids)
+            except Exception as e:
+                click.echo(f"Failed to renew leases with error {e}")
@@ -0,0 +1,302 @@
+import click
+import heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+from tempfile import TemporaryDirectory, TemporaryFile
+from typing import (
+    Optional,
+    Callable,
+    Iterable,
+    Iterator,
+    Sequence,
+    Tuple,
+    List,
+    Deque,
+    Any,
+    TypeVar,
+)
+from minio.datatypes import Object
+from minio.error import S3Error
+from sqlalchemy import Engine, Row, select, func
+from sqlalchemy.orm import InstrumentedAttribute
+from codeql_snapshot.models import Snapshot, SnapshotState
+from codeql_snapshot.helpers.queue import BUILT_STATES
+from codeql_snapshot.helpers.manifest import (
+    read_manifest,
+    blob_key,
+    BLOB_PREFIX,
+    BLOB_REFRESH_AGE,
+)
+from codeql_snapshot.helpers.object_store import (
+    list_source_objects,
+    list_source_blobs,
+    list_database_objects,
+    list_sarif_objects,
+    remove_source_objects,
+    remove_source_blobs,
+    get_source_blob_last_modified,
+    remove_database_objects,
+    remove_sarif_objects,
+    get_source_object_format,
+    get_source_object,
+)
+
+T = TypeVar("T")
+
+# Number of rows fetched at a time from the server side cursor.
+ROWS_PER_FETCH = 10000
+# Number of orphaned objects removed with a single request.
+OBJECTS_PER_REMOVAL = 1000
+# Number of blob digests sorted in memory before they are written to a temporary file.
+DIGESTS_PER_RUN = 250000
+
+
+@dataclass(frozen=True)
+class ObjectKind:
+    """The objects of one kind in the object store and the snapshots referring to them.
+
+    An object is referred to by every snapshot row with its key, whatever its state, e.g. the partial database of a
+    failed build or the tombstone of a deleted snapshot whose objects are removed when it is purged.
+    """
+
+    name: str
+    column: InstrumentedAttribute[str]
+    # States of the snapshots whose object must exist.
+    expected_states: Sequence[SnapshotState]
+    list_objects: Callable[[click.Context], Iterator[Object]]
+    remove_objects: Callable[[click.Context, Iterable[str]], None]
+
+
+OBJECT_KINDS = {
+    "source": ObjectKind(
+        "source",
+        Snapshot.source_id,
+        [
+            state
+            for state in SnapshotState
+            if not state in [SnapshotState.SNAPSHOT_FAILED, SnapshotState.DELETED]
+        ],
+        list_source_objects,
+        remove_source_objects,
+    ),
+    "database": ObjectKind(
+        "database",
+        Snapshot.global_id,
+        BUILT_STATES,
+        list_database_objects,
+        remove_database_objects,
+    ),
+    "sarif": ObjectKind(
+        "sarif",
+        Snapshot.global_id,
+        [SnapshotState.ANALYZED],
+        list_sarif_objects,
+        remove_sarif_objects,
+    ),
+}
+
+
+@dataclass
+class ReconcileReport:
+    orphaned: int = 0
+    missing: int = 0
+
+
+def _snapshot_ids(engine: Engine, kind: ObjectKind) -> Iterator[Row[Any]]:
+    # Sorted like the object store lists keys, by their bytes, and streamed with a server side cursor.
+    stmt = (
+        select(
+            kind.column.label("id"),
+            func.bool_or(Snapshot.state.in_(kind.expected_states)).label("expected"),
+        )
+        .group_by(kind.column)
+        .order_by(kind.column.collate("C"))
+    )
+    with engine.connect() as connection:
+        yield from connection.execution_options(yield_per=ROWS_PER_FETCH).execute(stmt)
+
+
+def _merge_join(
+    objects: Iterator[Object], rows: Iterator[T], key: Callable[[T], str]
+) -> Iterator[Tuple[Optional[Object], Optional[T]]]:
+    """Pairs objects and rows with the same key, given both in key order. Yields None for the missing side."""
+    obj = next(objects, None)
+    row = next(rows, None)
+    while obj or row:
+        if row == None or (obj and obj.object_name < key(row)):
+            yield obj, None
+            obj = next(objects, None)
+        elif obj == None or key(row) < obj.object_name:
+            yield None, row
+            row = next(rows, None)
+        else:
+            yield obj, row
+            obj = next(objects, None)
+            row = next(rows, None)
+
+
+def _reconcile(
+    ctx: click.Context,
+    name: str,
+    pairs: Iterable[Tuple[Optional[Object], Optional[T]]],
+    is_expected: Callable[[T], bool],
+    key: Callable[[T], str],
+    remove: Optional[Callable[[click.Context, Iterable[str]], None]],
+    min_age: timedelta,
+) -> ReconcileReport:
+    report = ReconcileReport()
+    # Objects are uploaded before the snapshot referring to them is committed, so recent objects are left alone.
+    cutoff = datetime.now(timezone.utc) - min_age
+    orphans: List[str] = []
+    for obj, row in pairs:
+        if obj and row == None:
+            if obj.last_modified and obj.last_modified > cutoff:
+                continue
+            click.echo(f"Orphaned {name} {obj.object_name}")
+            report.orphaned += 1
+            if remove:
+                orphans.append(obj.object_name)
+                if len(orphans) >= OBJECTS_PER_REMOVAL:
+                    remove(ctx, orphans)
+                    orphans = []
+        elif not obj and row != None and is_expected(row):
+            click.echo(f"Missing {name} {key(row)}")
+            report.missing += 1
+    if remove and orphans:
+        remove(ctx, orphans)
+    return report
+
+
+def reconcile_objects(
+    ctx: click.Context, kind: ObjectKind, min_age: timedelta, remove: bool
+) -> ReconcileReport:
+    """Merge joins the listing of the objects of a kind with the snapshots referring to them, reporting the objects
+    that no snapshot refers to and the snapshots whose object is missing. Orphaned objects are removed if requested.
+
+    Both sides are streamed in key order, so memory use does not depend on the number of objects or snapshots.
+    """
+    return _reconcile(
+        ctx,
+        f"{kind.name} object",
+        _merge_join(
+            kind.list_objects(ctx),
+            _snapshot_ids(ctx.obj["database"]["engine"], kind),
+            lambda row: row.id,
+        ),
+        lambda row: row.expected,
+        lambda row: row.id,
+        kind.remove_objects if remove else None,
+        min_age,
+    )
+
+
+def _manifest_blobs(ctx: click.Context, snapshot_source_id: str) -> List[str]:
+    try:
+        if get_source_object_format(ctx, snapshot_source_id).codec != "manifest":
+            return []
+        with TemporaryDirectory() as tmpdir:
+            manifest_path = Path(tmpdir) / "manifest"
+            get_source_object(ctx, snapshot_source_id, manifest_path)
+            return [entry.blob for entry in read_manifest(manifest_path) if entry.blob]
+    except S3Error as err:
+        # Reported as a missing source object.
+        if err.code == "NoSuchKey":
+            return []
+        raise err
+
+
+def _referenced_blobs(ctx: click.Context) -> Iterator[str]:
+    # Reads the manifests of the referenced source objects concurrently, in order and bounding the number of pending
+    # reads.
+    concurrency = ctx.obj["storage"]["transfer"].concurrency
+    source_ids = (
+        row.id
+        for row in _snapshot_ids(ctx.obj["database"]["engine"], OBJECT_KINDS["source"])
+    )
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending: Deque[Future[List[str]]] = deque()
+        try:
+            for source_id in source_ids:
+                pending.append(executor.submit(_manifest_blobs, ctx, source_id))
+                if len(pending) >= concurrency * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _sorted_unique(values: Iterable[str]) -> Iterator[str]:
+    """Sorts values that do not fit in memory by merging sorted runs written to temporary files."""
+    iterator = iter(values)
+    with ExitStack() as stack:
+        runs = []
+        for run in iter(lambda: sorted(set(islice(iterator, DIGESTS_PER_RUN))), []):
+            fd = stack.enter_context(TemporaryFile("w+"))
+            fd.writelines(f"{value}\n" for value in run)
+            fd.seek(0)
+            runs.append(fd)
+
+        previous = None
+        for line in heapq.merge(*runs):
+            value = line.rstrip("\n")
+            if value != previous:
+                yield value
+            previous = value
+
+
+def reconcile_blobs(
+    ctx: click.Context, min_age: timedelta, remove: bool
+) -> ReconcileReport:
+    """Reports the blobs no source manifest refers to and the blobs missing for the manifests, removing the
+    unreferenced blobs if requested.
+
+    The digests referred to by the manifests are sorted on disk, so only a run of them is held in memory.
+    Blobs are shared between manifests, so an add storing a new manifest can start referring to an unreferenced blob.
+    The add refreshes the modification time of the blobs it reuses, so the blobs are checked again right before
+    they are removed and recently modified blobs are left alone.
+    """
+    # Without blobs there is no need to read the manifests.
+    if next(list_source_blobs(ctx), None) == None:
+        return ReconcileReport()
+
+    # Blobs reused by an add in progress can have been refreshed up to the refresh age before.
+    min_age = max(min_age, BLOB_REFRESH_AGE * 2)
+    cutoff = datetime.now(timezone.utc) - min_age
+
+    def remove_unused_blobs(ctx: click.Context, keys: Iterable[str]) -> None:
+        digests = [key[len(BLOB_PREFIX) :] for key in keys]
+        with ThreadPoolExecutor(
+            max_workers=ctx.obj["storage"]["transfer"].concurrency
+        ) as executor:
+            last_modified = list(
+                executor.map(
+                    lambda digest: get_source_blob_last_modified(ctx, digest), digests
+                )
+            )
+        remove_source_blobs(
+            ctx,
+            (
+                digest
+                for digest, modified in zip(digests, last_modified)
+                if modified and modified <= cutoff
+            ),
+        )
+
+    return _reconcile(
+        ctx,
+        "source blob",
+        _merge_join(
+            list_source_blobs(ctx), _sorted_unique(_referenced_blobs(ctx)), blob_key
+        ),
+        lambda digest: True,
+        blob_key,
+        remove_unused_blobs if remove else None,
+        min_age,
+    )
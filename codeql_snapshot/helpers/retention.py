@@ -0,0 +1,172 @@
+import click
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional, Sequence, List, Tuple
+from sqlalchemy import (
+    Engine,
+    Select,
+    ColumnElement,
+    select,
+    update,
+    delete,
+    func,
+    and_,
+    or_,
+)
+from sqlalchemy.orm import Session
+from codeql_snapshot.models import Snapshot, SnapshotState
+from codeql_snapshot.helpers.queue import database_utcnow
+from codeql_snapshot.helpers.object_store import (
+    remove_source_objects,
+    remove_database_objects,
+    remove_sarif_objects,
+)
+
+# Snapshots claimed by a worker are not deleted while its lease is valid, the worker would still upload their objects.
+# They can be deleted once the worker is done with them, or once the lease expired because the worker stopped. Objects
+# uploaded by a worker that merely fell behind are left for reconcile.
+IN_PROGRESS_STATES = [
+    SnapshotState.BUILD_IN_PROGRESS,
+    SnapshotState.ANALYSIS_IN_PROGRESS,
+]
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """Selects the snapshots to delete, which must match all the given criteria."""
+
+    global_ids: Sequence[str] = ()
+    project_url: Optional[str] = None
+    branch: Optional[str] = None
+    label: Optional[str] = None
+    states: Sequence[SnapshotState] = ()
+    # Only delete snapshots created longer ago.
+    older_than: Optional[timedelta] = None
+    # Keep this many of the most recent snapshots of every branch, language and category.
+    keep_last: Optional[int] = None
+
+    def is_empty(self) -> bool:
+        return (
+            not self.global_ids
+            and self.project_url == None
+            and self.branch == None
+            and self.label == None
+            and not self.states
+            and self.older_than == None
+            and self.keep_last == None
+        )
+
+
+def _is_deletable() -> ColumnElement[bool]:
+    return and_(
+        Snapshot.state != SnapshotState.DELETED,
+        or_(
+            Snapshot.state.not_in(IN_PROGRESS_STATES),
+            Snapshot.lease_expires_at == None,
+            Snapshot.lease_expires_at < database_utcnow(),
+        ),
+    )
+
+
+def select_deletable_snapshots(policy: RetentionPolicy) -> Select[Tuple[str]]:
+    stmt = select(Snapshot.global_id).where(_is_deletable())
+    if policy.global_ids:
+        stmt = stmt.where(Snapshot.global_id.in_(policy.global_ids))
+    if policy.project_url != None:
+        stmt = stmt.where(Snapshot.project_url == policy.project_url)
+    if policy.branch != None:
+        stmt = stmt.where(Snapshot.branch == policy.branch)
+    if policy.label != None:
+        stmt = stmt.where(Snapshot.label == policy.label)
+    if policy.states:
+        stmt = stmt.where(Snapshot.state.in_(policy.states))
+    if policy.older_than != None:
+        stmt = stmt.where(Snapshot.created_at < database_utcnow() - policy.older_than)
+    if policy.keep_last != None:
+        # Rank the snapshots of every branch from newest to oldest. The newest snapshots are kept, whatever their state.
+        ranked = select(
+            Snapshot.global_id,
+            func.row_number()
+            .over(
+                partition_by=(
+                    Snapshot.project_url,
+                    Snapshot.branch,
+                    Snapshot.language,
+                    Snapshot.category,
+                ),
+                order_by=Snapshot.created_at.desc(),
+            )
+            .label("rank"),
+        ).where(Snapshot.state != SnapshotState.DELETED)
+        if policy.project_url != None:
+            ranked = ranked.where(Snapshot.project_url == policy.project_url)
+        if policy.branch != None:
+            ranked = ranked.where(Snapshot.branch == policy.branch)
+        ranked_subquery = ranked.subquery()
+        stmt = stmt.join(
+            ranked_subquery, ranked_subquery.c.global_id == Snapshot.global_id
+        ).where(ranked_subquery.c.rank > policy.keep_last)
+    return stmt
+
+
+def mark_snapshots_deleted(engine: Engine, policy: RetentionPolicy) -> List[str]:
+    """Replaces the snapshots selected by the policy with tombstones and returns their ids.
+
+    Only the database is updated, so the transaction is short and does not hold locks that workers wait for. The
+    objects of the snapshots are removed later by `purge_deleted_snapshots`.
+    """
+    with Session(engine) as session, session.begin():
+        # The states are checked again on the updated rows, in case a worker claimed a snapshot in the meantime.
+        return list(
+            session.scalars(
+                update(Snapshot)
+                .where(_is_deletable())
+                .where(Snapshot.global_id.in_(select_deletable_snapshots(policy)))
+                .values(
+                    state=SnapshotState.DELETED,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+                .returning(Snapshot.global_id)
+                .execution_options(synchronize_session=False)
+            )
+        )
+
+
+def purge_deleted_snapshots(ctx: click.Context, batch: int = 1000) -> int:
+    """Removes the objects of a batch of deleted snapshots followed by their tombstones, and returns the number of
+    snapshots purged.
+
+    Concurrent purgers skip each other's batches. Source objects are only removed with the last snapshot referring
+    to them, so tombstones are purged in source order to keep the snapshots sharing a source in the same batch.
+    """
+    engine: Engine = ctx.obj["database"]["engine"]
+    with Session(engine) as session, session.begin():
+        rows = session.execute(
+            select(Snapshot.global_id, Snapshot.source_id)
+            .where(Snapshot.state == SnapshotState.DELETED)
+            .order_by(Snapshot.source_id)
+            .limit(batch)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            return 0
+
+        global_ids = {row.global_id for row in rows}
+        source_ids = {row.source_id for row in rows}
+        referenced_source_ids = set(
+            session.scalars(
+                select(Snapshot.source_id)
+                .where(Snapshot.source_id.in_(source_ids))
+                .where(Snapshot.global_id.not_in(global_ids))
+                .distinct()
+            )
+        )
+
+        remove_source_objects(ctx, source_ids - referenced_source_ids)
+        remove_database_objects(ctx, global_ids)
+        remove_sarif_objects(ctx, global_ids)
+
+        # Removed last, so the tombstones remain to retry the purge if removing the objects fails.
+        session.execute(delete(Snapshot).where(Snapshot.global_id.in_(global_ids)))
+        return len(rows)
@@ -0,0 +1,270 @@
+import json
+import re
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, TextIO, Tuple
+from sqlalchemy import Engine, select, insert, delete, literal
+from sqlalchemy.orm import Session
+from codeql_snapshot.models import Result
+
+# Number of characters read from a JSON document at a time.
+CHUNK_SIZE = 64 * 1024
+# Number of results inserted with a single statement.
+RESULTS_PER_INSERT = 1000
+
+# Path of a value in a JSON document, with "item" standing for any item of an array.
+JsonPath = Tuple[str, ...]
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _JsonReader:
+    """Reads the tokens and values of a JSON document from a text stream, holding only the unread part of the
+    current chunk and the value being decoded in memory."""
+
+    def __init__(self, fd: TextIO) -> None:
+        self.fd = fd
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size: int = CHUNK_SIZE) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fd.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Returns the next character that is not whitespace, without consuming it."""
+        while True:
+            match = _WHITESPACE.match(self.buffer, self.pos)
+            assert match
+            self.pos = match.end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document!")
+
+    def consume(self, expected: str) -> None:
+        found = self.peek()
+        if found != expected:
+            raise ValueError(
+                f"Expected '{expected}' but found '{found}' in JSON document!"
+            )
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        size = CHUNK_SIZE
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer can continue in the next chunk.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Read ever larger chunks, so a large value is not decoded over and over again.
+            self._fill(size)
+            size *= 2
+
+
+def _walk(
+    reader: _JsonReader, path: JsonPath, paths: Set[JsonPath]
+) -> Iterator[Tuple[JsonPath, Any]]:
+    if path in paths:
+        yield path, reader.value()
+        return
+
+    # Containers are walked instead of decoded, so values outside of the requested paths are never held in memory.
+    if reader.peek() == "{":
+        reader.consume("{")
+        if reader.peek() == "}":
+            reader.consume("}")
+            return
+        while True:
+            key = reader.value()
+            reader.consume(":")
+            yield from _walk(reader, path + (key,), paths)
+            if reader.peek() != ",":
+                break
+            reader.consume(",")
+        reader.consume("}")
+    elif reader.peek() == "[":
+        reader.consume("[")
+        if reader.peek() == "]":
+            reader.consume("]")
+            return
+        while True:
+            yield from _walk(reader, path + ("item",), paths)
+            if reader.peek() != ",":
+                break
+            reader.consume(",")
+        reader.consume("]")
+    else:
+        reader.value()
+
+
+def iter_json_values(
+    fd: TextIO, paths: Set[JsonPath]
+) -> Iterator[Tuple[JsonPath, Any]]:
+    """Yields the values at the given paths of a JSON document in document order, each decoded on its own."""
+    return _walk(_JsonReader(fd), (), paths)
+
+
+TOOL_PATH: JsonPath = ("runs", "item", "tool")
+RESULT_PATH: JsonPath = ("runs", "item", "results", "item")
+
+
+@dataclass(frozen=True)
+class _Rule:
+    id: Optional[str]
+    level: Optional[str]
+    security_severity: Optional[float]
+
+
+def _parse_rule(rule: Dict[str, Any]) -> _Rule:
+    security_severity = (rule.get("properties") or {}).get("security-severity")
+    try:
+        security_severity = (
+            float(security_severity) if security_severity != None else None
+        )
+    except ValueError:
+        security_severity = None
+    return _Rule(
+        rule.get("id"),
+        (rule.get("defaultConfiguration") or {}).get("level"),
+        security_severity,
+    )
+
+
+class _Rules:
+    """The rules of the tool of a run, referred to by results through their index or their id."""
+
+    def __init__(self, tool: Dict[str, Any]) -> None:
+        self.by_index: Dict[Tuple[Optional[int], int], _Rule] = {}
+        self.by_id: Dict[str, _Rule] = {}
+        # Rules of the driver have no component index, rules of query packs are rules of an extension.
+        components: List[Tuple[Optional[int], Dict[str, Any]]] = [
+            (None, tool.get("driver") or {})
+        ]
+        components += enumerate(tool.get("extensions") or [])
+        for component_index, component in components:
+            for rule_index, rule in enumerate(component.get("rules") or []):
+                parsed = _parse_rule(rule)
+                self.by_index[(component_index, rule_index)] = parsed
+                if parsed.id:
+                    self.by_id.setdefault(parsed.id, parsed)
+
+    def find(self, result: Dict[str, Any]) -> Optional[_Rule]:
+        reference = result.get("rule") or {}
+        rule_index = result.get("ruleIndex", reference.get("index"))
+        component_index = (reference.get("toolComponent") or {}).get("index")
+        if rule_index != None and (component_index, rule_index) in self.by_index:
+            return self.by_index[(component_index, rule_index)]
+        return self.by_id.get(result.get("ruleId") or reference.get("id"))
+
+
+def _fingerprint(result: Dict[str, Any]) -> Optional[str]:
+    partial_fingerprints = result.get("partialFingerprints") or {}
+    # Computed by CodeQL and GitHub code scanning to track alerts across commits.
+    if "primaryLocationLineHash" in partial_fingerprints:
+        return partial_fingerprints["primaryLocationLineHash"]
+    for fingerprints in [result.get("fingerprints"), partial_fingerprints]:
+        if fingerprints:
+            return fingerprints[min(fingerprints)]
+    return None
+
+
+def _parse_result(result: Dict[str, Any], rules: _Rules) -> Dict[str, Any]:
+    rule = rules.find(result)
+    locations = result.get("locations") or [{}]
+    physical_location = locations[0].get("physicalLocation") or {}
+    region = physical_location.get("region") or {}
+    return {
+        "rule_id": result.get("ruleId")
+        or (result.get("rule") or {}).get("id")
+        or (rule.id if rule else None)
+        or "",
+        "path": (physical_location.get("artifactLocation") or {}).get("uri"),
+        "start_line": region.get("startLine"),
+        "start_column": region.get("startColumn"),
+        "end_line": region.get("endLine", region.get("startLine")),
+        "end_column": region.get("endColumn"),
+        "fingerprint": _fingerprint(result),
+        # Warning is the default level of SARIF.
+        "level": result.get("level") or (rule.level if rule else None) or "warning",
+        "security_severity": rule.security_severity if rule else None,
+        "message": (result.get("message") or {}).get("text"),
+    }
+
+
+def iter_results(sarif: Path) -> Iterator[Dict[str, Any]]:
+    """Yields the columns of a result row for every result of a SARIF file, reading one result at a time.
+
+    The rules are read from the tool of a run, which precedes its results in the SARIF files produced by CodeQL.
+    """
+    rules = _Rules({})
+    with sarif.open("r", encoding="UTF-8") as fd:
+        for path, value in iter_json_values(fd, {TOOL_PATH, RESULT_PATH}):
+            if path == TOOL_PATH:
+                rules = _Rules(value)
+            else:
+                yield _parse_result(value, rules)
+
+
+def store_results(engine: Engine, snapshot_global_id: str, sarif: Path) -> int:
+    """Replaces the results of the snapshot with the results of its SARIF file, inserted in batches. Returns the
+    number of results stored."""
+    results = iter_results(sarif)
+    stored = 0
+    with Session(engine) as session, session.begin():
+        session.execute(
+            delete(Result).where(Result.snapshot_global_id == snapshot_global_id)
+        )
+        for batch in iter(lambda: list(islice(results, RESULTS_PER_INSERT)), []):
+            session.execute(
+                insert(Result),
+                [dict(row, snapshot_global_id=snapshot_global_id) for row in batch],
+            )
+            stored += len(batch)
+    return stored
+
+
+def copy_results(
+    engine: Engine, source_snapshot_global_id: str, snapshot_global_id: str
+) -> None:
+    """Replaces the results of the snapshot with the results of the source snapshot, within the database."""
+    columns = [
+        Result.rule_id,
+        Result.path,
+        Result.start_line,
+        Result.start_column,
+        Result.end_line,
+        Result.end_column,
+        Result.fingerprint,
+        Result.level,
+        Result.security_severity,
+        Result.message,
+    ]
+    with Session(engine) as session, session.begin():
+        session.execute(
+            delete(Result).where(Result.snapshot_global_id == snapshot_global_id)
+        )
+        session.execute(
+            insert(Result).from_select(
+                [Result.snapshot_global_id, *columns],
+                select(literal(snapshot_global_id), *columns).where(
+                    Result.snapshot_global_id == source_snapshot_global_id
+                ),
+            )
+        )
@@ -0,0 +1,152 @@
+import shutil
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from pathlib import Path
+from subprocess import Popen, PIPE
+from typing import IO, Iterator, Sequence, List
+from codeql_snapshot.helpers.archive import ArchiveFormat, zstd_compressor
+from codeql_snapshot.helpers.zip import ZipError, walk
+import os
+
+
+def _is_excluded(relative_path: str, exclude: Sequence[str]) -> bool:
+    # Patterns without a slash match an entry by name at any depth, like .gitignore patterns.
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(
+        fnmatchcase(relative_path, pattern) or fnmatchcase(name, pattern)
+        for pattern in exclude
+    )
+
+
+def _has_excluded_parent(relative_path: str, exclude: Sequence[str]) -> bool:
+    parts = relative_path.split("/")
+    return any(_is_excluded("/".join(parts[:i]), exclude) for i in range(1, len(parts)))
+
+
+def _walk_excluding(source_root: Path, exclude: Sequence[str]) -> Iterator[Path]:
+    for root, dirnames, filenames in os.walk(source_root):
+        relative_root = Path(root).relative_to(source_root).as_posix()
+        prefix = "" if relative_root == "." else relative_root + "/"
+        # Do not descend into excluded directories at all.
+        dirnames[:] = [
+            name for name in dirnames if not _is_excluded(prefix + name, exclude)
+        ]
+        for name in dirnames + filenames:
+            if not _is_excluded(prefix + name, exclude):
+                yield Path(root) / name
+
+
+def _git_files(source_root: Path) -> Iterator[str]:
+    # Tracked files and untracked files that are not ignored, the files `git status` considers part of the tree.
+    with Popen(
+        [
+            "git",
+            f"--git-dir={source_root / '.git'}",
+            f"--work-tree={source_root}",
+            "ls-files",
+            "-z",
+            "--cached",
+            "--others",
+            "--exclude-standard",
+        ],
+        stdout=PIPE,
+    ) as proc:
+        assert proc.stdout
+        remainder = b""
+        previous = None
+        for chunk in iter(lambda: proc.stdout.read(64 * 1024), b""):  # type: ignore
+            *names, remainder = (remainder + chunk).split(b"\0")
+            for name in names:
+                # Files with merge conflicts are listed once per stage.
+                if name != previous:
+                    yield os.fsdecode(name)
+                previous = name
+    if proc.returncode != 0:
+        raise ZipError(f"Failed to list the files of the git repository {source_root}!")
+
+
+def walk_source(
+    source_root: Path, exclude: Sequence[str] = (), gitignore: bool = False
+) -> Iterator[Path]:
+    """Yields the entries below the source root to archive, skipping the entries matching any of the exclude
+    patterns and, if requested, the files ignored by git."""
+    if not gitignore:
+        yield from _walk_excluding(source_root, exclude)
+        return
+
+    for relative_path in _git_files(source_root):
+        if _is_excluded(relative_path, exclude) or _has_excluded_parent(
+            relative_path, exclude
+        ):
+            continue
+        path = source_root / relative_path
+        # Tracked files can be deleted in the working tree.
+        if not os.path.lexists(path):
+            continue
+        yield path
+        if path.is_dir() and not path.is_symlink():
+            # A submodule is listed as a single entry, its files are part of the source.
+            for f in walk(path):
+                if not _is_excluded(f.relative_to(source_root).as_posix(), exclude):
+                    yield f
+
+
+def _exclude_pathspecs(exclude: Sequence[str]) -> List[str]:
+    # Wildcards in pathspecs also match slashes, so prefixing a pattern with */ matches it at any depth.
+    return [
+        pathspec
+        for pattern in exclude
+        for pathspec in [f":(exclude){pattern}", f":(exclude)*/{pattern}"]
+    ]
+
+
+@contextmanager
+def open_commit_archive(
+    source_root: Path, commit: str, args: Sequence[str], exclude: Sequence[str] = ()
+) -> Iterator[IO[bytes]]:
+    """Streams the git archive of the files tracked in a commit, created with the given git archive arguments."""
+    with Popen(
+        [
+            "git",
+            f"--git-dir={source_root / '.git'}",
+            "archive",
+            *args,
+            commit,
+            "--",
+            *_exclude_pathspecs(exclude),
+        ],
+        stdout=PIPE,
+    ) as proc:
+        assert proc.stdout
+        yield proc.stdout
+        # Drain what the caller did not read, so git does not fail on a closed pipe.
+        with open(os.devnull, "wb") as devnull:
+            shutil.copyfileobj(proc.stdout, devnull)
+    if proc.returncode != 0:
+        raise ZipError(f"Failed to archive commit {commit} of {source_root}!")
+
+
+def archive_commit_to_stream(
+    source_root: Path,
+    commit: str,
+    stream: IO[bytes],
+    format: ArchiveFormat,
+    exclude: Sequence[str] = (),
+) -> None:
+    """Writes the files tracked in a commit as an archive to a stream, reading them from the git object database
+    instead of the working tree."""
+    if format.codec == "zstd":
+        args = ["--format=tar"]
+    elif format.codec == "deflate":
+        args = ["--format=zip"] + ([f"-{format.level}"] if format.level != None else [])
+    elif format.codec == "stored":
+        args = ["--format=zip", "-0"]
+    else:
+        raise ZipError(f"Cannot create an archive with codec {format.codec}!")
+
+    with open_commit_archive(source_root, commit, args, exclude) as archive:
+        if format.codec == "zstd":
+            with zstd_compressor(format).stream_writer(stream, closefd=False) as writer:
+                shutil.copyfileobj(archive, writer, 1024 * 1024)
+        else:
+            shutil.copyfileobj(archive, stream, 1024 * 1024)
@@ -0,0 +1,367 @@
+import json
+from dataclasses import dataclass
+from minio import Minio
+from minio.datatypes import Part, Object
+from minio.error import S3Error
+from minio.helpers import MIN_PART_SIZE, MAX_MULTIPART_COUNT
+from urllib3.exceptions import HTTPError
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from threading import Lock, BoundedSemaphore
+from typing import Optional, Dict, List, Set, Callable, TypeVar, Any, Mapping
+from hashlib import md5
+import io
+import math
+import os
+
+T = TypeVar("T")
+
+DEFAULT_PART_SIZE = 64 * 1024 * 1024
+DEFAULT_CONCURRENCY = 8
+# Number of attempts for a single part before giving up on the whole transfer.
+PART_ATTEMPTS = 3
+
+
+@dataclass(frozen=True)
+class TransferOptions:
+    """Controls how objects are split into parts that are transferred concurrently.
+
+    At most `concurrency` parts are held in memory at the same time during an upload."""
+
+    part_size: int = DEFAULT_PART_SIZE
+    concurrency: int = DEFAULT_CONCURRENCY
+
+    def buffer_size(self) -> int:
+        """Returns the memory held by the parts of an upload at most."""
+        return max(self.part_size, MIN_PART_SIZE) * self.concurrency
+
+    def part_size_for(self, size: int) -> int:
+        # S3 does not accept parts smaller than 5 MiB, nor more than 10000 parts per object.
+        return max(self.part_size, MIN_PART_SIZE, math.ceil(size / MAX_MULTIPART_COUNT))
+
+
+def _retry(transfer: Callable[[], T]) -> T:
+    # The object store client already retries failed requests, but not a response that breaks off halfway.
+    attempt = 1
+    while True:
+        try:
+            return transfer()
+        except HTTPError:
+            if attempt == PART_ATTEMPTS:
+                raise
+            attempt += 1
+
+
+def _list_uploaded_parts(
+    client: Minio, bucket: str, key: str, upload_id: str
+) -> Optional[Dict[int, Part]]:
+    # None if the upload no longer exists, because it was completed or aborted in the meantime.
+    parts: Dict[int, Part] = {}
+    marker = None
+    while True:
+        try:
+            result = client._list_parts(
+                bucket, key, upload_id, part_number_marker=marker
+            )
+        except S3Error as err:
+            if err.code == "NoSuchUpload":
+                return None
+            raise err
+        parts.update((int(part.part_number), part) for part in result.parts)
+        if not result.is_truncated:
+            return parts
+        marker = result.next_part_number_marker
+
+
+def upload_file(
+    client: Minio,
+    bucket: str,
+    key: str,
+    path: Path,
+    options: TransferOptions,
+    metadata: Optional[Dict[str, str]] = None,
+    resume: bool = False,
+) -> None:
+    """Uploads a file as a multipart upload whose parts are uploaded concurrently.
+
+    A failed upload is aborted, so its parts are not left behind in the object store. With `resume`, the upload is
+    instead recorded next to the file until it completes and left behind when it fails, so the next upload of the
+    same file to the same key resumes it, skipping the parts that were already uploaded with the same content. This
+    only helps when the file has the same path across attempts. Uploads of the same key by other processes are never
+    resumed nor aborted.
+    """
+    size = path.stat().st_size
+    part_size = options.part_size_for(size)
+    if size <= part_size:
+        client.fput_object(
+            bucket, key, str(path), metadata=metadata, part_size=part_size
+        )
+        return
+
+    def read_part(part_number: int) -> bytes:
+        with path.open("rb") as fd:
+            fd.seek((part_number - 1) * part_size)
+            return fd.read(part_size)
+
+    def is_uploaded(part_number: int, data: bytes) -> bool:
+        # Without server side encryption the ETag of a part is the MD5 digest of its content.
+        existing = uploaded.get(part_number)
+        return existing != None and existing.etag.strip('"') == md5(data).hexdigest()
+
+    progress_path = path.with_name(f"{path.name}.upload")
+    # The metadata of the object was fixed when the upload was created, so only an upload with the same metadata can
+    # be resumed.
+    upload = {
+        "bucket": bucket,
+        "key": key,
+        "part_size": part_size,
+        "metadata": metadata or {},
+    }
+    upload_id: Optional[str] = None
+    uploaded: Dict[int, Part] = {}
+    if resume and progress_path.exists():
+        progress = json.loads(progress_path.read_text())
+        if {name: progress.get(name) for name in upload} == upload:
+            recorded = _list_uploaded_parts(client, bucket, key, progress["upload_id"])
+            if recorded != None:
+                upload_id, uploaded = progress["upload_id"], recorded
+    if not upload_id:
+        upload_id = client._create_multipart_upload(
+            bucket,
+            key,
+            {"Content-Type": "application/octet-stream", **(metadata or {})},
+        )
+        if resume:
+            progress_path.write_text(json.dumps({**upload, "upload_id": upload_id}))
+
+    def upload_part(part_number: int) -> Part:
+        data = read_part(part_number)
+        if is_uploaded(part_number, data):
+            return Part(part_number, uploaded[part_number].etag)
+
+        etag = _retry(
+            lambda: client._upload_part(bucket, key, data, None, upload_id, part_number)
+        )
+        return Part(part_number, etag)
+
+    try:
+        with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+            parts = list(
+                executor.map(upload_part, range(1, math.ceil(size / part_size) + 1))
+            )
+        client._complete_multipart_upload(bucket, key, upload_id, parts)
+    except BaseException:
+        if not resume:
+            client._abort_multipart_upload(bucket, key, upload_id)
+        raise
+    progress_path.unlink(missing_ok=True)
+
+
+def _download_range(
+    client: Minio, bucket: str, key: str, etag: str, fd: int, offset: int, length: int
+) -> None:
+    # Fail instead of mixing parts of different versions when the object is replaced during the download.
+    response = client.get_object(
+        bucket, key, offset, length, request_headers={"If-Match": etag}
+    )
+    try:
+        position = offset
+        for data in response.stream(amt=1024 * 1024):
+            os.pwrite(fd, data, position)
+            position += len(data)
+        if position != offset + length:
+            raise HTTPError(
+                f"Received {position - offset} of {length} bytes at offset {offset} of {key}!"
+            )
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def download_file(
+    client: Minio,
+    bucket: str,
+    key: str,
+    path: Path,
+    options: TransferOptions,
+    stat: Optional[Object] = None,
+    resume: bool = False,
+) -> Mapping[str, str]:
+    """Downloads an object with concurrent ranged requests and returns its metadata.
+
+    With `resume`, the completed parts are recorded next to the partial download and kept when the download fails,
+    so downloading the same object to the same path again resumes from the parts that were already downloaded. This
+    only helps when the path is the same across attempts, like the entries of the object cache. If the object was
+    already looked up, the download fails instead of downloading another version when the object was replaced in the
+    meantime.
+    """
+    if not stat:
+        stat = client.stat_object(bucket, key)
+    size: int = stat.size
+    part_size = options.part_size_for(size)
+    if size <= part_size:
+        client.fget_object(
+            bucket, key, str(path), request_headers={"If-Match": stat.etag}
+        )
+        return stat.metadata
+
+    partial_path = path.with_name(f"{path.name}.{stat.etag}.part")
+    progress_path = path.with_name(f"{path.name}.{stat.etag}.progress")
+    completed: Set[int] = set()
+    if resume and partial_path.exists() and progress_path.exists():
+        progress = json.loads(progress_path.read_text())
+        if progress["part_size"] == part_size:
+            completed.update(progress["parts"])
+    progress_lock = Lock()
+
+    fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT)
+    try:
+        os.ftruncate(fd, size)
+
+        def download_part(part_number: int) -> None:
+            if part_number in completed:
+                return
+            offset = (part_number - 1) * part_size
+            length = min(part_size, size - offset)
+            _retry(
+                lambda: _download_range(
+                    client, bucket, key, stat.etag, fd, offset, length
+                )
+            )
+            if resume:
+                with progress_lock:
+                    completed.add(part_number)
+                    progress_path.write_text(
+                        json.dumps({"part_size": part_size, "parts": sorted(completed)})
+                    )
+
+        with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+            list(executor.map(download_part, range(1, math.ceil(size / part_size) + 1)))
+    except BaseException:
+        if not resume:
+            partial_path.unlink()
+        raise
+    finally:
+        os.close(fd)
+
+    os.replace(partial_path, path)
+    progress_path.unlink(missing_ok=True)
+    return stat.metadata
+
+
+class ObjectWriter(io.RawIOBase):
+    """Writable stream that stores everything written to it as a single object.
+
+    Full parts are uploaded in the background while the caller keeps writing. Writing blocks while `concurrency`
+    parts are being uploaded, so memory use stays bounded regardless of the size of the object. The object is
+    created when the writer is closed, and nothing is stored when the with block exits with an exception.
+    """
+
+    def __init__(
+        self,
+        client: Minio,
+        bucket: str,
+        key: str,
+        options: TransferOptions,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.metadata = metadata or {}
+        # The size is not known up front, the default part size allows objects of up to 625 GiB.
+        self.part_size = max(options.part_size, MIN_PART_SIZE)
+        self.buffer = bytearray()
+        self.position = 0
+        self.upload_id: Optional[str] = None
+        self.uploads: List[Future[Part]] = []
+        self.slots = BoundedSemaphore(options.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=options.concurrency)
+
+    def __enter__(self) -> "ObjectWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *args: Any) -> None:
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data: Any) -> int:
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[: self.part_size]))
+            del self.buffer[: self.part_size]
+        return len(data)
+
+    def _upload_part(self, data: bytes) -> None:
+        if not self.upload_id:
+            self.upload_id = self.client._create_multipart_upload(
+                self.bucket,
+                self.key,
+                {"Content-Type": "application/octet-stream", **self.metadata},
+            )
+        upload_id = self.upload_id
+        part_number = len(self.uploads) + 1
+
+        def upload() -> Part:
+            try:
+                etag = _retry(
+                    lambda: self.client._upload_part(
+                        self.bucket, self.key, data, None, upload_id, part_number
+                    )
+                )
+                return Part(part_number, etag)
+            finally:
+                self.slots.release()
+
+        self.slots.acquire()
+        # Stop writing as soon as a part failed instead of finding out when the writer is closed.
+        for future in self.uploads:
+            if future.done() and future.exception():
+                self.slots.release()
+                future.result()
+        self.uploads.append(self.executor.submit(upload))
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if not self.upload_id:
+                # Small enough for a single request.
+                self.client.put_object(
+                    self.bucket,
+                    self.key,
+                    io.BytesIO(self.buffer),
+                    len(self.buffer),
+                    metadata=self.metadata,
+                )
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                parts = [future.result() for future in self.uploads]
+                self.client._complete_multipart_upload(
+                    self.bucket, self.key, self.upload_id, parts
+                )
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown()
+            super().close()
+
+    def abort(self) -> None:
+        if self.closed:
+            return
+        self.executor.shutdown(cancel_futures=True)
+        if self.upload_id:
+            self.client._abort_multipart_upload(self.bucket, self.key, self.upload_id)
+        super().close()
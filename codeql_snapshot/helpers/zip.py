@@ -1,12 +1,130 @@
 import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
 from pathlib import Path
+from typing import IO, Optional, Iterator, Iterable, Deque, Tuple
 import click
+import os
+
+# Files up to this size are read and compressed by the worker threads. Larger files are compressed while they are
+# written to the archive, so the memory use does not depend on the size of the files.
+MAX_BUFFERED_FILE_SIZE = 16 * 1024 * 1024
+# Number of compressed entries that can wait for their turn to be written, per worker thread.
+ENTRIES_PER_THREAD = 4
 
 
 class ZipError(Exception):
     pass
 
 
+def walk(source_dir: Path) -> Iterator[Path]:
+    # Yield the entries while walking, so the first files are compressed before the whole tree has been listed.
+    for root, dirnames, filenames in os.walk(source_dir):
+        for name in dirnames + filenames:
+            yield Path(root) / name
+
+
+def _compress(
+    path: Path, arcname: str, compression: int, compresslevel: Optional[int]
+) -> Optional[Tuple[zipfile.ZipInfo, bytes]]:
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    if zinfo.is_dir() or zinfo.file_size > MAX_BUFFERED_FILE_SIZE:
+        return None
+
+    data = path.read_bytes()
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    zinfo.compress_type = compression
+    if compression == zipfile.ZIP_DEFLATED:
+        # Raw deflate stream, the same as the zipfile module produces. zlib releases the GIL while compressing.
+        compressor = zlib.compressobj(
+            compresslevel if compresslevel != None else zlib.Z_DEFAULT_COMPRESSION,
+            zlib.DEFLATED,
+            -15,
+        )
+        data = compressor.compress(data) + compressor.flush()
+    zinfo.compress_size = len(data)
+    return zinfo, data
+
+
+def _write_compressed(zip: zipfile.ZipFile, zinfo: zipfile.ZipInfo, data: bytes):
+    # The sizes and CRC are known up front, so the local header is complete and no data descriptor is needed,
+    # also when the stream is not seekable.
+    assert zip.fp
+    zinfo.header_offset = zip.fp.tell()
+    zip._writecheck(zinfo)  # type: ignore
+    zip._didModify = True  # type: ignore
+    zip.fp.write(zinfo.FileHeader(False))
+    zip.fp.write(data)
+    zip.start_dir = zip.fp.tell()  # type: ignore
+    zip.filelist.append(zinfo)
+    zip.NameToInfo[zinfo.filename] = zinfo
+
+
+def zipdir_to_stream(
+    source_dir: Path,
+    stream: IO[bytes],
+    compression: int = zipfile.ZIP_STORED,
+    compresslevel: Optional[int] = None,
+    threads: Optional[int] = None,
+    entries: Optional[Iterable[Path]] = None,
+):
+    """Writes the entries below a directory as a zip archive to a stream, by default all of them."""
+    if not source_dir.is_dir():
+        raise ZipError(f"The provided source path {source_dir} is not a directory!")
+
+    if not threads:
+        threads = (
+            len(os.sched_getaffinity(0))
+            if hasattr(os, "sched_getaffinity")
+            else os.cpu_count() or 1
+        )
+
+    # The stream does not have to be seekable, so the archive can be written straight to the object store.
+    with zipfile.ZipFile(
+        stream, mode="w", compression=compression, compresslevel=compresslevel
+    ) as fd, ThreadPoolExecutor(max_workers=threads) as executor:
+        # Entries are compressed concurrently, but written in the order of the walk.
+        pending: Deque[
+            Tuple[Path, str, Future[Optional[Tuple[zipfile.ZipInfo, bytes]]]]
+        ] = deque()
+
+        def write_next():
+            f, arcname, compressed = pending.popleft()
+            try:
+                result = compressed.result()
+                if result:
+                    _write_compressed(fd, *result)
+                else:
+                    fd.write(str(f), arcname=arcname)
+            except ValueError as e:
+                raise ZipError(f"Failed to zip file {f} with error {e}")
+
+        try:
+            with click.progressbar(
+                entries if entries != None else walk(source_dir)
+            ) as files:
+                for f in files:
+                    arcname = str(f.relative_to(source_dir))
+                    pending.append(
+                        (
+                            f,
+                            arcname,
+                            executor.submit(
+                                _compress, f, arcname, compression, compresslevel
+                            ),
+                        )
+                    )
+                    if len(pending) >= threads * ENTRIES_PER_THREAD:
+                        write_next()
+            while pending:
+                write_next()
+        finally:
+            for _, _, compressed in pending:
+                compressed.cancel()
+
+
 def zipdir(source_dir: Path, zip_path: Path):
     if not source_dir.is_dir():
         raise ZipError(f"The provided source path {source_dir} is not a directory!")
@@ -17,10 +135,5 @@ def zipdir(source_dir: Path, zip_path: Path):
     if zip_path.suffix != ".zip":
         raise ZipError(f"The provided zip path doesn't end with '.zip'")
 
-    with zipfile.ZipFile(str(zip_path), mode="x") as fd:
-        with click.progressbar([p for p in source_dir.glob("**/*")]) as files:
-            for f in files:
-                try:
-                    fd.write(str(f), arcname=str(f.relative_to(source_dir)))
-                except ValueError as e:
-                    raise ZipError(f"Failed to zip file {f} with error {e}")
+    with zip_path.open(mode="xb") as stream:
+        zipdir_to_stream(source_dir, stream)
@@ -1,2 +1,3 @@
 from .base import Base
 from .snapshot import Snapshot, SnapshotState, SnapshotLanguage
+from .result import Result
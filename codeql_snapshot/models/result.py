@@ -0,0 +1,42 @@
+from sqlalchemy import BigInteger, Float, ForeignKey, String, Text, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from codeql_snapshot.models import Base
+from typing import Optional
+
+
+class Result(Base):
+    """An alert of the SARIF file of an analyzed snapshot, so alerts can be queried across snapshots without
+    downloading their SARIF files."""
+
+    __tablename__ = "results"
+    __table_args__ = (
+        Index("ix_results_snapshot_global_id", "snapshot_global_id"),
+        Index("ix_results_rule_id", "rule_id"),
+        Index("ix_results_fingerprint", "fingerprint"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, init=False)
+    # Results are replaced when their snapshot is analyzed again and removed when it is purged.
+    snapshot_global_id: Mapped[str] = mapped_column(
+        String(64), ForeignKey("snapshots.global_id", ondelete="CASCADE")
+    )
+    rule_id: Mapped[str] = mapped_column(String(255))
+    # Location of the first location of the result, a file relative to the source root.
+    path: Mapped[Optional[str]] = mapped_column(Text, nullable=True, default=None)
+    start_line: Mapped[Optional[int]] = mapped_column(nullable=True, default=None)
+    start_column: Mapped[Optional[int]] = mapped_column(nullable=True, default=None)
+    end_line: Mapped[Optional[int]] = mapped_column(nullable=True, default=None)
+    end_column: Mapped[Optional[int]] = mapped_column(nullable=True, default=None)
+    # Identifies the same alert in the results of other snapshots, even if the code around it moved.
+    fingerprint: Mapped[Optional[str]] = mapped_column(
+        String(255), nullable=True, default=None
+    )
+    # The SARIF level of the result, one of error, warning, note or none.
+    level: Mapped[Optional[str]] = mapped_column(
+        String(16), nullable=True, default=None
+    )
+    # The CVSS score of the rule for security queries.
+    security_severity: Mapped[Optional[float]] = mapped_column(
+        Float, nullable=True, default=None
+    )
+    message: Mapped[Optional[str]] = mapped_column(Text, nullable=True, default=None)
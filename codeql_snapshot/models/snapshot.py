@@ -1,9 +1,10 @@
-from sqlalchemy import String, Enum as SqlEnum
+from sqlalchemy import String, Text, Enum as SqlEnum, Index
 from sqlalchemy.orm import Mapped, mapped_column, validates
 from sqlalchemy.engine.default import DefaultExecutionContext
 from codeql_snapshot.models import Base
 from enum import Enum
 from typing import Any, Optional
+from datetime import datetime
 from codeql_snapshot.helpers.hash import sha256_hexdigest
 
 
@@ -16,6 +17,8 @@ class SnapshotState(Enum):
     ANALYSIS_FAILED = "ANALYSIS_FAILED"
     ANALYSIS_IN_PROGRESS = "ANALYSIS_IN_PROGRESS"
     ANALYZED = "ANALYZED"
+    # Tombstone of a deleted snapshot whose objects have not been purged from the object store yet.
+    DELETED = "DELETED"
 
 
 class SnapshotLanguage(Enum):
@@ -46,8 +49,23 @@ def get_source_id(context: DefaultExecutionContext) -> str:
     commit = context.get_current_parameters()["commit"]
     return sha256_hexdigest(f"{project_url}-{branch}-{commit}")
 
+# States in which a worker can claim a snapshot, either because it is waiting or because its lease can expire.
+CLAIMABLE_STATES = [
+    SnapshotState.NOT_BUILT,
+    SnapshotState.BUILD_IN_PROGRESS,
+    SnapshotState.BUILD_FAILED,
+    SnapshotState.NOT_ANALYZED,
+    SnapshotState.ANALYSIS_IN_PROGRESS,
+    SnapshotState.ANALYSIS_FAILED,
+]
+
 class Snapshot(Base):
     __tablename__ = "snapshots"
+    __table_args__ = (
+        Index("ix_snapshots_source_id", "source_id"),
+        Index("ix_snapshots_project_url_branch_commit", "project_url", "branch", "commit"),
+        Index("ix_snapshots_commit_language", "commit", "language"),
+    )
 
     global_id: Mapped[str] = mapped_column(String(64), default=get_global_id, init=False, primary_key=True)
     source_id: Mapped[str] = mapped_column(String(64), default=get_source_id, init=False)
@@ -63,6 +81,17 @@ class Snapshot(Base):
     state: Mapped[SnapshotState] = mapped_column(
         SqlEnum(SnapshotState), default=SnapshotState.NOT_BUILT
     )
+    # Identifies the worker holding an in-progress snapshot. Snapshots whose lease expired can be claimed by other workers.
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, init=False, default=None)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(nullable=True, init=False, default=None)
+    # Snapshots with a higher priority are claimed first.
+    priority: Mapped[int] = mapped_column(default=0, server_default="0")
+    # How the database was built, so it can be reused for snapshots of the same commit on other branches.
+    # Unknown for databases built before it was recorded, which are never reused.
+    build_command: Mapped[Optional[str]] = mapped_column(Text, nullable=True, init=False, default=None)
+    # Identifies the database, CodeQL version and query packs the stored results were produced with, so an unchanged
+    # analysis is not repeated.
+    analysis_fingerprint: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, init=False, default=None)
 
     @validates("global_id", "source_id", "project_url", "branch", "commit", "language", "category")
     def ensure_write_once(self, key: str, value: Any) -> Any:
@@ -70,3 +99,30 @@ class Snapshot(Base):
         if existing:
             raise ValueError(f"The field {key} should not be updated!")
         return value
+
+
+# Partial indexes for the claim queries, which only look at the small fraction of snapshots that still require work.
+# They match the claim order, so the first snapshots in priority order can be read without sorting.
+Index(
+    "ix_snapshots_claim_priority",
+    Snapshot.label,
+    Snapshot.state,
+    Snapshot.priority.desc(),
+    Snapshot.created_at,
+    postgresql_where=Snapshot.state.in_(CLAIMABLE_STATES),
+)
+Index(
+    "ix_snapshots_claim_fair_share",
+    Snapshot.label,
+    Snapshot.state,
+    Snapshot.project_url,
+    Snapshot.priority.desc(),
+    Snapshot.created_at,
+    postgresql_where=Snapshot.state.in_(CLAIMABLE_STATES),
+)
+# Tombstones are purged in batches of snapshots sharing a source, so the source object can be removed with them.
+Index(
+    "ix_snapshots_deleted",
+    Snapshot.source_id,
+    postgresql_where=Snapshot.state == SnapshotState.DELETED,
+)
@@ -0,0 +1,89 @@
+"""Compare the archive codecs on representative source trees or CodeQL databases.
+
+Reports for every codec the archive size, the compression ratio, and the compression and decompression throughput
+relative to the size of the uncompressed tree. Use the results to pick the --source-compression and
+--database-compression options.
+"""
+
+import click
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Tuple
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from codeql_snapshot.helpers.archive import (
+    ArchiveFormat,
+    archive_dir,
+    extract_archive,
+)
+
+DEFAULT_CODECS = [
+    "stored",
+    "deflate:1",
+    "deflate:6",
+    "deflate:9",
+    "zstd:1",
+    "zstd:3",
+    "zstd:9",
+    "zstd:19",
+]
+
+
+def tree_size(root: Path) -> int:
+    return sum(f.stat().st_size for f in root.glob("**/*") if f.is_file())
+
+
+@click.command()
+@click.option(
+    "--codec",
+    "codecs",
+    multiple=True,
+    default=DEFAULT_CODECS,
+    help="Codec to compare, optionally followed by a level. Can be repeated.",
+)
+@click.argument(
+    "trees",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, path_type=Path, file_okay=False),
+)
+def main(codecs: Tuple[str, ...], trees: Tuple[Path, ...]) -> None:
+    formats = [ArchiveFormat.parse(codec) for codec in codecs]
+    for format in formats:
+        try:
+            format.validate()
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--codec")
+
+    for tree in trees:
+        size = tree_size(tree)
+        click.echo(f"{tree} ({size / 1024 / 1024:.1f} MiB)")
+        click.echo(
+            f"{'codec':<12} {'size MiB':>10} {'ratio':>7} {'compress MiB/s':>15} {'decompress MiB/s':>17}"
+        )
+        for format in formats:
+            with TemporaryDirectory() as tmpdir:
+                archive_path = Path(tmpdir) / f"archive{format.suffix}"
+                start = perf_counter()
+                archive_dir(tree, archive_path, format)
+                compress_time = perf_counter() - start
+
+                target_dir = Path(tmpdir) / "extracted"
+                target_dir.mkdir()
+                start = perf_counter()
+                extract_archive(archive_path, target_dir, format)
+                decompress_time = perf_counter() - start
+
+                archive_size = archive_path.stat().st_size
+                click.echo(
+                    f"{str(format):<12} {archive_size / 1024 / 1024:>10.1f} {size / max(archive_size, 1):>7.2f} "
+                    f"{size / 1024 / 1024 / compress_time:>15.1f} {size / 1024 / 1024 / decompress_time:>17.1f}"
+                )
+        click.echo()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Check that the snapshot claim queries use the snapshot indexes on a large snapshots table.
+
+Fills the snapshots table of the database referenced by CODEQL_SNAPSHOT_CONNECTION_STRING with synthetic snapshots,
+prints the plan and execution time of the claim queries, and fails if any of them falls back to a sequential scan.
+Everything happens in a single transaction that is rolled back, so the database is left untouched.
+"""
+
+import click
+from sqlalchemy import create_engine, text, select, func, Connection
+from sqlalchemy.dialects import postgresql
+from pathlib import Path
+from time import perf_counter
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from codeql_snapshot.models import Snapshot, SnapshotState
+from codeql_snapshot.helpers.queue import (
+    select_claimable_snapshots,
+    select_expired_snapshots,
+    select_reusable_snapshot,
+)
+
+# Most snapshots in a long-lived deployment are done, only a small fraction still requires work.
+POPULATE_SNAPSHOTS = """
+INSERT INTO snapshots (global_id, source_id, project_url, branch, commit, language, state, label, priority, created_at, updated_at)
+SELECT
+    md5('global-' || i) || md5('global-' || i || '-2'),
+    md5('source-' || (i / 4)) || md5('source-' || (i / 4) || '-2'),
+    'https://example.com/project-' || (i % 1000),
+    'branch-' || (i % 20),
+    substr(md5('commit-' || (i / 4)) || md5('commit-' || (i / 4) || '-2'), 1, 40),
+    (ARRAY['JAVA', 'CPP', 'JAVASCRIPT', 'PYTHON'])[1 + i % 4]::snapshotlanguage,
+    CASE
+        WHEN i % 1000 = 0 THEN 'NOT_BUILT'
+        WHEN i % 1000 = 1 THEN 'BUILD_IN_PROGRESS'
+        WHEN i % 1000 = 2 THEN 'NOT_ANALYZED'
+        WHEN i % 1000 = 3 THEN 'ANALYSIS_IN_PROGRESS'
+        WHEN i % 1000 < 10 THEN 'BUILD_FAILED'
+        WHEN i % 1000 < 20 THEN 'ANALYSIS_FAILED'
+        ELSE 'ANALYZED'
+    END::snapshotstate,
+    CASE WHEN (i / 1000) % 2 = 0 THEN NULL ELSE 'label-' || ((i / 1000) % 10) END,
+    i % 3,
+    now(),
+    now()
+FROM generate_series(1, :rows) AS i
+"""
+
+
+def explain(connection: Connection, description: str, stmt) -> bool:
+    sql = str(
+        stmt.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+    start = perf_counter()
+    plan = "\n".join(
+        row[0] for row in connection.execute(text(f"EXPLAIN ANALYZE {sql}"))
+    )
+    elapsed = perf_counter() - start
+
+    uses_index = "Seq Scan on snapshots" not in plan
+    click.echo(
+        f"{'OK' if uses_index else 'FAIL'} {description} ({elapsed * 1000:.1f} ms)"
+    )
+    click.echo(plan)
+    click.echo()
+    return uses_index
+
+
+@click.command()
+@click.option("--connection-string", required=True)
+@click.option("--rows", type=click.IntRange(min=1), default=1_000_000)
+def main(connection_string: str, rows: int) -> None:
+    engine = create_engine(connection_string)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            click.echo(f"Adding {rows} snapshots.")
+            connection.execute(text(POPULATE_SNAPSHOTS), {"rows": rows})
+            connection.execute(text("ANALYZE snapshots"))
+
+            queries = [
+                (
+                    "claim build without label",
+                    select_claimable_snapshots(SnapshotState.NOT_BUILT, None),
+                ),
+                (
+                    "claim build with label",
+                    select_claimable_snapshots(
+                        SnapshotState.NOT_BUILT, "label-1", batch=50
+                    ),
+                ),
+                (
+                    "claim build with fair share",
+                    select_claimable_snapshots(
+                        SnapshotState.NOT_BUILT, None, batch=50, fair_share=True
+                    ),
+                ),
+                (
+                    "claim build retry",
+                    select_claimable_snapshots(SnapshotState.BUILD_FAILED, None),
+                ),
+                (
+                    "reclaim expired build",
+                    select_expired_snapshots(
+                        SnapshotState.BUILD_IN_PROGRESS, None, batch=50
+                    ),
+                ),
+                (
+                    "claim analysis",
+                    select_claimable_snapshots(
+                        SnapshotState.NOT_ANALYZED, "label-3", batch=50
+                    ),
+                ),
+                (
+                    "reusable database lookup",
+                    select_reusable_snapshot("0" * 64, "autobuild"),
+                ),
+                (
+                    "source reference count",
+                    select(func.count())
+                    .select_from(Snapshot)
+                    .where(Snapshot.source_id == "0" * 64),
+                ),
+                (
+                    "snapshot lookup by project, branch and commit",
+                    select(Snapshot)
+                    .where(Snapshot.project_url == "https://example.com/project-1")
+                    .where(Snapshot.branch == "branch-1")
+                    .where(Snapshot.commit == "0" * 40),
+                ),
+            ]
+            results = [explain(connection, *query) for query in queries]
+        finally:
+            transaction.rollback()
+
+    if not all(results):
+        raise click.ClickException("Not all queries use an index!")
+
+
+if __name__ == "__main__":
+    main(auto_envvar_prefix="CODEQL_SNAPSHOT")
@@ -0,0 +1,93 @@
+"""Compare running short CodeQL commands in a process of their own with running them on a CodeQL CLI server.
+
+Reports for every command the median and mean duration under both backends, and the time it takes to start a CLI
+server. Use the results to decide on the --codeql-cli-server option.
+"""
+
+import click
+import shlex
+import subprocess
+from pathlib import Path
+from statistics import mean, median
+from time import perf_counter
+from typing import Callable, List, Tuple
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from codeql_snapshot.helpers.codeql import CliServerPool
+
+DEFAULT_COMMANDS = [
+    "version --format=json",
+    "resolve languages --format=json",
+]
+
+
+def measure(
+    run: Callable[[], subprocess.CompletedProcess[str]], repeat: int
+) -> List[float]:
+    durations = []
+    for _ in range(repeat):
+        start = perf_counter()
+        cp = run()
+        durations.append(perf_counter() - start)
+        if cp.returncode != 0:
+            raise click.ClickException(f"Failed to run {cp.args}:\n{cp.stderr}")
+    return durations
+
+
+@click.command()
+@click.option(
+    "--command",
+    "commands",
+    multiple=True,
+    default=DEFAULT_COMMANDS,
+    help="CodeQL command to run, without the codeql executable. Can be repeated.",
+)
+@click.option(
+    "--repeat",
+    type=click.IntRange(min=1),
+    default=10,
+    help="Number of times every command is run under each backend.",
+)
+def main(commands: Tuple[str, ...], repeat: int) -> None:
+    pool = CliServerPool()
+    try:
+        start = perf_counter()
+        # Starts a server, which includes running its first command.
+        if not pool.run(["version", "--format=json"]):
+            raise click.ClickException("Failed to start a CodeQL CLI server!")
+        click.echo(f"Started CLI server in {perf_counter() - start:.2f}s")
+
+        click.echo(
+            f"{'command':<40} {'backend':<10} {'median s':>9} {'mean s':>9} {'speedup':>8}"
+        )
+        for command in commands:
+            args = shlex.split(command)
+            process_durations = measure(
+                lambda: subprocess.run(
+                    ["codeql"] + args, capture_output=True, text=True
+                ),
+                repeat,
+            )
+
+            def run_on_server() -> subprocess.CompletedProcess[str]:
+                cp = pool.run(args)
+                if not cp:
+                    raise click.ClickException("The CodeQL CLI server is unavailable!")
+                return cp
+
+            server_durations = measure(run_on_server, repeat)
+
+            click.echo(
+                f"{command:<40} {'process':<10} {median(process_durations):>9.3f} {mean(process_durations):>9.3f}"
+            )
+            click.echo(
+                f"{'':<40} {'server':<10} {median(server_durations):>9.3f} {mean(server_durations):>9.3f} {median(process_durations) / median(server_durations):>7.1f}x"
+            )
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()